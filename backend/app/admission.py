@@ -0,0 +1,236 @@
+"""
+Admission control per gli endpoint costosi.
+
+Dashboard Athena, `/downtimes?cliente=` e le scritture massive passano da
+pool con un limite di concorrenza e una coda limitata. In coda le richieste
+"interactive" hanno precedenza sulle "bulk"; quando la coda è piena una
+richiesta interattiva può scalzare l'ultima bulk in attesa, altrimenti si
+risponde subito 429 con `Retry-After`. Gli endpoint leggeri (health,
+metrics, connection-test, liste in cache) non vengono mai accodati.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from starlette.responses import JSONResponse
+
+from .shared_cache import per_worker
+
+logger = logging.getLogger("checkmk_api")
+
+# --- CONFIGURAZIONE ---
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+ADMISSION_MAX_RETRY_AFTER = int(os.getenv("ADMISSION_MAX_RETRY_AFTER", "60"))
+# Header con cui il client può dichiararsi "bulk" (mai promuoversi a interactive)
+PRIORITY_HEADER = b"x-request-priority"
+
+PRIORITIES = {"interactive": 0, "bulk": 1}
+
+# Pool: nome -> (concorrenza, posti in coda) di default, sovrascrivibili con
+# ADMISSION_<NOME>_CONCURRENCY e ADMISSION_<NOME>_QUEUE (totali dell'istanza,
+# ripartiti tra i worker uvicorn)
+POOL_DEFAULTS = {
+    "athena": (4, 20),
+    "checkmk_read": (4, 20),
+    "checkmk_write": (4, 10),
+}
+
+# Regole: (metodo, path, pool, classe di default, parametro di query richiesto)
+ROUTE_RULES = [
+    ("POST", r"/api/cloudconnexa/(dashboard|security|timeline|users/.+)", "athena", "interactive", None),
+    ("GET", r"/api/cloudconnexa/customers", "athena", "interactive", None),
+    ("POST", r"/api/sap/(dashboard|timeline|sids)", "athena", "interactive", None),
+    ("GET", r"/api/sap/clients", "athena", "interactive", None),
+    ("POST", r"/api/logs/.+", "athena", "bulk", None),
+    ("GET", r"/api/downtimes", "checkmk_read", "interactive", "cliente"),
+    ("POST", r"/api/downtimes/delete-batch", "checkmk_write", "interactive", None),
+    ("POST", r"/api/schedule", "checkmk_write", "bulk", None),
+    ("POST", r"/api/downtimes/delete-by-filter", "checkmk_write", "bulk", None),
+]
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionPool:
+    """Semaforo con coda limitata e ordinata per priorità (poi per arrivo)."""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future, str]] = []
+        self._seq = itertools.count()
+        self.queued = {name: 0 for name in PRIORITIES}
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "evicted": 0, "timeout": 0}
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.avg_service: Optional[float] = None   # media mobile della durata delle richieste
+
+    def retry_after(self) -> int:
+        """Stima (secondi) di quando si libererà un posto, dalla durata media delle richieste."""
+        service = self.avg_service or 1.0
+        waiting = sum(self.queued.values()) + 1
+        return max(1, min(ADMISSION_MAX_RETRY_AFTER, math.ceil(service * waiting / self.max_concurrent)))
+
+    def _live_waiters(self):
+        return [w for w in self._waiters if not w[2].done()]
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        return AdmissionRejected(reason, self.retry_after())
+
+    async def acquire(self, priority_class: str):
+        if self.active < self.max_concurrent and not self._live_waiters():
+            self.active += 1
+            self.admitted += 1
+            return
+
+        priority = PRIORITIES[priority_class]
+        if sum(self.queued.values()) >= self.max_queue:
+            # Coda piena: si può scalzare solo un'attesa di priorità inferiore (la più recente)
+            victim = max(self._live_waiters(), key=lambda w: (w[0], w[1]), default=None)
+            if victim is None or victim[0] <= priority:
+                raise self._reject("queue_full")
+            self.queued[victim[3]] -= 1
+            victim[2].set_exception(self._reject("evicted"))
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future, priority_class)
+        heapq.heappush(self._waiters, entry)
+        self.queued[priority_class] += 1
+        start_time = time.monotonic()
+        try:
+            await asyncio.wait({future}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # Client disconnesso mentre era in coda
+            self._leave(entry)
+            raise
+        if not future.done():
+            self._leave(entry)
+            raise self._reject("timeout")
+        # Risultato (slot assegnato) oppure AdmissionRejected se scalzata
+        future.result()
+        wait = time.monotonic() - start_time
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.admitted += 1
+
+    def _leave(self, entry):
+        future = entry[2]
+        if future.done() and not future.cancelled() and future.exception() is None:
+            # Lo slot era già stato assegnato: lo restituiamo
+            self.release()
+        elif not future.done():
+            future.cancel()
+            self.queued[entry[3]] -= 1
+
+    def release(self, duration: Optional[float] = None):
+        if duration is not None:
+            self.avg_service = duration if self.avg_service is None else 0.8 * self.avg_service + 0.2 * duration
+        self.active -= 1
+        while self._waiters:
+            _, _, future, priority_class = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.queued[priority_class] -= 1
+            self.active += 1
+            future.set_result(True)
+            break
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": dict(self.queued),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_wait": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+            "max_wait": round(self.max_wait, 4),
+            "avg_service": round(self.avg_service, 4) if self.avg_service is not None else None,
+        }
+
+
+class AdmissionController:
+    def __init__(self, pool_defaults: Dict[str, Tuple[int, int]], rules):
+        self.pools = {
+            name: AdmissionPool(
+                name,
+                per_worker(int(os.getenv(f"ADMISSION_{name.upper()}_CONCURRENCY", str(concurrency)))),
+                per_worker(int(os.getenv(f"ADMISSION_{name.upper()}_QUEUE", str(queue)))),
+                ADMISSION_QUEUE_TIMEOUT,
+            )
+            for name, (concurrency, queue) in pool_defaults.items()
+        }
+        self.rules = [(method, re.compile(path + "/?"), pool, klass, param) for method, path, pool, klass, param in rules]
+
+    def match(self, method: str, path: str, query_string: bytes) -> Optional[Tuple[AdmissionPool, str]]:
+        for rule_method, pattern, pool, klass, param in self.rules:
+            if rule_method != method or not pattern.fullmatch(path):
+                continue
+            if param and not parse_qs(query_string.decode("latin-1")).get(param):
+                continue
+            return self.pools[pool], klass
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": ADMISSION_ENABLED, "pools": {name: pool.stats() for name, pool in self.pools.items()}}
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI: applica i pool alle rotte configurate in ROUTE_RULES."""
+
+    def __init__(self, app, controller: "AdmissionController" = None):
+        self.app = app
+        self.controller = controller or admission_controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_ENABLED:
+            return await self.app(scope, receive, send)
+        matched = self.controller.match(scope["method"], scope["path"], scope.get("query_string", b""))
+        if matched is None:
+            return await self.app(scope, receive, send)
+
+        pool, priority_class = matched
+        requested = dict(scope.get("headers") or []).get(PRIORITY_HEADER, b"").decode("latin-1").lower()
+        if requested == "bulk":
+            priority_class = "bulk"
+
+        try:
+            await pool.acquire(priority_class)
+        except AdmissionRejected as e:
+            logger.warning(f"[Admission] {scope['method']} {scope['path']} rejected ({pool.name}, {priority_class}): "
+                           f"{e.reason}, retry after {e.retry_after}s")
+            response = JSONResponse(
+                {"detail": f"Server busy ({pool.name}): {e.reason}. Retry later."},
+                status_code=429,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            return await response(scope, receive, send)
+
+        start_time = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            pool.release(time.monotonic() - start_time)
+
+
+# Controller condiviso dal middleware e da /metrics
+admission_controller = AdmissionController(POOL_DEFAULTS, ROUTE_RULES)
@@ -1,7 +1,18 @@
+import asyncio
 import boto3
-import time
+import codecs
+import csv
+import itertools
+import logging
 import os
-from typing import List, Dict, Any
+import time
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+
+from .athena_cache import athena_cache, result_reuse_configuration, ATHENA_RESULT_REUSE_MINUTES
+from .athena_decode import ColumnarResult, ResultDecoder, empty_columns
+from .deadline import DeadlineExceeded, current_deadline, set_deadline
+
+logger = logging.getLogger("checkmk_api")
 
 # --- CONFIGURAZIONE ---
 # Recupera le variabili d'ambiente o usa valori di default
@@ -9,6 +20,17 @@ ATHENA_DB = os.getenv("ATHENA_DB", "cloudconnexa_logs_db")
 ATHENA_OUTPUT_BUCKET = os.getenv("ATHENA_RESULTS_BUCKET", "tuo-bucket-athena-results")
 ATHENA_WORKGROUP = os.getenv("ATHENA_WORKGROUP", "primary")
 AWS_REGION = os.getenv("AWS_REGION", "eu-central-1")
+# Polling adattivo: primo controllo dopo ATHENA_POLL_MIN secondi, poi sempre più
+# distanziati (fino a ATHENA_POLL_MAX) in proporzione alla durata della query
+ATHENA_POLL_MIN = float(os.getenv("ATHENA_POLL_MIN", "0.2"))
+ATHENA_POLL_MAX = float(os.getenv("ATHENA_POLL_MAX", "2"))
+ATHENA_POLL_BACKOFF = float(os.getenv("ATHENA_POLL_BACKOFF", "1.5"))
+ATHENA_POLL_ELAPSED_RATIO = 0.2
+# Righe per chiamata GetQueryResults (massimo consentito da Athena: 1000)
+ATHENA_PAGE_SIZE = 1000
+# Oltre queste righe il resto del risultato si legge direttamente dal CSV su S3
+# (molto più veloce di GetQueryResults per decine di migliaia di righe); 0 = mai
+ATHENA_S3_RESULTS_THRESHOLD = int(os.getenv("ATHENA_S3_RESULTS_THRESHOLD", "1000"))
 
 # --- WHITELIST CAMPI (Per sicurezza) ---
 # Replica la logica di configurazione del vecchio progetto per evitare SQL Injection
@@ -23,8 +45,23 @@ FIELDS_CONFIG = {
     ]
 }
 
+_client = None
+_s3_client = None
+
+
 def get_athena_client():
-    return boto3.client('athena', region_name=AWS_REGION)
+    """Client boto3 condiviso (thread-safe): crearne uno per query costa decine di ms."""
+    global _client
+    if _client is None:
+        _client = boto3.client('athena', region_name=AWS_REGION)
+    return _client
+
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3', region_name=AWS_REGION)
+    return _s3_client
 
 def build_dynamic_query(log_type: str, filters: List[Dict], select_fields: List[str]) -> str:
     """Costruisce una query SQL sicura basata sui filtri."""
@@ -64,54 +101,443 @@ def build_dynamic_query(log_type: str, filters: List[Dict], select_fields: List[
     query = f"SELECT {select_clause} FROM extracted_logs WHERE {where_clause} ORDER BY timestamp DESC LIMIT 1000"
     return query
 
-def run_athena_query(query_string: str):
-    """Esegue la query su Athena e attende i risultati."""
+class AthenaProfile:
+    """
+    Profilo di esecuzione di un carico di lavoro: database, workgroup e
+    destinazione dei risultati, più i limiti applicati dal runner (query
+    contemporanee, età massima per il riuso dei risultati, byte scansionati).
+    """
+
+    def __init__(self, name: str, database: str, workgroup: str, output_location: str, max_concurrency: int,
+                 result_reuse_minutes: int, scan_budget_mb: int, timeout: float):
+        prefix = f"ATHENA_PROFILE_{name.upper().replace('-', '_')}_"
+        self.name = name
+        self.database = os.getenv(prefix + "DATABASE", database)
+        self.workgroup = os.getenv(prefix + "WORKGROUP", workgroup)
+        # Vuoto = si usa la destinazione configurata nel workgroup
+        self.output_location = os.getenv(prefix + "OUTPUT", output_location)
+        self.max_concurrency = max(1, int(os.getenv(prefix + "CONCURRENCY", str(max_concurrency))))
+        self.result_reuse_minutes = int(os.getenv(prefix + "REUSE_MINUTES", str(result_reuse_minutes)))
+        # Oltre questo volume scansionato la query viene fermata (0 = nessun limite)
+        self.scan_budget = int(os.getenv(prefix + "SCAN_BUDGET_MB", str(scan_budget_mb))) * 1024 * 1024
+        # Durata massima di un'esecuzione (secondi), anche senza una richiesta HTTP che attende
+        self.timeout = float(os.getenv(prefix + "TIMEOUT", str(timeout)))
+        self.running = 0
+        self.executions = 0
+        self.bytes_scanned = 0
+        self.stopped = {"cancelled": 0, "deadline": 0, "timeout": 0, "scan_budget": 0}
+        self.stopped_bytes_scanned = 0
+        self._slots: Optional[Tuple[Any, asyncio.Semaphore]] = None
+
+    def slot(self) -> asyncio.Semaphore:
+        """Semaforo del profilo, ricreato se cambia l'event loop (es. nei test)."""
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots[0] is not loop:
+            self._slots = (loop, asyncio.Semaphore(self.max_concurrency))
+        return self._slots[1]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "database": self.database,
+            "workgroup": self.workgroup,
+            "max_concurrency": self.max_concurrency,
+            "running": self.running,
+            "executions": self.executions,
+            "bytes_scanned": self.bytes_scanned,
+            "stopped": dict(self.stopped),
+            "stopped_bytes_scanned": self.stopped_bytes_scanned,
+        }
+
+
+_DEFAULT_OUTPUT = f"s3://{ATHENA_OUTPUT_BUCKET}/query_results/"
+
+# Ogni carico ha il suo pool: la dashboard SAP non resta in coda dietro CloudConnexa e viceversa
+ATHENA_PROFILES = {
+    profile.name: profile for profile in (
+        AthenaProfile("cloudconnexa", ATHENA_DB, ATHENA_WORKGROUP, _DEFAULT_OUTPUT, 10, ATHENA_RESULT_REUSE_MINUTES, 0, 300),
+        AthenaProfile("sap", os.getenv("SAP_ATHENA_DB", "sap_reports_db"),
+                      os.getenv("SAP_ATHENA_WORKGROUP", "ReportCheckSistemiSap"),
+                      os.getenv("SAP_ATHENA_OUTPUT") or _DEFAULT_OUTPUT, 6, ATHENA_RESULT_REUSE_MINUTES, 0, 300),
+        # Ricerca libera nei log: risultati sempre freschi e scansioni limitate
+        AthenaProfile("logs-search", ATHENA_DB, ATHENA_WORKGROUP, _DEFAULT_OUTPUT, 2, 0, 10240, 600),
+    )
+}
+
+
+def get_profile(profile: str) -> AthenaProfile:
+    try:
+        return ATHENA_PROFILES[profile]
+    except KeyError:
+        raise ValueError(f"Profilo Athena sconosciuto: {profile}")
+
+
+def _poll_delay(stats: Dict[str, Any], attempt: int) -> float:
+    """
+    Attesa prima del prossimo controllo: breve all'inizio (le query piccole
+    finiscono in meno di un secondo), poi crescente. Per le query in
+    esecuzione da tempo si attende una frazione del tempo già trascorso,
+    usando le statistiche che Athena restituisce a ogni polling.
+    """
+    backoff = ATHENA_POLL_MIN * (ATHENA_POLL_BACKOFF ** attempt)
+    status = stats['QueryExecution']['Status']['State']
+    statistics = stats['QueryExecution'].get('Statistics', {})
+    if status == 'QUEUED':
+        elapsed = statistics.get('QueryQueueTimeInMillis', 0) / 1000
+    else:
+        elapsed = statistics.get('EngineExecutionTimeInMillis', 0) / 1000
+    return min(ATHENA_POLL_MAX, max(backoff, elapsed * ATHENA_POLL_ELAPSED_RATIO))
+
+
+# Esecuzioni in corso (QueryExecutionId -> profilo) e stop in background non ancora conclusi
+_running: Dict[str, "AthenaProfile"] = {}
+_stopping = set()
+
+
+async def _stop_query(query_execution_id: str, profile: AthenaProfile, kind: str, reason: str):
+    """Ferma l'esecuzione e registra quanti byte aveva già scansionato (e quindi pagato)."""
+    client = get_athena_client()
+    try:
+        await asyncio.to_thread(client.stop_query_execution, QueryExecutionId=query_execution_id)
+    except Exception as e:
+        logger.warning(f"[Athena] Failed to stop query {query_execution_id}: {e}")
+    scanned = None
+    try:
+        stats = await asyncio.to_thread(client.get_query_execution, QueryExecutionId=query_execution_id)
+        scanned = stats['QueryExecution'].get('Statistics', {}).get('DataScannedInBytes', 0)
+        profile.bytes_scanned += scanned
+        profile.stopped_bytes_scanned += scanned
+    except Exception as e:
+        logger.debug(f"[Athena] Cannot read statistics of stopped query {query_execution_id}: {e}")
+    profile.stopped[kind] += 1
+    logger.warning(f"[Athena] Query {query_execution_id} ({profile.name}) stopped: {reason}, "
+                   f"{scanned if scanned is not None else 'unknown'} bytes scanned")
+
+
+def _run_stop(coro):
+    # Chi ci ha cancellato non attende: lo stop prosegue da solo (e viene atteso allo shutdown)
+    task = asyncio.ensure_future(coro)
+    _stopping.add(task)
+    task.add_done_callback(_stopping.discard)
+
+
+def _stop_in_background(query_execution_id: str, profile: AthenaProfile, kind: str, reason: str):
+    _run_stop(_stop_query(query_execution_id, profile, kind, reason))
+
+
+async def _stop_when_started(start: "asyncio.Future", profile: AthenaProfile):
+    """Ferma una query il cui avvio era in corso quando il chiamante è stato cancellato."""
+    try:
+        response = await start
+    except Exception:
+        return  # Avvio fallito: non c'è nulla da fermare
+    profile.executions += 1
+    await _stop_query(response['QueryExecutionId'], profile, "cancelled", "request cancelled while starting")
+
+
+async def stop_running_queries():
+    """Allo shutdown: ferma le esecuzioni ancora in corso, nessuno ne leggerà i risultati."""
+    while _running:
+        query_execution_id, profile = _running.popitem()
+        _stop_in_background(query_execution_id, profile, "cancelled", "shutdown")
+    if _stopping:
+        await asyncio.gather(*list(_stopping), return_exceptions=True)
+
+
+async def run_athena_query(query_string: str, profile: str = "cloudconnexa", max_rows: Optional[int] = None,
+                           cache_class: str = "default", columnar: bool = False):
+    """
+    Esegue la query su Athena con il profilo indicato (vedi ATHENA_PROFILES) e
+    attende i risultati senza bloccare l'event loop: le chiamate boto3 girano
+    in un thread e l'attesa usa asyncio.sleep.
+    Ritorna tutte le righe (paginando i risultati), al massimo `max_rows`, con
+    valori tipizzati; con `columnar=True` ritorna {"columns", "data"} colonna per colonna.
+    I risultati restano in cache per il TTL di `cache_class` (vedi athena_cache):
+    il valore ritornato è condiviso e non va modificato.
+    """
+    settings = get_profile(profile)
+    key = athena_cache.key(query_string, settings.database, settings.workgroup, max_rows,
+                           "columns" if columnar else "rows")
+    cached = await athena_cache.get(key, cache_class)
+    if cached is not None:
+        return cached
+
+    async def execute():
+        # L'esecuzione è condivisa: la deadline di chi l'ha avviata non deve fermarla per gli altri
+        set_deadline(None)
+        query_execution_id = await _start(query_string, settings)
+        if columnar:
+            result = await collect_query_columns(query_execution_id, max_rows)
+        else:
+            result = [row async for row in iter_query_results(query_execution_id, max_rows)]
+        await athena_cache.put(key, result, cache_class)
+        return result
+
+    return await _singleflight(key, execute)
+
+
+class _Flight:
+    """Un'esecuzione in corso e il numero di richieste che ne attendono il risultato."""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+_inflight: Dict[str, _Flight] = {}
+_stats = {"executions": 0, "coalesced": 0}
+
+
+async def _singleflight(key: str, execute):
+    """
+    Le richieste identiche contemporanee si agganciano alla stessa esecuzione
+    (stesso QueryExecutionId) e ne condividono il risultato. L'esecuzione
+    viene cancellata solo quando tutte le richieste in attesa se ne sono andate.
+    """
+    flight = _inflight.get(key)
+    if flight is None or flight.task.done():
+        flight = _Flight(asyncio.ensure_future(execute()))
+        _inflight[key] = flight
+        flight.task.add_done_callback(lambda _, f=flight: _inflight.pop(key, None) if _inflight.get(key) is f else None)
+        _stats["executions"] += 1
+    else:
+        _stats["coalesced"] += 1
+    flight.waiters += 1
+    try:
+        return await asyncio.shield(flight.task)
+    except asyncio.CancelledError:
+        if flight.waiters == 1 and not flight.task.done():
+            flight.task.cancel()
+        raise
+    finally:
+        flight.waiters -= 1
+
+
+def athena_stats() -> Dict[str, Any]:
+    return {**_stats, "in_flight": len(_inflight),
+            "profiles": {name: profile.stats() for name, profile in ATHENA_PROFILES.items()}}
+
+
+async def _start(query_string: str, profile: AthenaProfile) -> str:
+    """Esegue la query nel pool del profilo; la lettura dei risultati poi non lo occupa."""
+    async with profile.slot():
+        profile.running += 1
+        try:
+            return await _execute(query_string, profile)
+        finally:
+            profile.running -= 1
+
+
+async def _execute(query_string: str, profile: AthenaProfile) -> str:
+    """Avvia la query e ne attende il completamento; ritorna il QueryExecutionId."""
     client = get_athena_client()
     
     # 1. Avvia esecuzione
-    response = client.start_query_execution(
+    params = dict(
         QueryString=query_string,
-        QueryExecutionContext={'Database': ATHENA_DB},
-        ResultConfiguration={'OutputLocation': f"s3://{ATHENA_OUTPUT_BUCKET}/query_results/"},
-        WorkGroup=ATHENA_WORKGROUP
+        QueryExecutionContext={'Database': profile.database},
+        WorkGroup=profile.workgroup
     )
+    if profile.output_location:
+        params['ResultConfiguration'] = {'OutputLocation': profile.output_location}
+    reuse = result_reuse_configuration(profile.result_reuse_minutes)
+    if reuse:
+        # Athena restituisce direttamente il risultato di un'esecuzione identica recente
+        params['ResultReuseConfiguration'] = reuse
+    # L'avvio non è annullabile: se il chiamante viene cancellato nel frattempo la query
+    # parte comunque, quindi ne attendiamo l'ID in background per fermarla
+    start = asyncio.ensure_future(asyncio.to_thread(client.start_query_execution, **params))
+    try:
+        response = await asyncio.shield(start)
+    except asyncio.CancelledError:
+        _run_stop(_stop_when_started(start, profile))
+        raise
     query_execution_id = response['QueryExecutionId']
+    profile.executions += 1
+    _running[query_execution_id] = profile
     
-    # 2. Polling per attesa completamento
-    while True:
-        stats = client.get_query_execution(QueryExecutionId=query_execution_id)
-        status = stats['QueryExecution']['Status']['State']
-        
-        if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-            break
-        time.sleep(1) # Attendi 1 secondo
+    # 2. Polling adattivo per attesa completamento
+    deadline = current_deadline()
+    started_at = time.monotonic()
+    attempt = 0
+    try:
+        while True:
+            stats = await asyncio.to_thread(client.get_query_execution, QueryExecutionId=query_execution_id)
+            status = stats['QueryExecution']['Status']['State']
+            
+            if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
+                break
+            scanned = stats['QueryExecution'].get('Statistics', {}).get('DataScannedInBytes', 0)
+            if profile.scan_budget and scanned > profile.scan_budget:
+                await _stop_query(query_execution_id, profile, "scan_budget", f"scan budget exceeded ({scanned} bytes)")
+                raise Exception(f"Query Athena fermata: superato il limite di {profile.scan_budget // (1024 * 1024)} MB scansionati")
+            if profile.timeout and time.monotonic() - started_at > profile.timeout:
+                await _stop_query(query_execution_id, profile, "timeout", f"running for more than {profile.timeout:g}s")
+                raise Exception(f"Query Athena fermata: superato il tempo massimo di {profile.timeout:g}s")
+            if deadline is not None and deadline.expired():
+                # Richiesta scaduta o abbandonata: fermiamo la query invece di lasciarla girare
+                await _stop_query(query_execution_id, profile, "deadline", deadline.describe())
+                raise DeadlineExceeded(f"Athena query {query_execution_id} stopped: {deadline.describe()}")
+            delay = _poll_delay(stats, attempt)
+            if deadline is not None:
+                delay = min(delay, max(0.05, deadline.remaining()))
+            await asyncio.sleep(delay)
+            attempt += 1
+    except asyncio.CancelledError:
+        # Client disconnesso o deadline scaduta mentre eravamo in attesa (se non già fermata allo shutdown)
+        if query_execution_id in _running:
+            _stop_in_background(query_execution_id, profile, "cancelled", "request cancelled")
+        raise
+    finally:
+        _running.pop(query_execution_id, None)
         
+    statistics = stats['QueryExecution'].get('Statistics', {})
+    profile.bytes_scanned += statistics.get('DataScannedInBytes', 0)
     if status != 'SUCCEEDED':
         reason = stats['QueryExecution']['Status'].get('StateChangeReason', 'Errore sconosciuto')
         raise Exception(f"Query Athena fallita: {reason}")
+    if statistics.get('ResultReuseInformation', {}).get('ReusedPreviousResult'):
+        athena_cache.reused_executions += 1
         
-    # 3. Recupero Risultati
-    results = client.get_query_results(QueryExecutionId=query_execution_id)
-    return format_results(results)
-
-def format_results(results):
-    """Formatta la risposta complessa di Boto3 in una lista di dizionari JSON-friendly."""
-    rows = results['ResultSet']['Rows']
-    if not rows:
-        return []
-        
-    # La prima riga contiene gli headers
-    headers = [col['VarCharValue'] for col in rows[0]['Data']]
-    formatted_data = []
-    
-    # Salta l'header e processa i dati
-    for row in rows[1:]:
-        item = {}
-        for index, col in enumerate(row['Data']):
-            # Gestisce campi vuoti o mancanti
-            val = col.get('VarCharValue', '')
-            if index < len(headers):
-                item[headers[index]] = val
-        formatted_data.append(item)
-        
-    return formatted_data
\ No newline at end of file
+    return query_execution_id
+
+
+async def _iter_raw_pages(query_execution_id: str, max_rows: Optional[int] = None,
+                          page_size: int = ATHENA_PAGE_SIZE) -> AsyncIterator[Tuple[ResultDecoder, List[List[Optional[str]]]]]:
+    """
+    Legge i risultati pagina per pagina (MaxResults/NextToken) e produce
+    (decoder, righe grezze); oltre la soglia passa al CSV su S3. Con `max_rows`
+    si ferma senza scaricare il resto.
+    """
+    client = get_athena_client()
+    decoder: Optional[ResultDecoder] = None
+    next_token = None
+    produced = 0
+    use_s3 = ATHENA_S3_RESULTS_THRESHOLD > 0
+    while True:
+        kwargs = {'QueryExecutionId': query_execution_id, 'MaxResults': page_size}
+        if next_token:
+            kwargs['NextToken'] = next_token
+        page = await asyncio.to_thread(client.get_query_results, **kwargs)
+        rows = [[col.get('VarCharValue') for col in row['Data']] for row in page['ResultSet']['Rows']]
+        if decoder is None:
+            # Nella prima pagina la prima riga contiene gli headers; i tipi sono nei metadati
+            if not rows:
+                return
+            decoder = ResultDecoder.from_metadata(page['ResultSet'].get('ResultSetMetadata'),
+                                                  [name or '' for name in rows[0]])
+            rows = rows[1:]
+        if max_rows is not None:
+            rows = rows[:max_rows - produced]
+        produced += len(rows)
+        yield decoder, rows
+        next_token = page.get('NextToken')
+        if not next_token or (max_rows is not None and produced >= max_rows):
+            return
+        if use_s3 and produced >= ATHENA_S3_RESULTS_THRESHOLD:
+            # Risultato grande: il resto arriva dal CSV su S3 (se non disponibile si continua a paginare)
+            use_s3 = False
+            reader = await _open_csv_results(query_execution_id)
+            if reader is not None:
+                try:
+                    async for rows in _iter_csv_chunks(reader, skip=produced):
+                        if max_rows is not None:
+                            rows = rows[:max_rows - produced]
+                        produced += len(rows)
+                        yield decoder, rows
+                        if max_rows is not None and produced >= max_rows:
+                            break
+                finally:
+                    reader.close()
+                return
+
+
+async def iter_query_results(query_execution_id: str, max_rows: Optional[int] = None,
+                             page_size: int = ATHENA_PAGE_SIZE) -> AsyncIterator[Dict[str, Any]]:
+    """Righe del risultato come dizionari con valori tipizzati (vedi athena_decode)."""
+    async for decoder, rows in _iter_raw_pages(query_execution_id, max_rows, page_size):
+        for item in decoder.decode_rows(rows):
+            yield item
+
+
+async def collect_query_columns(query_execution_id: str, max_rows: Optional[int] = None) -> ColumnarResult:
+    """Risultato in forma colonnare: ogni pagina è convertita colonna per colonna."""
+    result: Optional[ColumnarResult] = None
+    async for decoder, rows in _iter_raw_pages(query_execution_id, max_rows):
+        if result is None:
+            result = empty_columns(decoder.names)
+        for name, values in zip(decoder.names, decoder.decode_columns(rows)):
+            result['data'][name].extend(values)
+    return result if result is not None else empty_columns([])
+
+
+class _CsvResults:
+    """Lettore incrementale del CSV dei risultati (usato da un thread alla volta)."""
+
+    def __init__(self, body):
+        self.body = body
+        self.rows = csv.reader(codecs.getreader('utf-8')(body))
+
+    def read(self, count: int) -> List[List[str]]:
+        return list(itertools.islice(self.rows, count))
+
+    def close(self):
+        self.body.close()
+
+
+async def _open_csv_results(query_execution_id: str) -> Optional[_CsvResults]:
+    """Apre in streaming il CSV scritto da Athena; None se non disponibile."""
+    try:
+        stats = await asyncio.to_thread(get_athena_client().get_query_execution, QueryExecutionId=query_execution_id)
+        location = stats['QueryExecution']['ResultConfiguration']['OutputLocation']
+        if not location.startswith('s3://') or not location.endswith('.csv'):
+            return None
+        bucket, _, key = location[len('s3://'):].partition('/')
+        response = await asyncio.to_thread(get_s3_client().get_object, Bucket=bucket, Key=key)
+        return _CsvResults(response['Body'])
+    except Exception as e:
+        logger.warning(f"[Athena] Cannot read results of {query_execution_id} from S3, paging instead: {e}")
+        return None
+
+
+async def _iter_csv_chunks(reader: _CsvResults, skip: int) -> AsyncIterator[List[List[str]]]:
+    """Blocchi di righe del CSV, saltando l'header e le `skip` righe già lette."""
+    skip += 1
+    while True:
+        rows = await asyncio.to_thread(reader.read, ATHENA_PAGE_SIZE)
+        if not rows:
+            return
+        if skip:
+            dropped = min(skip, len(rows))
+            rows = rows[dropped:]
+            skip -= dropped
+        if rows:
+            yield rows
+
+
+async def run_query_set(queries: Dict[str, str], profile: str = "cloudconnexa", cache_class: str = "dashboard",
+                        columnar: bool = False) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Esegue insieme le query di una dashboard (nome widget -> SQL), entro il
+    limite di concorrenza del profilo. Ritorna (risultati, errori): un widget
+    fallito ha risultato vuoto e il messaggio in `errori`. Se falliscono tutte
+    viene sollevato il primo errore.
+    """
+    names = list(queries)
+    outcomes = await asyncio.gather(
+        *(run_athena_query(queries[name], profile, cache_class=cache_class, columnar=columnar) for name in names),
+        return_exceptions=True
+    )
+    results: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, BaseException):
+            if isinstance(outcome, asyncio.CancelledError):
+                raise outcome
+            logger.error(f"[Athena] Query '{name}' failed: {type(outcome).__name__} - {outcome}")
+            results[name] = empty_columns([]) if columnar else []
+            errors[name] = str(outcome)
+        else:
+            results[name] = outcome
+    if names and len(errors) == len(names):
+        raise next(o for o in outcomes if isinstance(o, BaseException))
+    return results, errors
@@ -0,0 +1,155 @@
+"""
+Cache dei risultati Athena.
+
+Le dashboard rieseguono tutto il giorno le stesse query (stesso intervallo di
+date), pagando ogni volta coda e dati scansionati. I risultati vengono
+memorizzati con chiave = hash della SQL normalizzata (spazi compattati fuori
+dalle stringhe) + database + workgroup, in una LRU in memoria con TTL per
+classe di query e, opzionalmente, in un secondo livello su disco condiviso tra
+i worker.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .shared_cache import SharedCache, shared_cache, SHARED_CACHE_LEASE, SHARED_CACHE_POLL
+
+logger = logging.getLogger("checkmk_api")
+
+# --- CONFIGURAZIONE ---
+ATHENA_CACHE_ENABLED = os.getenv("ATHENA_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ATHENA_CACHE_MAX_ENTRIES = int(os.getenv("ATHENA_CACHE_MAX_ENTRIES", "256"))
+# TTL (secondi) per classe di query, es. "dashboard:300,filters:900" (0 = non in cache)
+ATHENA_CACHE_TTLS = {"default": 300.0, "dashboard": 300.0, "filters": 900.0, "live": 60.0, "logs": 0.0}
+ATHENA_CACHE_TTLS.update({
+    name.strip(): float(ttl)
+    for name, _, ttl in (item.partition(":") for item in os.getenv("ATHENA_CACHE_TTLS", "").split(",") if item.strip())
+})
+# Secondo livello su disco; vuoto = usa la cache condivisa tra worker, se attiva
+ATHENA_CACHE_PATH = os.getenv("ATHENA_CACHE_PATH", "")
+# Riuso lato Athena dei risultati di query identiche (ResultReuseConfiguration), 0 = disabilitato
+ATHENA_RESULT_REUSE_MINUTES = int(os.getenv("ATHENA_RESULT_REUSE_MINUTES", "60"))
+
+_STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(query: str) -> str:
+    """Compatta gli spazi (a capo e indentazione inclusi) lasciando intatte le stringhe SQL."""
+    parts = _STRING_LITERAL.split(query.strip())
+    return "".join(part if index % 2 else _WHITESPACE.sub(" ", part) for index, part in enumerate(parts))
+
+
+def result_reuse_configuration(max_age_minutes: int = ATHENA_RESULT_REUSE_MINUTES) -> Optional[Dict[str, Any]]:
+    """Parametro ResultReuseConfiguration per StartQueryExecution (None se disabilitato)."""
+    if max_age_minutes <= 0:
+        return None
+    return {"ResultReuseByAgeConfiguration": {"Enabled": True, "MaxAgeInMinutes": max_age_minutes}}
+
+
+class AthenaResultCache:
+    def __init__(self, max_entries: int, ttls: Dict[str, float], disk: Optional[SharedCache]):
+        self.max_entries = max_entries
+        self.ttls = ttls
+        self.disk = disk
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.reused_executions = 0
+        self.by_class: Dict[str, Dict[str, int]] = {}
+
+    def ttl_for(self, cache_class: str) -> float:
+        return self.ttls.get(cache_class, self.ttls.get("default", 0.0))
+
+    @staticmethod
+    def key(query: str, database: str, workgroup: str, max_rows: Optional[int] = None, shape: str = "rows") -> str:
+        raw = "\x1f".join([normalize_sql(query), database, workgroup, str(max_rows), shape])
+        return "athena:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, cache_class: str, outcome: str):
+        counters = self.by_class.setdefault(cache_class, {"hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+    async def get(self, key: str, cache_class: str) -> Optional[Any]:
+        if not ATHENA_CACHE_ENABLED or self.ttl_for(cache_class) <= 0:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self._count(cache_class, "hits")
+                return entry[1]
+            del self._entries[key]
+        if self.disk is not None:
+            try:
+                rows = await asyncio.to_thread(self.disk.get, key)
+            except Exception as e:
+                logger.warning(f"[AthenaCache] Disk tier unavailable: {e}")
+                rows = None
+            if rows is not None:
+                # Il TTL residuo non è noto: in memoria resta al massimo un TTL intero
+                self._remember(key, rows, self.ttl_for(cache_class))
+                self.disk_hits += 1
+                self._count(cache_class, "hits")
+                return rows
+        self.misses += 1
+        self._count(cache_class, "misses")
+        return None
+
+    def _remember(self, key: str, rows: Any, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, rows)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def put(self, key: str, rows: Any, cache_class: str):
+        ttl = self.ttl_for(cache_class)
+        if not ATHENA_CACHE_ENABLED or ttl <= 0:
+            return
+        self._remember(key, rows, ttl)
+        self.stores += 1
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, rows, ttl)
+            except Exception as e:
+                logger.warning(f"[AthenaCache] Failed to store on disk: {e}")
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "enabled": ATHENA_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "reused_executions": self.reused_executions,
+            "by_class": self.by_class,
+            "ttls": self.ttls,
+            "disk": self.disk.path if self.disk is not None else None,
+            "result_reuse_minutes": ATHENA_RESULT_REUSE_MINUTES,
+        }
+
+
+athena_cache = AthenaResultCache(
+    ATHENA_CACHE_MAX_ENTRIES,
+    ATHENA_CACHE_TTLS,
+    SharedCache(ATHENA_CACHE_PATH, SHARED_CACHE_LEASE, SHARED_CACHE_POLL) if ATHENA_CACHE_PATH else shared_cache,
+)
@@ -0,0 +1,93 @@
+"""
+Decodifica tipizzata dei risultati Athena.
+
+Athena restituisce ogni cella come stringa; i tipi delle colonne sono in
+`ResultSetMetadata.ColumnInfo`. Qui i convertitori vengono scelti una volta
+per colonna e applicati a colonne intere (trasposizione + map), così le rotte
+ricevono numeri e booleani già pronti e possono lavorare per colonne invece
+di rileggere ogni riga con `int(row.get(...))`.
+"""
+
+from typing import Any, Callable, Dict, List, Literal, Optional
+
+# Risultato colonnare: {"columns": [nomi], "data": {nome: [valori]}}
+ColumnarResult = Dict[str, Any]
+# Formato delle risposte delle rotte (parametro di query `format`)
+ResultFormat = Literal["rows", "columnar"]
+
+_INTEGER_TYPES = {"tinyint", "smallint", "integer", "int", "bigint"}
+_FLOAT_TYPES = {"double", "float", "real", "decimal"}
+
+
+def _to_int(value: Optional[str]) -> Optional[int]:
+    return int(value) if value else None
+
+
+def _to_float(value: Optional[str]) -> Optional[float]:
+    return float(value) if value else None
+
+
+def _to_bool(value: Optional[str]) -> Optional[bool]:
+    return value == "true" if value else None
+
+
+def _to_text(value: Optional[str]) -> str:
+    # Come in passato, i valori NULL delle colonne testuali diventano stringa vuota
+    return value if value is not None else ""
+
+
+def column_decoder(athena_type: str) -> Callable[[Optional[str]], Any]:
+    """
+    Convertitore per un tipo Athena. Date e timestamp restano stringhe ISO:
+    sono già nel formato atteso dal frontend e restano serializzabili in JSON
+    (anche nel livello su disco della cache).
+    """
+    base = (athena_type or "varchar").lower().split("(")[0]
+    if base in _INTEGER_TYPES:
+        return _to_int
+    if base in _FLOAT_TYPES:
+        return _to_float
+    if base == "boolean":
+        return _to_bool
+    return _to_text
+
+
+class ResultDecoder:
+    """Nomi e convertitori delle colonne di un risultato, letti una volta sola."""
+
+    def __init__(self, names: List[str], types: Optional[List[str]] = None):
+        self.names = names
+        self.types = types or ["varchar"] * len(names)
+        self.decoders = [column_decoder(t) for t in self.types]
+
+    @classmethod
+    def from_metadata(cls, metadata: Dict[str, Any], header_row: List[str]) -> "ResultDecoder":
+        column_info = (metadata or {}).get("ColumnInfo") or []
+        if len(column_info) == len(header_row):
+            return cls([col["Name"] for col in column_info], [col.get("Type", "varchar") for col in column_info])
+        # Metadati assenti: colonne testuali con i nomi della riga di intestazione
+        return cls(header_row)
+
+    def decode_columns(self, raw_rows: List[List[Optional[str]]]) -> List[List[Any]]:
+        """Righe grezze -> una lista di valori convertiti per ogni colonna."""
+        width = len(self.names)
+        if not raw_rows:
+            return [[] for _ in range(width)]
+        # Righe più corte (celle finali mancanti) completate con NULL
+        padded = (row if len(row) >= width else list(row) + [None] * (width - len(row)) for row in raw_rows)
+        columns = list(zip(*padded))[:width]
+        return [list(map(decoder, column)) for decoder, column in zip(self.decoders, columns)]
+
+    def decode_rows(self, raw_rows: List[List[Optional[str]]]) -> List[Dict[str, Any]]:
+        columns = self.decode_columns(raw_rows)
+        return [dict(zip(self.names, values)) for values in zip(*columns)]
+
+
+def rows_from_columns(result: ColumnarResult) -> List[Dict[str, Any]]:
+    """Risultato colonnare -> lista di dizionari (per le tabelle)."""
+    names = result["columns"]
+    return [dict(zip(names, values)) for values in zip(*(result["data"][name] for name in names))]
+
+
+def empty_columns(names: List[str]) -> ColumnarResult:
+    return {"columns": list(names), "data": {name: [] for name in names}}
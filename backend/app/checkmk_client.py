@@ -0,0 +1,62 @@
+"""
+Configurazione condivisa per l'accesso alla REST API di Checkmk.
+"""
+
+import os
+from typing import Dict, Optional
+
+import httpx
+
+
+def get_checkmk_config():
+    config = {
+        "host": os.environ.get("CHECKMK_HOST", "monitor-horsarun.horsa.it"),
+        "site": os.environ.get("CHECKMK_SITE", "mkhrun"),
+        "user": os.environ.get("CHECKMK_USER", "demousera"),
+        "password": os.environ.get("CHECKMK_PASSWORD"),
+    }
+    return config
+
+
+def get_api_url(config: dict) -> str:
+    return f"https://{config['host']}/{config['site']}/check_mk/api/1.0"
+
+
+def get_auth_headers(config: dict) -> Dict[str, str]:
+    return {
+        'Authorization': f"Bearer {config['user']} {config['password']}",
+        'Accept': 'application/json'
+    }
+
+
+# --- CLIENT CONDIVISO ---
+# Un solo AsyncClient per processo: le connessioni TLS verso Checkmk vengono
+# riutilizzate tra le richieste invece di essere riaperte ogni volta.
+CHECKMK_TIMEOUT = float(os.getenv("CHECKMK_TIMEOUT", "300"))
+CHECKMK_MAX_CONNECTIONS = int(os.getenv("CHECKMK_MAX_CONNECTIONS", "40"))
+
+_session: Optional[httpx.AsyncClient] = None
+
+
+def get_checkmk_session() -> httpx.AsyncClient:
+    """Ritorna il client httpx condiviso (creato al primo uso)."""
+    global _session
+    if _session is None or _session.is_closed:
+        config = get_checkmk_config()
+        _session = httpx.AsyncClient(
+            headers=get_auth_headers(config),
+            timeout=CHECKMK_TIMEOUT,
+            verify=False,
+            limits=httpx.Limits(
+                max_connections=CHECKMK_MAX_CONNECTIONS,
+                max_keepalive_connections=CHECKMK_MAX_CONNECTIONS,
+            ),
+        )
+    return _session
+
+
+async def close_checkmk_session():
+    global _session
+    if _session is not None:
+        await _session.aclose()
+        _session = None
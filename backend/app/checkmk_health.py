@@ -0,0 +1,157 @@
+"""
+Health check di Checkmk eseguito in background.
+
+Un task periodico interroga `/version` e conserva lo storico delle latenze e
+l'ultimo esito positivo: `/connection-test` risponde subito da questo stato
+invece di aprire una connessione nuova a ogni chiamata.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+import httpx
+
+from .checkmk_client import get_checkmk_config, get_api_url, get_checkmk_session
+
+logger = logging.getLogger("checkmk_api")
+
+# --- CONFIGURAZIONE ---
+HEALTH_PROBE_INTERVAL = float(os.getenv("CHECKMK_HEALTH_INTERVAL", "30"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("CHECKMK_HEALTH_TIMEOUT", "10"))
+HEALTH_HISTORY_SIZE = int(os.getenv("CHECKMK_HEALTH_HISTORY", "120"))
+# Oltre questa età l'ultimo successo non basta a dichiarare Checkmk raggiungibile
+HEALTH_STALE_AFTER = float(os.getenv("CHECKMK_HEALTH_STALE_AFTER", str(HEALTH_PROBE_INTERVAL * 3)))
+
+
+def percentile(values, pct: float) -> Optional[float]:
+    """Percentile con interpolazione lineare; None se la lista è vuota."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+class CheckmkHealthProber:
+    """Esegue il probe di `/version` a intervalli regolari e ne conserva lo storico."""
+
+    def __init__(self, interval: float, timeout: float, history_size: int):
+        self.interval = interval
+        self.timeout = timeout
+        self.history = deque(maxlen=history_size)  # (timestamp, latenza, ok)
+        self.last_success: Optional[float] = None
+        self.last_probe: Optional[float] = None
+        self.last_latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.version: Optional[str] = None
+        self.consecutive_failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def probe_once(self) -> bool:
+        config = get_checkmk_config()
+        api_url = get_api_url(config)
+        start_time = time.monotonic()
+        try:
+            # Il probe non passa dal limiter: deve misurare Checkmk, non la nostra coda
+            resp = await get_checkmk_session().get(f"{api_url}/version", timeout=self.timeout)
+            latency = time.monotonic() - start_time
+            resp.raise_for_status()
+            version_info = resp.json() if resp.text else {}
+            self.version = version_info.get('version', 'unknown')
+            self._record(latency, True, None)
+            logger.debug(f"[Health] Checkmk v{self.version} answered in {latency:.2f}s")
+            return True
+        except httpx.HTTPStatusError as e:
+            self._record(time.monotonic() - start_time, False, f"Failed with status {e.response.status_code}: {e.response.text}")
+        except httpx.TimeoutException:
+            self._record(time.monotonic() - start_time, False, f"Connection timed out (>{self.timeout:.0f}s)")
+        except Exception as e:
+            self._record(time.monotonic() - start_time, False, f"Connection error: {str(e)}")
+        logger.warning(f"[Health] Checkmk probe failed ({self.consecutive_failures} in a row): {self.last_error}")
+        return False
+
+    def _record(self, latency: float, ok: bool, error: Optional[str]):
+        now = time.time()
+        self.history.append((now, latency, ok))
+        self.last_probe = now
+        self.last_latency = latency
+        if ok:
+            self.last_success = now
+            self.last_error = None
+            self.consecutive_failures = 0
+        else:
+            self.last_error = error
+            self.consecutive_failures += 1
+
+    async def _run(self):
+        while True:
+            try:
+                await self.probe_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[Health] Unexpected prober error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            logger.info(f"[Health] Starting Checkmk health prober (every {self.interval:.0f}s)")
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def is_healthy(self) -> bool:
+        if self.last_success is None or self.consecutive_failures > 0:
+            return False
+        return time.time() - self.last_success <= HEALTH_STALE_AFTER
+
+    def latency_percentiles(self) -> Dict[str, Optional[float]]:
+        latencies = [latency for _, latency, ok in self.history if ok]
+        return {
+            f"p{p}": round(percentile(latencies, p), 4) if latencies else None
+            for p in (50, 90, 95, 99)
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stato corrente nel formato di `ConnectionTestResponse`."""
+        if self.last_probe is None:
+            status, message = "pending", "Health check not yet completed"
+        elif self.is_healthy():
+            status = "success"
+            message = f"Connected to Checkmk v{self.version} in {self.last_latency:.2f}s"
+        else:
+            status = "error"
+            message = self.last_error or "Last successful check is too old"
+
+        def as_iso(ts):
+            return datetime.fromtimestamp(ts).isoformat() if ts else None
+
+        return {
+            "status": status,
+            "message": message,
+            "version": self.version,
+            "last_latency": round(self.last_latency, 4) if self.last_latency is not None else None,
+            "last_probe": as_iso(self.last_probe),
+            "last_success": as_iso(self.last_success),
+            "consecutive_failures": self.consecutive_failures,
+            "samples": len(self.history),
+            "latency_percentiles": self.latency_percentiles(),
+        }
+
+
+# Istanza condivisa, avviata dallo startup dell'app
+health_prober = CheckmkHealthProber(HEALTH_PROBE_INTERVAL, HEALTH_PROBE_TIMEOUT, HEALTH_HISTORY_SIZE)
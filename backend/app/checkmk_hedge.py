@@ -0,0 +1,149 @@
+"""
+Hedging delle letture idempotenti verso Checkmk.
+
+Se una GET non è completata entro un percentile adattivo delle latenze
+recenti dello stesso endpoint, viene inviato un duplicato e si usa la prima
+risposta. Il numero di duplicati è limitato da un budget globale, così nei
+momenti di carico l'hedging non raddoppia il traffico verso Checkmk.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+
+import httpx
+
+from .checkmk_limiter import checkmk_limiter
+from .checkmk_health import percentile
+from .deadline import apply_to_httpx
+
+logger = logging.getLogger("checkmk_api")
+
+# --- CONFIGURAZIONE ---
+HEDGE_ENABLED = os.getenv("CHECKMK_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("CHECKMK_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("CHECKMK_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("CHECKMK_HEDGE_MIN_DELAY", "0.05"))
+# Frazione massima di richieste che può generare un duplicato
+HEDGE_BUDGET_RATIO = float(os.getenv("CHECKMK_HEDGE_BUDGET", "0.05"))
+HEDGE_BUDGET_BURST = float(os.getenv("CHECKMK_HEDGE_BUDGET_BURST", "10"))
+LATENCY_WINDOW = int(os.getenv("CHECKMK_HEDGE_WINDOW", "200"))
+
+
+class HedgeBudget:
+    """Ogni richiesta accredita `ratio` token, ogni duplicato ne consuma uno."""
+
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+
+    def credit(self):
+        self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+
+class CheckmkHedger:
+    def __init__(self):
+        self.latencies: Dict[str, deque] = {}
+        self.budget = HedgeBudget(HEDGE_BUDGET_RATIO, HEDGE_BUDGET_BURST)
+        self.requests = 0
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self.hedges_denied = 0
+
+    def threshold(self, key: str) -> Optional[float]:
+        """Ritardo dopo cui inviare il duplicato; None finché i campioni sono pochi."""
+        samples = self.latencies.get(key)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY, percentile(list(samples), HEDGE_PERCENTILE))
+
+    def _record(self, key: str, latency: float):
+        self.latencies.setdefault(key, deque(maxlen=LATENCY_WINDOW)).append(latency)
+
+    async def _send(self, session: httpx.AsyncClient, key: str, url: str, sent: asyncio.Event, **kwargs) -> httpx.Response:
+        async with checkmk_limiter.read.slot():
+            # Il timer di hedging parte quando la richiesta esce davvero, non durante l'attesa nel limiter
+            sent.set()
+            start_time = time.monotonic()
+            try:
+                return await session.get(url, **apply_to_httpx(dict(kwargs), session.timeout.read))
+            finally:
+                # Anche le richieste fallite o cancellate (primaria superata dal duplicato)
+                # entrano nella finestra, con il tempo trascorso come limite inferiore:
+                # altrimenti restano solo le risposte veloci e la soglia continua a scendere
+                self._record(key, time.monotonic() - start_time)
+
+    async def get(self, session: httpx.AsyncClient, url: str, key: str, **kwargs) -> httpx.Response:
+        """GET con hedging opzionale; `key` raggruppa le latenze per endpoint."""
+        if not HEDGE_ENABLED:
+            return await checkmk_limiter.request(session, "GET", url, **kwargs)
+
+        self.requests += 1
+        self.budget.credit()
+
+        primary_sent = asyncio.Event()
+        primary = asyncio.create_task(self._send(session, key, url, primary_sent, **kwargs))
+        tasks = [primary]
+        try:
+            threshold = self.threshold(key)
+            if threshold is None:
+                return await primary
+
+            # Attende che la richiesta primaria sia partita, poi la soglia di hedging
+            sent_waiter = asyncio.create_task(primary_sent.wait())
+            await asyncio.wait({primary, sent_waiter}, return_when=asyncio.FIRST_COMPLETED)
+            sent_waiter.cancel()
+            if not primary.done():
+                await asyncio.wait({primary}, timeout=threshold)
+            if primary.done():
+                return primary.result()
+
+            if not self.budget.try_spend():
+                self.hedges_denied += 1
+                return await primary
+
+            self.hedges_sent += 1
+            logger.debug(f"[Hedge] {key}: no answer after {threshold:.3f}s, sending hedge")
+            hedge = asyncio.create_task(self._send(session, key, url, asyncio.Event(), **kwargs))
+            tasks.append(hedge)
+
+            pending = set(tasks)
+            first_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedges_won += 1
+                        return task.result()
+                    # La prima a terminare è fallita: aspettiamo l'altra
+                    first_error = first_error or task.exception()
+            raise first_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": HEDGE_ENABLED,
+            "requests": self.requests,
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+            "hedges_denied_by_budget": self.hedges_denied,
+            "thresholds": {key: round(self.threshold(key), 4) if self.threshold(key) else None for key in self.latencies},
+        }
+
+
+# Istanza condivisa: latenze e budget sono globali al processo
+checkmk_hedger = CheckmkHedger()
@@ -0,0 +1,151 @@
+"""
+Rate limiter globale per il traffico verso Checkmk.
+
+Un unico limiter di processo (token bucket + massimo di richieste in volo)
+condiviso da tutte le rotte, con budget separati per letture e scritture.
+Sostituisce i semafori locali creati da ogni singola richiesta.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any
+
+import httpx
+
+from .deadline import apply_to_httpx
+from .shared_cache import per_worker
+
+logger = logging.getLogger("checkmk_api")
+
+# --- CONFIGURAZIONE ---
+# Limiti dell'intera istanza, ripartiti tra i worker uvicorn (vedi per_worker)
+READ_MAX_IN_FLIGHT = per_worker(int(os.getenv("CHECKMK_READ_MAX_IN_FLIGHT", "20")))
+READ_RATE = per_worker(float(os.getenv("CHECKMK_READ_RATE", "50")))  # richieste/secondo
+READ_BURST = per_worker(int(os.getenv("CHECKMK_READ_BURST", "20")))
+
+WRITE_MAX_IN_FLIGHT = per_worker(int(os.getenv("CHECKMK_WRITE_MAX_IN_FLIGHT", "10")))
+WRITE_RATE = per_worker(float(os.getenv("CHECKMK_WRITE_RATE", "20")))
+WRITE_BURST = per_worker(int(os.getenv("CHECKMK_WRITE_BURST", "10")))
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class TokenBucket:
+    """Token bucket asincrono: `rate` token al secondo, capacità `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def take(self):
+        # Il lock viene creato al primo uso, dentro il loop di uvicorn
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Il lock serializza i waiter: i token vengono distribuiti in ordine FIFO
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CheckmkBudget:
+    """Budget di un tipo di traffico (read o write): in-flight massimo + rate."""
+
+    def __init__(self, name: str, max_in_flight: int, rate: float, burst: int):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self._bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self._semaphore = None
+
+        # Metriche
+        self.waiting = 0
+        self.in_flight = 0
+        self.total_acquired = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.last_wait_time = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        self.waiting += 1
+        start = time.monotonic()
+        try:
+            await self._semaphore.acquire()
+            try:
+                if self._bucket:
+                    await self._bucket.take()
+            except BaseException:
+                self._semaphore.release()
+                raise
+        finally:
+            self.waiting -= 1
+
+        wait_time = time.monotonic() - start
+        self.total_acquired += 1
+        self.total_wait_time += wait_time
+        self.last_wait_time = wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+        if wait_time > 1.0:
+            logger.debug(f"[Limiter] {self.name} slot acquired after {wait_time:.2f}s (queue: {self.waiting})")
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "rate": self._bucket.rate if self._bucket else None,
+            "burst": self._bucket.burst if self._bucket else None,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "total_acquired": self.total_acquired,
+            "avg_wait_time": round(self.total_wait_time / self.total_acquired, 4) if self.total_acquired else 0.0,
+            "max_wait_time": round(self.max_wait_time, 4),
+            "last_wait_time": round(self.last_wait_time, 4),
+        }
+
+
+class CheckmkLimiter:
+    """Limiter di processo con budget separati per letture e scritture."""
+
+    def __init__(self):
+        self.read = CheckmkBudget("read", READ_MAX_IN_FLIGHT, READ_RATE, READ_BURST)
+        self.write = CheckmkBudget("write", WRITE_MAX_IN_FLIGHT, WRITE_RATE, WRITE_BURST)
+
+    def budget_for(self, method: str) -> CheckmkBudget:
+        return self.read if method.upper() in READ_METHODS else self.write
+
+    async def request(self, session: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+        """Esegue una richiesta Checkmk rispettando il budget del suo tipo."""
+        async with self.budget_for(method).slot():
+            # Il timeout non supera il tempo rimasto alla richiesta del client
+            kwargs = apply_to_httpx(kwargs, session.timeout.read)
+            return await session.request(method, url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"read": self.read.stats(), "write": self.write.stats()}
+
+
+# Istanza condivisa da tutte le rotte
+checkmk_limiter = CheckmkLimiter()
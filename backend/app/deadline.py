@@ -0,0 +1,214 @@
+"""
+Deadline delle richieste e cancellazione del lavoro abbandonato.
+
+Ogni richiesta HTTP riceve una deadline (header `X-Request-Timeout` in
+secondi, oppure il default della rotta) salvata in una contextvar: le
+chiamate Checkmk la usano come timeout e il polling Athena la controlla tra
+un giro e l'altro. Se la deadline scade o il client si disconnette, il
+middleware cancella la richiesta: le chiamate httpx in corso vengono
+interrotte e le query Athena ancora in esecuzione fermate.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, Optional
+
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger("checkmk_api")
+
+# --- CONFIGURAZIONE ---
+DEADLINE_ENABLED = os.getenv("DEADLINE_ENABLED", "true").lower() in ("1", "true", "yes")
+DEADLINE_DEFAULT = float(os.getenv("DEADLINE_DEFAULT", "120"))
+# Limite massimo per l'header e il default (nginx chiude comunque a 600s)
+DEADLINE_MAX = float(os.getenv("DEADLINE_MAX", "600"))
+DEADLINE_HEADER = b"x-request-timeout"
+# Elenco downtime (anche per cliente): come il timeout client di 300s usato in precedenza
+DEADLINE_DOWNTIMES = float(os.getenv("DEADLINE_DOWNTIMES", "300"))
+# Scritture massive: 0 = nessuna deadline, il job arriva in fondo anche se il client
+# si disconnette (come prima delle deadline); un valore > 0 le interrompe prima
+DEADLINE_BULK_WRITES = float(os.getenv("DEADLINE_BULK_WRITES", "0"))
+
+# Default per rotta (secondi, 0 = nessuna deadline), il primo pattern che corrisponde vince
+ROUTE_DEADLINES = [
+    (r"/api/(health/.*|metrics|connection-test)", 15),
+    (r"/api/(cloudconnexa|sap|logs)/.*", 300),
+    (r"/api/(schedule|downtimes/delete-batch|downtimes/delete-by-filter)", DEADLINE_BULK_WRITES),
+    (r"/api/downtimes", DEADLINE_DOWNTIMES),
+]
+_ROUTE_DEADLINES = [(re.compile(pattern), seconds) for pattern, seconds in ROUTE_DEADLINES]
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# Contatori esposti su /metrics
+deadline_stats = {"expired": 0, "disconnected": 0}
+
+
+class Deadline:
+    """Istante limite di una richiesta; `cancel()` la fa scadere subito."""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+        self.cancelled = False
+        self.reason: Optional[str] = None
+
+    def remaining(self) -> float:
+        if self.cancelled:
+            return 0.0
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.cancelled or time.monotonic() >= self.expires_at
+
+    def cancel(self, reason: str):
+        self.cancelled = True
+        self.reason = self.reason or reason
+
+    def describe(self) -> str:
+        return self.reason or f"deadline of {self.timeout:g}s exceeded"
+
+
+_current: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+def set_deadline(deadline: Optional[Deadline]) -> contextvars.Token:
+    return _current.set(deadline)
+
+
+def reset_deadline(token: contextvars.Token):
+    _current.reset(token)
+
+
+def check_deadline(what: str = "request"):
+    """Solleva DeadlineExceeded se la richiesta corrente è scaduta o abbandonata."""
+    deadline = _current.get()
+    if deadline is not None and deadline.expired():
+        raise DeadlineExceeded(f"{what} aborted: {deadline.describe()}")
+
+
+def clamp_timeout(timeout: Optional[float]) -> Optional[float]:
+    """Il timeout indicato, ridotto al tempo rimasto della richiesta corrente."""
+    deadline = _current.get()
+    if deadline is None:
+        return timeout
+    remaining = max(0.001, deadline.remaining())
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+def apply_to_httpx(kwargs: Dict[str, Any], default: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Imposta `timeout` nei kwargs httpx in base alla deadline, se più stretta del
+    timeout esplicito o di `default` (il timeout della sessione).
+    """
+    deadline = _current.get()
+    if deadline is not None:
+        timeout = kwargs.get("timeout", default)
+        kwargs["timeout"] = clamp_timeout(timeout if isinstance(timeout, (int, float)) else default)
+    return kwargs
+
+
+def route_timeout(path: str, headers) -> Optional[float]:
+    """Deadline della richiesta in secondi; None se la rotta non ne ha (e il client non la chiede)."""
+    requested = dict(headers or []).get(DEADLINE_HEADER)
+    if requested:
+        try:
+            return max(0.1, min(DEADLINE_MAX, float(requested)))
+        except ValueError:
+            pass
+    for pattern, seconds in _ROUTE_DEADLINES:
+        if pattern.fullmatch(path):
+            # Valori configurati esplicitamente per la rotta: non limitati da DEADLINE_MAX
+            return seconds if seconds > 0 else None
+    return min(DEADLINE_MAX, DEADLINE_DEFAULT)
+
+
+class DeadlineMiddleware:
+    """
+    Middleware ASGI: imposta la deadline e cancella la richiesta quando scade o
+    quando il client chiude la connessione.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not DEADLINE_ENABLED:
+            return await self.app(scope, receive, send)
+
+        timeout = route_timeout(scope["path"], scope.get("headers"))
+        if timeout is None:
+            return await self.app(scope, receive, send)
+        deadline = Deadline(timeout)
+        token = set_deadline(deadline)
+        messages: asyncio.Queue = asyncio.Queue()
+        disconnected = asyncio.Event()
+        response_started = False
+
+        async def pump_receive():
+            # Unico lettore di `receive`: finito il body resta in attesa della disconnessione
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+
+        async def wrapped_receive():
+            if disconnected.is_set() and messages.empty():
+                return {"type": "http.disconnect"}
+            return await messages.get()
+
+        async def wrapped_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        app_task = asyncio.ensure_future(self.app(scope, wrapped_receive, wrapped_send))
+        watcher = asyncio.ensure_future(pump_receive())
+        disconnect_waiter = asyncio.ensure_future(disconnected.wait())
+        try:
+            done, _ = await asyncio.wait({app_task, disconnect_waiter}, timeout=deadline.remaining(),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if app_task in done:
+                return app_task.result()
+
+            # Deadline scaduta o client disconnesso: fermiamo il lavoro a valle
+            client_gone = disconnected.is_set()
+            # Segnala anche ai thread (polling Athena) che il lavoro va fermato
+            deadline.cancel("client disconnected" if client_gone else f"deadline of {deadline.timeout:g}s exceeded")
+            app_task.cancel()
+            try:
+                await app_task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.debug(f"[Deadline] Exception while cancelling {scope['path']}: {e}")
+            if client_gone:
+                deadline_stats["disconnected"] += 1
+                logger.warning(f"[Deadline] Client disconnected, cancelled {scope['method']} {scope['path']}")
+                return
+            deadline_stats["expired"] += 1
+            logger.warning(f"[Deadline] {scope['method']} {scope['path']} exceeded its {deadline.timeout:g}s deadline")
+            if not response_started:
+                response = JSONResponse(
+                    {"detail": f"Request deadline of {deadline.timeout:g}s exceeded"}, status_code=504
+                )
+                await response(scope, receive, send)
+        finally:
+            for task in (watcher, disconnect_waiter, app_task):
+                if not task.done():
+                    task.cancel()
+            reset_deadline(token)
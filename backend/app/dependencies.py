@@ -2,11 +2,14 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
 import logging
+import asyncio
 from jose import jwt, jwk
 from jose.jwt import get_unverified_header
 from urllib.request import urlopen
 import json
 
+from .shared_cache import shared_cache
+
 logger = logging.getLogger("checkmk_api")
 
 security = HTTPBearer()
@@ -21,6 +24,12 @@ COGNITO_KEYS_URL = f"https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{COGNITO
 
 # Cache for JWKS
 jwks = None
+# With several workers the JWKS are shared through the cross-process cache
+JWKS_SHARED_TTL = float(os.getenv("JWKS_SHARED_TTL", "86400"))
+
+def _fetch_jwks() -> dict:
+    response = urlopen(COGNITO_KEYS_URL, timeout=10)
+    return json.loads(response.read())
 
 async def get_jwks():
     """Fetches and caches the JWKS from Cognito."""
@@ -28,8 +37,13 @@ async def get_jwks():
     if jwks is None:
         try:
             logger.info(f"Fetching JWKS from {COGNITO_KEYS_URL}")
-            response = urlopen(COGNITO_KEYS_URL)
-            jwks = json.loads(response.read())
+            # urlopen is blocking: run it off the event loop
+            if shared_cache is not None:
+                jwks = await shared_cache.get_or_fetch(
+                    "cognito_jwks", JWKS_SHARED_TTL, lambda: asyncio.to_thread(_fetch_jwks)
+                )
+            else:
+                jwks = await asyncio.to_thread(_fetch_jwks)
             logger.info("JWKS fetched successfully.")
         except Exception as e:
             logger.error(f"Failed to fetch JWKS: {e}")
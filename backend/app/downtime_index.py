@@ -0,0 +1,301 @@
+"""
+Indice in memoria dei downtime di Checkmk per query temporali.
+
+Tutti i downtime vengono scaricati periodicamente (livestatus se configurato,
+altrimenti REST API) e indicizzati in un interval tree statico: "cosa è in
+downtime alle 23:00?" o "cosa si sovrappone a 22:00-02:00?" costano
+O(log n + k) invece di scaricare e filtrare tutto a ogni richiesta. Lo stesso
+indice, per host, serve al controllo dei conflitti prima di `/schedule`.
+
+Allo startup l'indice viene ricostruito dallo snapshot su disco e usato
+finché il primo refresh in background non lo sostituisce.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from .checkmk_client import get_checkmk_config, get_api_url, get_checkmk_session
+from .checkmk_limiter import checkmk_limiter
+from .host_inventory import host_inventory
+from .livestatus import livestatus_client, downtime_to_rest, LivestatusError
+from .snapshot_store import snapshot_store
+from .shared_cache import shared_cache
+
+logger = logging.getLogger("checkmk_api")
+
+# --- CONFIGURAZIONE ---
+DOWNTIME_INDEX_REFRESH = float(os.getenv("DOWNTIME_INDEX_REFRESH", "60"))
+DOWNTIME_INDEX_TIMEOUT = float(os.getenv("DOWNTIME_INDEX_TIMEOUT", "60"))
+# Oltre questa età l'indice viene ricaricato prima di rispondere
+DOWNTIME_INDEX_MAX_AGE = float(os.getenv("DOWNTIME_INDEX_MAX_AGE", str(DOWNTIME_INDEX_REFRESH * 3)))
+
+
+def parse_epoch(value: Any) -> Optional[int]:
+    """Epoch da un valore numerico o da una data ISO della REST API."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp())
+    except ValueError:
+        return None
+
+
+def folder_and_ancestors(folder: str) -> List[str]:
+    """'/c1/sub/x' -> ['/c1/sub/x', '/c1/sub', '/c1']; la radice '/' resta solo sé stessa."""
+    folders = []
+    path = folder.rstrip("/")
+    while path:
+        folders.append(path)
+        path = path.rsplit("/", 1)[0]
+    return folders or ["/"]
+
+
+class IntervalIndex:
+    """
+    Interval tree statico: gli intervalli sono ordinati per inizio e ogni nodo
+    dell'albero binario implicito (il punto medio di un intervallo di indici)
+    conosce la fine massima del proprio sottoalbero.
+    """
+
+    def __init__(self, intervals: List[Tuple[int, int, Any]]):
+        intervals = sorted(intervals, key=lambda item: (item[0], item[1]))
+        self.starts = [item[0] for item in intervals]
+        self.ends = [item[1] for item in intervals]
+        self.items = [item[2] for item in intervals]
+        self.max_end = list(self.ends)
+        self._build(0, len(intervals))
+
+    def _build(self, lo: int, hi: int) -> Optional[int]:
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child is not None and child > self.max_end[mid]:
+                self.max_end[mid] = child
+        return self.max_end[mid]
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def overlapping(self, start: int, end: int) -> List[Any]:
+        """Intervalli con inizio <= end e fine >= start, in ordine di inizio."""
+        found = []
+        stack = [(0, len(self.items))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self.max_end[mid] < start:
+                # Nessun intervallo di questo sottoalbero arriva fino a start
+                continue
+            stack.append((lo, mid))
+            if self.starts[mid] <= end:
+                if self.ends[mid] >= start:
+                    found.append(mid)
+                stack.append((mid + 1, hi))
+        return [self.items[i] for i in sorted(found)]
+
+
+class DowntimeIndex:
+    """Downtime indicizzati globalmente, per folder (cliente) e per host."""
+
+    def __init__(self, refresh_interval: float, max_age: float):
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.all = IntervalIndex([])
+        self.by_folder: Dict[str, IntervalIndex] = {}
+        self.by_host: Dict[str, IntervalIndex] = {}
+        self.source: Optional[str] = None
+        self.updated_at: Optional[float] = None      # time.time() dell'ultimo refresh riuscito
+        self.refresh_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.skipped_rows = 0
+        self._invalidated = False
+        self.from_snapshot = False
+        self.snapshot_version: Optional[int] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _fetch_from_checkmk(self) -> Dict[str, Any]:
+        """Tutti i downtime, nel formato della REST API."""
+        config = get_checkmk_config()
+        if livestatus_client is not None:
+            try:
+                rows = await livestatus_client.get_downtimes()
+                return {"downtimes": [downtime_to_rest(row, config['site']) for row in rows], "source": "livestatus"}
+            except LivestatusError as e:
+                logger.warning(f"[DowntimeIndex] Livestatus failed, falling back to REST API: {e}")
+
+        resp = await checkmk_limiter.request(
+            get_checkmk_session(), "GET", f"{get_api_url(config)}/domain-types/downtime/collections/all",
+            timeout=DOWNTIME_INDEX_TIMEOUT
+        )
+        resp.raise_for_status()
+        return {"downtimes": resp.json().get('value', []), "source": "rest"}
+
+    async def _fetch(self) -> Tuple[List[Dict[str, Any]], str]:
+        if shared_cache is not None:
+            # Con più worker i downtime vengono scaricati da uno solo per intervallo di refresh
+            result = await shared_cache.get_or_fetch("downtimes", self.refresh_interval, self._fetch_from_checkmk)
+        else:
+            result = await self._fetch_from_checkmk()
+        return result["downtimes"], result["source"]
+
+    def build(self, downtimes: List[Dict[str, Any]], host_map: Dict[str, str], source: str):
+        """Ricostruisce gli indici; i downtime senza orari validi vengono scartati."""
+        intervals = []
+        by_folder: Dict[str, list] = {}
+        by_host: Dict[str, list] = {}
+        skipped = 0
+        for downtime in downtimes:
+            ext = downtime.get('extensions', {})
+            start_ts = parse_epoch(ext.get('start_time'))
+            end_ts = parse_epoch(ext.get('end_time'))
+            if start_ts is None or end_ts is None:
+                skipped += 1
+                continue
+            interval = (start_ts, end_ts, downtime)
+            host_name = ext.get('host_name')
+            intervals.append(interval)
+            by_host.setdefault(host_name, []).append(interval)
+            if host_name in host_map:
+                # Indicizzato anche sotto ogni folder antenato: un cliente include le sottocartelle
+                for folder in folder_and_ancestors(host_map[host_name]):
+                    by_folder.setdefault(folder, []).append(interval)
+
+        self.all = IntervalIndex(intervals)
+        self.by_folder = {folder: IntervalIndex(items) for folder, items in by_folder.items()}
+        self.by_host = {host: IntervalIndex(items) for host, items in by_host.items()}
+        self.source = source
+        self.skipped_rows = skipped
+        self.updated_at = time.time()
+        self._invalidated = False
+
+    async def refresh(self):
+        start_time = time.monotonic()
+        try:
+            downtimes, source = await self._fetch()
+            host_map = await host_inventory.get_map()
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            raise
+        self.build(downtimes, host_map, source)
+        self.from_snapshot = False
+        self.refresh_duration = time.monotonic() - start_time
+        self.last_error = None
+        if snapshot_store is not None:
+            self.snapshot_version = await snapshot_store.save_async("downtimes", downtimes, source)
+        logger.info(f"[DowntimeIndex] Indexed {len(self.all)} downtimes from {source} in {self.refresh_duration:.2f}s")
+
+    def restore_snapshot(self, host_map: Dict[str, str]) -> bool:
+        """Ricostruisce l'indice dallo snapshot su disco (chiamato allo startup)."""
+        if snapshot_store is None or self.updated_at is not None:
+            return False
+        snapshot = snapshot_store.load("downtimes")
+        if snapshot is None:
+            return False
+        self.build(snapshot["data"], host_map, "snapshot")
+        # L'età dell'indice è quella dello snapshot, non quella del caricamento
+        self.updated_at = snapshot["saved_at"]
+        self.snapshot_version = snapshot["version"]
+        self.from_snapshot = True
+        return True
+
+    def is_fresh(self) -> bool:
+        if self.updated_at is None or self._invalidated:
+            return False
+        return time.time() - self.updated_at < self.max_age
+
+    async def ensure_fresh(self, force: bool = False) -> "DowntimeIndex":
+        """
+        Ricarica l'indice se è vuoto, troppo vecchio o invalidato. Se il refresh
+        fallisce ma un indice esiste già, si risponde con quello.
+        """
+        if not force and (self.is_fresh() or (self.from_snapshot and not self._invalidated)):
+            # Lo snapshot viene servito finché il refresh in background non lo sostituisce
+            return self
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not force and self.is_fresh():
+                return self
+            try:
+                await self.refresh()
+            except Exception as e:
+                if self.updated_at is None:
+                    raise
+                logger.warning(f"[DowntimeIndex] Refresh failed, serving stale index: {e}")
+        return self
+
+    def invalidate(self):
+        """Da chiamare dopo una scrittura: la prossima query ricarica l'indice."""
+        self._invalidated = True
+        if shared_cache is not None:
+            shared_cache.invalidate("downtimes")
+
+    def overlapping(self, start: int, end: int, folder: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Downtime sovrapposti all'intervallo; con `folder` quelli del folder e delle sue sottocartelle."""
+        index = self.all if folder is None else self.by_folder.get(folder.rstrip("/") or "/")
+        return index.overlapping(start, end) if index else []
+
+    def active_at(self, at: int, folder: Optional[str] = None) -> List[Dict[str, Any]]:
+        return self.overlapping(at, at, folder)
+
+    def host_conflicts(self, host: str, start: int, end: int) -> List[Dict[str, Any]]:
+        """Downtime di host (non di servizio) che si sovrappongono all'intervallo."""
+        index = self.by_host.get(host)
+        if not index:
+            return []
+        return [dt for dt in index.overlapping(start, end)
+                if dt.get('extensions', {}).get('is_service') not in ("yes", True)]
+
+    async def _run(self):
+        while True:
+            try:
+                await self.ensure_fresh(force=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[DowntimeIndex] Refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            logger.info(f"[DowntimeIndex] Starting downtime index refresh (every {self.refresh_interval:.0f}s)")
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def updated_at_iso(self) -> Optional[str]:
+        return datetime.fromtimestamp(self.updated_at).isoformat() if self.updated_at else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "downtimes": len(self.all),
+            "hosts": len(self.by_host),
+            "folders": len(self.by_folder),
+            "source": self.source,
+            "snapshot_version": self.snapshot_version,
+            "updated_at": self.updated_at_iso(),
+            "refresh_duration": round(self.refresh_duration, 3) if self.refresh_duration is not None else None,
+            "skipped_rows": self.skipped_rows,
+            "last_error": self.last_error,
+        }
+
+
+# Istanza condivisa, aggiornata in background dallo startup
+downtime_index = DowntimeIndex(DOWNTIME_INDEX_REFRESH, DOWNTIME_INDEX_MAX_AGE)
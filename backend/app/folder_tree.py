@@ -0,0 +1,151 @@
+"""
+Albero dei folder Checkmk (clienti) con aggregati per sottoalbero.
+
+Ogni nodo conosce, per sé e per tutti i suoi discendenti, il numero di host,
+gli host attualmente in downtime e i downtime in arrivo. Lo stato di ogni
+host viene confrontato con quello precedente e solo le differenze vengono
+propagate verso la radice, così un refresh tocca solo i rami cambiati.
+"""
+
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from .downtime_index import DowntimeIndex, parse_epoch
+
+logger = logging.getLogger("checkmk_api")
+
+# --- CONFIGURAZIONE ---
+# Finestra (ore) in cui un downtime futuro conta come "in arrivo"
+FOLDER_TREE_UPCOMING_HOURS = float(os.getenv("FOLDER_TREE_UPCOMING_HOURS", "24"))
+# Lo stato "in downtime" dipende dall'ora: oltre questa età l'albero viene ricalcolato
+FOLDER_TREE_MAX_AGE = float(os.getenv("FOLDER_TREE_MAX_AGE", "60"))
+
+# (folder, in downtime, downtime in arrivo)
+HostState = Tuple[str, int, int]
+
+
+def split_folder(path: str) -> Tuple[str, ...]:
+    """'/clienteA/prod' -> ('clienteA', 'prod'); '/' -> ()."""
+    return tuple(part for part in (path or "/").split("/") if part)
+
+
+class FolderNode:
+    def __init__(self, name: str, path: str, parent: Optional["FolderNode"] = None):
+        self.name = name
+        self.path = path
+        self.parent = parent
+        self.children: Dict[str, "FolderNode"] = {}
+        self.hosts = 0                 # host direttamente nel folder
+        self.total_hosts = 0           # aggregati del sottoalbero (nodo incluso)
+        self.hosts_in_downtime = 0
+        self.upcoming_downtimes = 0
+
+    def to_dict(self, depth: Optional[int] = None) -> Dict[str, Any]:
+        node = {
+            "name": self.name,
+            "path": self.path,
+            "hosts": self.hosts,
+            "total_hosts": self.total_hosts,
+            "hosts_in_downtime": self.hosts_in_downtime,
+            "upcoming_downtimes": self.upcoming_downtimes,
+        }
+        if depth is None or depth > 0:
+            next_depth = None if depth is None else depth - 1
+            node["children"] = [child.to_dict(next_depth) for _, child in sorted(self.children.items())]
+        return node
+
+
+class FolderTree:
+    def __init__(self, upcoming_hours: float, max_age: float):
+        self.upcoming_window = int(upcoming_hours * 3600)
+        self.max_age = max_age
+        self.root = FolderNode("", "/")
+        self.host_states: Dict[str, HostState] = {}
+        self.updated_at: Optional[float] = None
+        self.last_changes = 0
+        self._sources: Tuple[Any, Any] = (None, None)
+
+    def _node(self, folder: str, create: bool = False) -> Optional[FolderNode]:
+        node = self.root
+        for part in split_folder(folder):
+            child = node.children.get(part)
+            if child is None:
+                if not create:
+                    return None
+                child = FolderNode(part, f"{node.path.rstrip('/')}/{part}", node)
+                node.children[part] = child
+            node = child
+        return node
+
+    def _apply(self, state: HostState, sign: int):
+        """Aggiunge (sign=1) o toglie (sign=-1) il contributo di un host lungo il ramo."""
+        folder, in_downtime, upcoming = state
+        node = self._node(folder, create=sign > 0)
+        node.hosts += sign
+        while node is not None:
+            node.total_hosts += sign
+            node.hosts_in_downtime += sign * in_downtime
+            node.upcoming_downtimes += sign * upcoming
+            parent = node.parent
+            if parent is not None and node.total_hosts == 0 and not node.children:
+                # Folder rimasto vuoto
+                del parent.children[node.name]
+            node = parent
+
+    def _host_state(self, host: str, folder: str, index: DowntimeIndex, now: int) -> HostState:
+        in_downtime = 1 if index.host_conflicts(host, now, now) else 0
+        upcoming = 0
+        host_index = index.by_host.get(host)
+        if host_index:
+            upcoming = sum(
+                1 for dt in host_index.overlapping(now + 1, now + self.upcoming_window)
+                if (parse_epoch(dt.get('extensions', {}).get('start_time')) or 0) > now
+            )
+        return folder, in_downtime, upcoming
+
+    def sync(self, host_map: Dict[str, str], index: DowntimeIndex, now: Optional[int] = None) -> int:
+        """Allinea l'albero a inventario e downtime; ritorna il numero di host cambiati."""
+        now = int(now if now is not None else time.time())
+        changes = 0
+        for host, folder in host_map.items():
+            state = self._host_state(host, folder, index, now)
+            previous = self.host_states.get(host)
+            if previous == state:
+                continue
+            if previous is not None:
+                self._apply(previous, -1)
+            self._apply(state, 1)
+            self.host_states[host] = state
+            changes += 1
+        for host in [h for h in self.host_states if h not in host_map]:
+            self._apply(self.host_states.pop(host), -1)
+            changes += 1
+        self.updated_at = time.time()
+        self.last_changes = changes
+        return changes
+
+    def is_current(self, hosts_version: Any, index: DowntimeIndex) -> bool:
+        """True se inventario e indice non sono cambiati e l'albero non è troppo vecchio."""
+        if self.updated_at is None or time.time() - self.updated_at >= self.max_age:
+            return False
+        return self._sources == (hosts_version, index.updated_at)
+
+    def refresh(self, host_map: Dict[str, str], hosts_version: Any, index: DowntimeIndex) -> int:
+        """`hosts_version` identifica la versione dell'inventario (es. il suo timestamp)."""
+        if self.is_current(hosts_version, index):
+            return 0
+        start_time = time.monotonic()
+        changes = self.sync(host_map, index)
+        self._sources = (hosts_version, index.updated_at)
+        logger.info(f"[FolderTree] Synced {len(self.host_states)} hosts, {changes} changed, in {time.monotonic() - start_time:.3f}s")
+        return changes
+
+    def subtree(self, folder: Optional[str] = None, depth: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        node = self._node(folder) if folder else self.root
+        return node.to_dict(depth) if node is not None else None
+
+
+# Istanza condivisa da /clients/tree
+folder_tree = FolderTree(FOLDER_TREE_UPCOMING_HOURS, FOLDER_TREE_MAX_AGE)
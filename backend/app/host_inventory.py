@@ -0,0 +1,130 @@
+"""
+Cache dell'inventario host di Checkmk (host -> folder).
+
+`/hosts`, `/clients`, `/stats` e il filtro per cliente di `/downtimes` leggono
+tutti la stessa collection `host_config`: la scarichiamo una volta sola e la
+condividiamo finché non scade il TTL.
+
+Dopo un restart la mappa viene ripresa dallo snapshot su disco e servita
+così com'è finché il primo refresh non la riallinea.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from .checkmk_client import get_checkmk_config, get_api_url, get_checkmk_session
+from .checkmk_limiter import checkmk_limiter
+from .deadline import set_deadline
+from .livestatus import livestatus_client, LivestatusError
+from .snapshot_store import snapshot_store
+from .shared_cache import shared_cache
+
+logger = logging.getLogger("checkmk_api")
+
+HOST_INVENTORY_TTL = float(os.getenv("HOST_INVENTORY_TTL", "60"))
+HOST_INVENTORY_TIMEOUT = float(os.getenv("HOST_INVENTORY_TIMEOUT", "30"))
+
+
+class HostInventory:
+    """Mappa host -> folder con TTL e refresh coalescente."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hosts: Dict[str, str] = {}
+        self.updated_at: Optional[float] = None
+        self.stale = False                   # True finché la mappa viene dallo snapshot su disco
+        self.snapshot_version: Optional[int] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._background: Optional[asyncio.Task] = None
+
+    def is_fresh(self) -> bool:
+        return self.updated_at is not None and time.monotonic() - self.updated_at < self.ttl
+
+    async def _fetch(self) -> Dict[str, Any]:
+        """Scarica l'inventario da Checkmk (le eccezioni httpx vengono propagate)."""
+        if livestatus_client is not None:
+            try:
+                return {"hosts": await livestatus_client.get_host_map(), "source": "livestatus"}
+            except LivestatusError as e:
+                logger.warning(f"[Inventory] Livestatus failed, falling back to REST API: {e}")
+
+        config = get_checkmk_config()
+        api_url = get_api_url(config)
+        resp = await checkmk_limiter.request(
+            get_checkmk_session(), "GET", f"{api_url}/domain-types/host_config/collections/all",
+            params={"effective_attributes": False},
+            timeout=HOST_INVENTORY_TIMEOUT
+        )
+        resp.raise_for_status()
+
+        host_map = {}
+        for item in resp.json()['value']:
+            host_map[item['id']] = item['extensions'].get('folder', '/')
+        return {"hosts": host_map, "source": "rest"}
+
+    async def refresh(self) -> Dict[str, str]:
+        start_time = time.time()
+        if shared_cache is not None:
+            # Con più worker l'inventario viene scaricato da uno solo e condiviso
+            result = await shared_cache.get_or_fetch("host_inventory", self.ttl, self._fetch)
+        else:
+            result = await self._fetch()
+        host_map = result["hosts"]
+        await self._store(host_map, result["source"])
+        logger.info(f"[Inventory] Loaded {len(host_map)} hosts from {result['source']} in {time.time() - start_time:.2f}s")
+        return host_map
+
+    async def _store(self, host_map: Dict[str, str], source: str):
+        self.hosts = host_map
+        self.updated_at = time.monotonic()
+        self.stale = False
+        if snapshot_store is not None:
+            self.snapshot_version = await snapshot_store.save_async("host_inventory", host_map, source)
+
+    def restore_snapshot(self) -> bool:
+        """Carica la mappa dallo snapshot su disco (chiamato allo startup)."""
+        if snapshot_store is None or self.hosts:
+            return False
+        snapshot = snapshot_store.load("host_inventory")
+        if snapshot is None:
+            return False
+        self.hosts = snapshot["data"]
+        self.snapshot_version = snapshot["version"]
+        self.stale = True
+        return True
+
+    def _refresh_in_background(self):
+        if self._background is None or self._background.done():
+            self._background = asyncio.create_task(self._background_refresh())
+
+    async def _background_refresh(self):
+        # Il task copia il contesto della richiesta che l'ha avviato: la sua deadline
+        # (o la disconnessione del client) non deve limitare l'aggiornamento
+        set_deadline(None)
+        try:
+            await self.get_map(force=True)
+        except Exception as e:
+            logger.warning(f"[Inventory] Background refresh failed, still serving snapshot: {e}")
+
+    async def get_map(self, force: bool = False) -> Dict[str, str]:
+        """Ritorna la mappa host -> folder, aggiornandola se scaduta."""
+        if not force and self.is_fresh():
+            return self.hosts
+        if not force and self.stale and self.hosts:
+            # Dati dello snapshot: rispondiamo subito e riallineiamo in background
+            self._refresh_in_background()
+            return self.hosts
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Un'altra richiesta può aver già aggiornato la cache mentre aspettavamo
+            if not force and self.is_fresh():
+                return self.hosts
+            return await self.refresh()
+
+
+# Istanza condivisa da tutte le rotte
+host_inventory = HostInventory(HOST_INVENTORY_TTL)
@@ -0,0 +1,230 @@
+"""
+Client Livestatus (TCP o TLS) usato come backend di lettura veloce.
+
+La REST API di Checkmk interroga comunque livestatus, ma con un overhead
+Python significativo per ogni richiesta. Per le letture più frequenti
+(`/hosts` e `/downtimes`) interroghiamo livestatus direttamente con
+proiezione delle colonne e filtri, riutilizzando le connessioni (KeepAlive).
+Se livestatus non è configurato o fallisce, le rotte usano la REST API.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import ssl
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
+
+from .deadline import clamp_timeout
+
+logger = logging.getLogger("checkmk_api")
+
+# --- CONFIGURAZIONE ---
+LIVESTATUS_HOST = os.getenv("LIVESTATUS_HOST")  # vuoto = livestatus disabilitato
+LIVESTATUS_PORT = int(os.getenv("LIVESTATUS_PORT", "6557"))
+LIVESTATUS_TLS = os.getenv("LIVESTATUS_TLS", "false").lower() in ("1", "true", "yes")
+LIVESTATUS_TLS_VERIFY = os.getenv("LIVESTATUS_TLS_VERIFY", "true").lower() in ("1", "true", "yes")
+LIVESTATUS_CA_FILE = os.getenv("LIVESTATUS_CA_FILE")
+LIVESTATUS_TIMEOUT = float(os.getenv("LIVESTATUS_TIMEOUT", "30"))
+LIVESTATUS_POOL_SIZE = int(os.getenv("LIVESTATUS_POOL_SIZE", "4"))
+
+HOST_COLUMNS = ["name", "filename"]
+DOWNTIME_COLUMNS = [
+    "id", "host_name", "service_description", "is_service", "start_time", "end_time",
+    "fixed", "duration", "recurring", "author", "comment",
+]
+
+
+class LivestatusError(Exception):
+    pass
+
+
+def _check_value(value: str) -> str:
+    # Una query livestatus è testo a righe: un a-capo permetterebbe di iniettare header
+    value = str(value)
+    if "\n" in value or "\r" in value:
+        raise LivestatusError("Invalid character in livestatus value")
+    return value
+
+
+def build_query(table: str, columns: List[str], filters: Optional[List[Tuple[str, str, Any]]] = None,
+                any_of: bool = False) -> str:
+    """Costruisce una query GET; con `any_of` i filtri sono combinati in OR."""
+    lines = [f"GET {table}", f"Columns: {' '.join(columns)}"]
+    filters = filters or []
+    for column, op, value in filters:
+        lines.append(f"Filter: {column} {op} {_check_value(value)}")
+    if any_of and len(filters) > 1:
+        lines.append(f"Or: {len(filters)}")
+    lines += ["OutputFormat: json", "ResponseHeader: fixed16", "KeepAlive: on"]
+    return "\n".join(lines) + "\n\n"
+
+
+def folder_from_filename(filename: str) -> str:
+    """'/wato/clienteA/sub/hosts.mk' -> '/clienteA/sub' (come il folder della REST API)."""
+    path = filename or ""
+    if path.startswith("/wato"):
+        path = path[len("/wato"):]
+    path = path.rsplit("/", 1)[0] if "/" in path else ""
+    return path or "/"
+
+
+def _iso(epoch) -> Optional[str]:
+    if not epoch:
+        return None
+    return datetime.fromtimestamp(int(epoch), tz=timezone.utc).isoformat()
+
+
+def downtime_to_rest(row: Dict[str, Any], site_id: str) -> Dict[str, Any]:
+    """Converte una riga livestatus nel formato dei downtime della REST API."""
+    is_service = bool(row.get("is_service"))
+    extensions = {
+        "site_id": site_id,
+        "host_name": row.get("host_name"),
+        "type": "service" if is_service else "host",
+        "is_service": "yes" if is_service else "no",
+        "start_time": _iso(row.get("start_time")),
+        "end_time": _iso(row.get("end_time")),
+        "recurring": "yes" if row.get("recurring") else "no",
+        "author": row.get("author"),
+        "comment": row.get("comment"),
+    }
+    if is_service:
+        extensions["service_description"] = row.get("service_description")
+    return {
+        "domainType": "downtime",
+        "id": str(row.get("id")),
+        "title": row.get("comment"),
+        "extensions": extensions,
+    }
+
+
+class LivestatusClient:
+    """Client asincrono con un piccolo pool di connessioni KeepAlive."""
+
+    def __init__(self, host: str, port: int, use_tls: bool = False, timeout: float = 30.0, pool_size: int = 4):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.queries = 0
+        self.errors = 0
+
+    def _ssl_context(self):
+        if not self.use_tls:
+            return None
+        context = ssl.create_default_context(cafile=LIVESTATUS_CA_FILE)
+        if not LIVESTATUS_TLS_VERIFY:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    async def _connect(self):
+        try:
+            return await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self._ssl_context()),
+                timeout=clamp_timeout(self.timeout)
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            self.errors += 1
+            raise LivestatusError(f"Cannot connect to livestatus {self.host}:{self.port}: {type(e).__name__} - {e}")
+
+    async def _roundtrip(self, reader, writer, query: str) -> bytes:
+        writer.write(query.encode("utf-8"))
+        await writer.drain()
+        header = await reader.readexactly(16)
+        try:
+            status_code, length = int(header[0:3]), int(header[4:15])
+        except ValueError:
+            raise LivestatusError(f"Invalid livestatus response header: {header!r}")
+        body = await reader.readexactly(length)
+        if status_code != 200:
+            raise LivestatusError(f"Livestatus error {status_code}: {body.decode('utf-8', 'replace').strip()}")
+        return body
+
+    async def raw_query(self, query: str) -> list:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.pool_size)
+        async with self._semaphore:
+            conn = self._idle.pop() if self._idle else None
+            reused = conn is not None
+            if conn is None:
+                conn = await self._connect()
+            reader, writer = conn
+            self.queries += 1
+            try:
+                body = await asyncio.wait_for(self._roundtrip(reader, writer, query), timeout=clamp_timeout(self.timeout))
+            except LivestatusError:
+                self.errors += 1
+                writer.close()
+                raise
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                writer.close()
+                if not reused:
+                    self.errors += 1
+                    raise LivestatusError(f"Livestatus connection error: {type(e).__name__} - {e}")
+                # La connessione riutilizzata può essere stata chiusa lato server: riprova con una nuova
+                reader, writer = await self._connect()
+                try:
+                    body = await asyncio.wait_for(self._roundtrip(reader, writer, query), timeout=clamp_timeout(self.timeout))
+                except Exception as retry_error:
+                    self.errors += 1
+                    writer.close()
+                    raise LivestatusError(f"Livestatus connection error: {type(retry_error).__name__} - {retry_error}")
+            except BaseException:
+                # Cancellazione a metà risposta: la connessione non è più riutilizzabile
+                writer.close()
+                raise
+            try:
+                rows = json.loads(body)
+            except ValueError as e:
+                # Risposta troncata o non JSON: errore livestatus, così le rotte ripiegano sulla REST API
+                self.errors += 1
+                writer.close()
+                raise LivestatusError(f"Invalid livestatus response body: {e}")
+            self._idle.append((reader, writer))
+            return rows
+
+    async def query(self, table: str, columns: List[str], filters=None, any_of: bool = False) -> List[Dict[str, Any]]:
+        rows = await self.raw_query(build_query(table, columns, filters, any_of))
+        return [dict(zip(columns, row)) for row in rows]
+
+    async def get_host_map(self) -> Dict[str, str]:
+        rows = await self.query("hosts", HOST_COLUMNS)
+        return {row["name"]: folder_from_filename(row["filename"]) for row in rows}
+
+    async def get_downtimes(self, hosts: Optional[List[str]] = None,
+                            host_groups: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Downtime (host e servizi) per una lista di host o di host group, in una sola query."""
+        filters = []
+        if hosts:
+            filters += [("host_name", "=", h) for h in hosts]
+        if host_groups:
+            filters += [("host_groups", ">=", g) for g in host_groups]
+        return await self.query("downtimes", DOWNTIME_COLUMNS, filters, any_of=True)
+
+    async def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "host": self.host,
+            "port": self.port,
+            "tls": self.use_tls,
+            "queries": self.queries,
+            "errors": self.errors,
+            "idle_connections": len(self._idle),
+        }
+
+
+# Client condiviso, presente solo se LIVESTATUS_HOST è configurato
+livestatus_client: Optional[LivestatusClient] = (
+    LivestatusClient(LIVESTATUS_HOST, LIVESTATUS_PORT, LIVESTATUS_TLS, LIVESTATUS_TIMEOUT, LIVESTATUS_POOL_SIZE)
+    if LIVESTATUS_HOST else None
+)
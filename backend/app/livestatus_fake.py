@@ -0,0 +1,168 @@
+"""
+Server livestatus finto, per provare il connettore senza un Checkmk reale.
+
+Implementa il sottoinsieme del protocollo usato da `livestatus.py`: GET,
+Columns, Filter (=, !=, <, <=, >, >=), Or, OutputFormat json,
+ResponseHeader fixed16 e KeepAlive.
+
+Avvio:  python -m app.livestatus_fake --port 6557
+poi:    LIVESTATUS_HOST=127.0.0.1 uvicorn app.main:app
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, List, Any, Tuple
+
+logger = logging.getLogger("checkmk_api")
+
+
+def sample_tables() -> Dict[str, List[Dict[str, Any]]]:
+    """Dati di esempio: due clienti con qualche host e un paio di downtime."""
+    now = int(time.time())
+    hosts = [
+        {"name": "srv-a1", "filename": "/wato/clienteA/hosts.mk", "host_groups": ["clienteA"]},
+        {"name": "srv-a2", "filename": "/wato/clienteA/hosts.mk", "host_groups": ["clienteA"]},
+        {"name": "srv-b1", "filename": "/wato/clienteB/prod/hosts.mk", "host_groups": ["clienteB"]},
+        {"name": "localhost", "filename": "/wato/hosts.mk", "host_groups": []},
+    ]
+    downtimes = [
+        {"id": 1, "host_name": "srv-a1", "service_description": "", "is_service": 0,
+         "start_time": now - 3600, "end_time": now + 3600, "fixed": 1, "duration": 0,
+         "recurring": 0, "author": "automation", "comment": "Manutenzione programmata",
+         "host_groups": ["clienteA"]},
+        {"id": 2, "host_name": "srv-b1", "service_description": "CPU load", "is_service": 1,
+         "start_time": now + 86400, "end_time": now + 90000, "fixed": 1, "duration": 0,
+         "recurring": 0, "author": "automation", "comment": "Patch notturne",
+         "host_groups": ["clienteB"]},
+    ]
+    return {"hosts": hosts, "downtimes": downtimes}
+
+
+def _matches(row: Dict[str, Any], column: str, op: str, value: str) -> bool:
+    cell = row.get(column)
+    if isinstance(cell, list):
+        # Per le colonne lista livestatus usa ">=" come "contiene"
+        return value in cell if op == ">=" else value not in cell if op == "!=" else False
+    if isinstance(cell, (int, float)):
+        try:
+            value = type(cell)(value)
+        except ValueError:
+            return False
+    else:
+        cell = "" if cell is None else str(cell)
+    return {
+        "=": cell == value, "!=": cell != value,
+        "<": cell < value, "<=": cell <= value,
+        ">": cell > value, ">=": cell >= value,
+    }.get(op, False)
+
+
+class FakeLivestatusServer:
+    def __init__(self, tables: Dict[str, List[Dict[str, Any]]] = None):
+        self.tables = tables if tables is not None else sample_tables()
+        self.queries = 0
+        self._server = None
+        self._writers = set()
+        self._handlers = set()
+
+    def execute(self, lines: List[str]) -> Tuple[int, str, Dict[str, str]]:
+        """Esegue una query e ritorna (status, body, header della query)."""
+        headers: Dict[str, str] = dict(
+            line.partition(": ")[::2] for line in lines[1:]
+            if line.partition(": ")[0] not in ("Columns", "Filter", "Or", "And")
+        )
+        if not lines or not lines[0].startswith("GET "):
+            return 400, "Invalid request method", headers
+        table = lines[0][4:].strip()
+        if table not in self.tables:
+            return 404, f"Invalid GET request, no such table '{table}'", headers
+
+        columns: List[str] = []
+        stack: List[Any] = []  # ogni elemento è un predicato riga -> bool
+        for line in lines[1:]:
+            key, _, value = line.partition(": ")
+            if key == "Columns":
+                columns = value.split()
+            elif key == "Filter":
+                column, op, operand = (value.split(" ", 2) + [""])[:3]
+                stack.append(lambda row, c=column, o=op, v=operand: _matches(row, c, o, v))
+            elif key in ("Or", "And"):
+                n = int(value)
+                if n > len(stack):
+                    return 400, f"{key}: {n} exceeds number of filters", headers
+                group, stack = stack[len(stack) - n:], stack[:len(stack) - n]
+                combine = any if key == "Or" else all
+                stack.append(lambda row, g=group, f=combine: f(p(row) for p in g))
+
+        rows = [row for row in self.tables[table] if all(p(row) for p in stack)]
+        if not columns:
+            columns = sorted({k for row in self.tables[table] for k in row})
+        return 200, json.dumps([[row.get(c) for c in columns] for row in rows]), headers
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                lines = []
+                while True:
+                    raw = await reader.readline()
+                    if not raw:
+                        return
+                    line = raw.decode("utf-8").rstrip("\n")
+                    if line == "":
+                        break
+                    lines.append(line)
+                self.queries += 1
+                status_code, body, headers = self.execute(lines)
+                payload = body.encode("utf-8") + b"\n"
+                if headers.get("ResponseHeader") == "fixed16":
+                    writer.write(f"{status_code:03d} {len(payload):11d}\n".encode("ascii"))
+                writer.write(payload)
+                await writer.drain()
+                if headers.get("KeepAlive") != "on":
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    def drop_connections(self):
+        """Chiude le connessioni aperte, come un riavvio di livestatus lato server."""
+        for writer in list(self._writers):
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """Avvia il server; con port=0 sceglie una porta libera e la ritorna."""
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            # Le connessioni chiuse fanno terminare gli handler in attesa di una query
+            self.drop_connections()
+            if self._handlers:
+                await asyncio.wait(set(self._handlers), timeout=1)
+            await self._server.wait_closed()
+
+
+async def _serve(host: str, port: int):
+    server = FakeLivestatusServer()
+    bound = await server.start(host, port)
+    logger.info(f"Fake livestatus listening on {host}:{bound}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake livestatus server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6557)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_serve(args.host, args.port))
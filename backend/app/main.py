@@ -2,8 +2,6 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import os
 import logging
-import time
-import requests
 from dotenv import load_dotenv
 
 # Importa il router dal tuo file routes.py
@@ -12,6 +10,16 @@ from .routes import router as api_router
 from .routes_logs import router as logs_router
 from .routes_cloudconnexa import router as cloudconnexa_router
 from .routes_sap import router as sap_router
+from .checkmk_health import health_prober
+from .checkmk_client import close_checkmk_session
+from .livestatus import livestatus_client
+from .warmup import warmup
+from .write_scheduler import write_scheduler
+from .downtime_index import downtime_index
+from .host_inventory import host_inventory
+from .admission import AdmissionMiddleware
+from .deadline import DeadlineMiddleware
+from .athena import stop_running_queries
 
 # Configura il logging
 logging.basicConfig(
@@ -28,6 +36,11 @@ load_dotenv()
 # Crea l'app FastAPI
 app = FastAPI(title="Checkmk Downtime API")
 
+# Admission control sugli endpoint costosi (aggiunto prima di CORS, così anche i 429 hanno gli header CORS)
+app.add_middleware(AdmissionMiddleware)
+# Deadline e cancellazione su disconnessione (esterno all'admission: l'attesa in coda consuma la deadline)
+app.add_middleware(DeadlineMiddleware)
+
 # Configurazione CORS
 origins = [
     "http://localhost",
@@ -55,12 +68,11 @@ app.include_router(sap_router, prefix="/api")
 # Le rotte /api/hosts, /api/downtime, /api/downtimes, /api/test-connection
 # sono state rimosse da qui perché ora sono gestite da routes.py
 
-# Configurazione Checkmk (usata solo per il test di avvio)
+# Configurazione Checkmk (usata solo per il log di avvio)
 CHECKMK_HOST = os.getenv("CHECKMK_HOST")
 CHECKMK_SITE = os.getenv("CHECKMK_SITE")
 CHECKMK_USER = os.getenv("CHECKMK_USER")
 CHECKMK_PASSWORD = os.getenv("CHECKMK_PASSWORD")
-CHECKMK_API_URL = f"https://{CHECKMK_HOST}/{CHECKMK_SITE}/check_mk/api/1.0"
 
 # Verifica la presenza delle variabili d'ambiente
 logger.info("Starting application with configuration:")
@@ -69,39 +81,6 @@ logger.info(f"CHECKMK_SITE: {CHECKMK_SITE}")
 logger.info(f"CHECKMK_USER: {CHECKMK_USER}")
 logger.info(f"CHECKMK_PASSWORD: {'*****' if CHECKMK_PASSWORD else 'Not set'}")
 
-# Funzione di utilità per il test di connessione (usata solo allo startup)
-def test_checkmk_connection():
-    # NOTA: questa sessione è diversa da quella usata in routes.py
-    # Questa usa 'requests', routes.py usa 'httpx'
-    session = requests.session()
-    session.headers['Authorization'] = f"Bearer {CHECKMK_USER} {CHECKMK_PASSWORD}"
-    session.headers['Accept'] = 'application/json'
-    
-    logger.info("Testing connection to Checkmk server...")
-    start_time = time.time()
-    
-    try:
-        response = session.get(f"{CHECKMK_API_URL}/version", timeout=10)
-        
-        if response.status_code == 200:
-            end_time = time.time()
-            response_time = round(end_time - start_time, 2)
-            
-            version = response.json().get("value", "unknown")
-            logger.info(f"Connection successful! Response time: {response_time}s")
-            logger.info(f"Checkmk version: {version}")
-            
-            return f"Connected to Checkmk v{version} in {response_time}s"
-        else:
-            logger.error(f"Connection error: HTTP {response.status_code}")
-            return f"Connection error: HTTP {response.status_code}"
-    except requests.exceptions.Timeout:
-        logger.error("Connection timed out (>10s)")
-        return "Connection timed out (>10s)"
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Connection error: {str(e)}")
-        return f"Connection error: {str(e)}"
-
 # Rotta principale
 @app.get("/")
 def root():
@@ -114,19 +93,34 @@ async def startup_event():
     logger.info("          Checkmk Downtime API Started              ")
     logger.info("=" * 52)
     
-    # Testa la connessione a Checkmk
-    connection_result = test_checkmk_connection()
-    if "Connected to Checkmk" in connection_result:
-        logger.info(f"✅ Successfully connected to Checkmk: {connection_result}")
-    else:
-        logger.error(f"❌ Failed to connect to Checkmk: {connection_result}")
+    # Nessuna chiamata bloccante allo startup: connessione a Checkmk, inventario,
+    # JWKS e filtri Athena vengono preparati in background (vedi /api/health/ready)
+    # Inventario e downtime dell'ultima esecuzione, serviti finché il warm-up non li riallinea
+    if host_inventory.restore_snapshot():
+        logger.info(f"Restored {len(host_inventory.hosts)} hosts from snapshot v{host_inventory.snapshot_version}")
+    if downtime_index.restore_snapshot(host_inventory.hosts):
+        logger.info(f"Restored {len(downtime_index.all)} downtimes from snapshot v{downtime_index.snapshot_version}")
+
+    health_prober.start()
+    warmup.start()
+    downtime_index.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await warmup.stop()
+    await health_prober.stop()
+    await downtime_index.stop()
+    await write_scheduler.stop()
+    await stop_running_queries()
+    await close_checkmk_session()
+    if livestatus_client:
+        await livestatus_client.close()
     logger.info("=" * 52)
     logger.info("          Checkmk Downtime API Stopped              ")
     logger.info("=" * 52)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    from .shared_cache import WEB_CONCURRENCY
+    # Con più worker uvicorn richiede l'app come stringa di import
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, workers=WEB_CONCURRENCY)
\ No newline at end of file
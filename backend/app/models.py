@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Union
+from typing import List, Dict, Literal, Optional, Union
 from datetime import datetime
 
 class DowntimeRequest(BaseModel):
@@ -12,6 +12,8 @@ class DowntimeRequest(BaseModel):
     batch_size: Optional[int] = 3
     delay: Optional[float] = 1.0
     specific_date: Optional[str] = None  # NEW: For specific date scheduling
+    response_mode: Literal["summary", "full"] = "summary"  # "full" aggiunge l'esito di ogni item
+    skip_conflicts: bool = False  # salta gli slot già coperti da un downtime dello stesso host
 
 class HostWithFolder(BaseModel):
     id: str
@@ -27,14 +29,34 @@ class StatsResponse(BaseModel):
     totalHosts: int
     activeDowntimes: int
 
+class FailureGroup(BaseModel):
+    count: int
+    example: str
+
 class DowntimeResponse(BaseModel):
+    # Job completo se created + skipped + failed == total (coppie host/slot uniche)
     start_times: List[str]
     end_times: List[str]
-    responses: List[str]
+    total: int = 0
+    created: int = 0
+    skipped: int = 0
+    duplicates: int = 0                                   # coppie host/slot ripetute nella richiesta (fuori da total)
+    conflicts: int = 0                                    # slot saltati per sovrapposizione (inclusi in skipped)
+    failed: int = 0
+    failures_by_host: Dict[str, Dict[str, int]] = {}      # host -> classe errore -> conteggio
+    failures_by_class: Dict[str, FailureGroup] = {}
+    responses: Optional[List[Optional[str]]] = None       # solo con response_mode="full"
 
 class ConnectionTestResponse(BaseModel):
     status: str
     message: str
+    version: Optional[str] = None
+    last_latency: Optional[float] = None
+    last_probe: Optional[str] = None
+    last_success: Optional[str] = None
+    consecutive_failures: int = 0
+    samples: int = 0
+    latency_percentiles: Dict[str, Optional[float]] = {}
 
 class DowntimeDeleteRequest(BaseModel):
     downtime_id: str
@@ -46,4 +68,19 @@ class BatchDeleteRequest(BaseModel):
 class BatchDeleteResponse(BaseModel):
     succeeded: int
     failed: int
-    errors: List[str]
\ No newline at end of file
+    errors: List[str]
+
+class DeleteByFilterRequest(BaseModel):
+    folder: Optional[str] = None              # cliente (folder Checkmk)
+    hosts: List[str] = []
+    start: Optional[str] = None               # ISO datetime: downtime che finiscono dopo
+    end: Optional[str] = None                 # ISO datetime: downtime che iniziano prima
+    dry_run: bool = False
+
+class DeleteByFilterResponse(BaseModel):
+    dry_run: bool
+    hosts: Optional[int] = None  # None = nessun filtro host (solo intervallo temporale)
+    matched: int
+    deleted: int
+    calls: int
+    errors: List[str]
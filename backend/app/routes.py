@@ -1,51 +1,45 @@
 from starlette.responses import Response
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import requests
 import httpx
 import asyncio
 import os
+import json
 import logging
 import time
 import traceback
 from datetime import datetime, date, timedelta
 import calendar
-from .models import DowntimeRequest, HostResponse, ClientResponse, StatsResponse, DowntimeResponse, ConnectionTestResponse, BatchDeleteRequest, BatchDeleteResponse
+from .models import DowntimeRequest, HostResponse, ClientResponse, StatsResponse, DowntimeResponse, ConnectionTestResponse, BatchDeleteRequest, BatchDeleteResponse, DeleteByFilterRequest, DeleteByFilterResponse
 from .dependencies import get_current_user
+from .checkmk_limiter import checkmk_limiter
+from .checkmk_hedge import checkmk_hedger
+from .checkmk_client import get_checkmk_config, get_checkmk_session
+from .host_inventory import host_inventory
+from .livestatus import livestatus_client, downtime_to_rest, LivestatusError
+from .warmup import warmup
+from .checkmk_health import health_prober
+from .write_scheduler import write_scheduler
+from .downtime_index import downtime_index
+from .folder_tree import folder_tree, FOLDER_TREE_UPCOMING_HOURS
+from .snapshot_store import snapshot_store
+from .shared_cache import shared_cache
+from .admission import admission_controller
+from .deadline import deadline_stats
+from .athena_cache import athena_cache
+from .athena import athena_stats
 
 logger = logging.getLogger("checkmk_api")
 
 router = APIRouter()
 
-def get_checkmk_config():
-    config = {
-        "host": os.environ.get("CHECKMK_HOST", "monitor-horsarun.horsa.it"),
-        "site": os.environ.get("CHECKMK_SITE", "mkhrun"),
-        "user": os.environ.get("CHECKMK_USER", "demousera"),
-        "password": os.environ.get("CHECKMK_PASSWORD"),
-    }
-    return config
-
-async def get_all_hosts_map(config: dict, headers: dict) -> Dict[str, str]:
-    api_url = f"https://{config['host']}/{config['site']}/check_mk/api/1.0"
+async def get_all_hosts_map() -> Dict[str, str]:
     logger.info("[Helper] Fetching host map...")
     
     try:
-        async with httpx.AsyncClient(headers=headers, timeout=30.0, verify=False) as session:
-            resp = await session.get(
-                f"{api_url}/domain-types/host_config/collections/all",
-                params={"effective_attributes": False}
-            )
-        resp.raise_for_status()
-        
-        host_map = {}
-        data = resp.json()
-        for item in data['value']:
-            host_id = item['id']
-            folder = item['extensions'].get('folder', '/')
-            host_map[host_id] = folder
-            
-        logger.info(f"[Helper] Host map created with {len(host_map)} entries.")
+        host_map = await host_inventory.get_map()
+        logger.info(f"[Helper] Host map ready with {len(host_map)} entries.")
         return host_map
     except httpx.HTTPStatusError as e:
         logger.error(f"[Helper] API error fetching hosts: {e.response.status_code} - {e.response.text}")
@@ -55,43 +49,46 @@ async def get_all_hosts_map(config: dict, headers: dict) -> Dict[str, str]:
         logger.error(f"[Helper] Traceback: {traceback.format_exc()}")
         return {}
 
-async def test_checkmk_connection() -> Dict[str, str]:
-    try:
-        logger.info("Testing connection to Checkmk server...")
-        config = get_checkmk_config()
-        api_url = f"https://{config['host']}/{config['site']}/check_mk/api/1.0"
-        
-        headers = {
-            'Authorization': f"Bearer {config['user']} {config['password']}",
-            'Accept': 'application/json'
-        }
-        
-        start_time = time.time()
-        
-        async with httpx.AsyncClient(headers=headers, timeout=10.0, verify=False) as session:
-            resp = await session.get(f"{api_url}/version")
-        
-        response_time = time.time() - start_time
-        
-        if resp.status_code == 200:
-            version_info = resp.json() if resp.text else {"version": "unknown"}
-            logger.info(f"Connection successful! Response time: {response_time:.2f}s")
-            logger.info(f"Checkmk version: {version_info.get('version', 'unknown')}")
-            return {
-                "status": "success", 
-                "message": f"Connected to Checkmk v{version_info.get('version', 'unknown')} in {response_time:.2f}s"
-            }
-        else:
-            logger.error(f"Connection failed with status code: {resp.status_code}")
-            return {"status": "error", "message": f"Failed with status {resp.status_code}: {resp.text}"}
-    except Exception as e:
-        logger.error(f"Connection error: {str(e)}")
-        return {"status": "error", "message": f"Connection error: {str(e)}"}
-
 @router.get("/connection-test", response_model=ConnectionTestResponse)
-async def connection_test():
-    result = await test_checkmk_connection()
-    return result
+async def connection_test(refresh: bool = False):
+    # Risponde dallo stato del prober in background; refresh=true forza un probe immediato
+    if refresh:
+        await health_prober.probe_once()
+    return health_prober.snapshot()
+
+@router.get("/health/live")
+async def liveness():
+    """Liveness del processo: non dipende da Checkmk."""
+    return {"status": "ok"}
+
+@router.get("/health/ready")
+async def readiness(response: Response):
+    """
+    Readiness: 200 solo quando il warm-up di startup è completato e i task
+    critici (pool Checkmk, inventario host) sono riusciti; se uno è fallito
+    resta 503 finché il ritentativo in background non va a buon fine. Gli
+    errori di JWKS e filtri Athena non bloccano la readiness.
+    """
+    if not warmup.is_ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return warmup.snapshot()
+
+@router.get("/metrics")
+async def get_metrics():
+    """Metriche interne del backend (limiter, hedging, livestatus, scritture e indice downtime)."""
+    return {
+        "checkmk_limiter": checkmk_limiter.stats(),
+        "checkmk_hedging": checkmk_hedger.stats(),
+        "livestatus": livestatus_client.stats() if livestatus_client else None,
+        "write_scheduler": write_scheduler.stats(),
+        "downtime_index": downtime_index.stats(),
+        "snapshots": snapshot_store.stats() if snapshot_store else None,
+        "shared_cache": shared_cache.stats() if shared_cache else None,
+        "admission": admission_controller.stats(),
+        "deadlines": dict(deadline_stats),
+        "athena": athena_stats(),
+        "athena_cache": athena_cache.stats(),
+    }
 
 def calcolo_dst(day):
     logger.debug(f"Calculating DST for date: {day}")
@@ -129,35 +126,18 @@ async def get_hosts(request: Request, token: str = Depends(get_current_user)):
     request_id = f"req-{int(time.time())}"
     logger.info(f"[{request_id}] GET /hosts - Request received")
     
-    config = get_checkmk_config()
-    api_url = f"https://{config['host']}/{config['site']}/check_mk/api/1.0"
-    
-    headers = {
-        'Authorization': f"Bearer {config['user']} {config['password']}",
-        'Accept': 'application/json'
-    }
-    
     try:
-        logger.info(f"[{request_id}] Connecting to Checkmk API (async): {api_url}")
-        
-        async with httpx.AsyncClient(headers=headers, timeout=30.0, verify=False) as session:
-            start_time = time.time()
-            resp = await session.get(
-                f"{api_url}/domain-types/host_config/collections/all",
-                params={"effective_attributes": False}
-            )
-            response_time = time.time() - start_time
-        
-        logger.info(f"[{request_id}] API response received in {response_time:.2f}s with status: {resp.status_code}")
+        start_time = time.time()
+        host_map = await host_inventory.get_map()
+        response_time = time.time() - start_time
         
-        resp.raise_for_status()
+        logger.info(f"[{request_id}] Host inventory ready in {response_time:.2f}s")
         
         host_list = []
-        data = resp.json()
-        for item in data['value']:
+        for host_id, folder in host_map.items():
             host_obj = {
-                'id': item['id'],
-                'folder': item['extensions'].get('folder', '/')
+                'id': host_id,
+                'folder': folder
             }
             host_list.append(host_obj)
 
@@ -184,34 +164,14 @@ async def get_clients(request: Request, token: str = Depends(get_current_user)):
     request_id = f"req-{int(time.time())}"
     logger.info(f"[{request_id}] GET /clients - Request received")
 
-    config = get_checkmk_config()
-    api_url = f"https://{config['host']}/{config['site']}/check_mk/api/1.0"
-
-    headers = {
-        'Authorization': f"Bearer {config['user']} {config['password']}",
-        'Accept': 'application/json'
-    }
-
     try:
-        logger.info(f"[{request_id}] Connecting to Checkmk API (async): {api_url}")
-
-        async with httpx.AsyncClient(headers=headers, timeout=30.0, verify=False) as session:
-            start_time = time.time()
-            resp = await session.get(
-                f"{api_url}/domain-types/host_config/collections/all",
-                params={"effective_attributes": False}
-            )
-            response_time = time.time() - start_time
+        start_time = time.time()
+        host_map = await host_inventory.get_map()
+        response_time = time.time() - start_time
 
-        logger.info(f"[{request_id}] API response received in {response_time:.2f}s with status: {resp.status_code}")
-        
-        resp.raise_for_status()
+        logger.info(f"[{request_id}] Host inventory ready in {response_time:.2f}s")
 
-        data = resp.json()
-        folders = set()
-        for item in data['value']:
-            folder = item['extensions'].get('folder', '/')
-            folders.add(folder)
+        folders = set(host_map.values())
 
         client_list = sorted(list(folders))
         logger.info(f"[{request_id}] Successfully retrieved {len(client_list)} unique clients")
@@ -232,37 +192,60 @@ async def get_clients(request: Request, token: str = Depends(get_current_user)):
             detail=error_msg
         )
 
+@router.get("/clients/tree")
+async def get_clients_tree(
+    request: Request,
+    token: str = Depends(get_current_user),
+    folder: str = None,
+    depth: int = None
+):
+    """Albero dei folder con host, host in downtime e downtime in arrivo per sottoalbero."""
+    request_id = f"req-{int(time.time())}"
+    logger.info(f"[{request_id}] GET /clients/tree - folder={folder}, depth={depth}")
+
+    try:
+        host_map = await host_inventory.get_map()
+    except httpx.HTTPStatusError as e:
+        logger.error(f"[{request_id}] API error: {e.response.status_code} - {e.response.text}")
+        raise HTTPException(
+            status_code=e.response.status_code,
+            detail=f"Error from Checkmk API: {e.response.status_code} - {e.response.text}"
+        )
+    except Exception as e:
+        error_msg = f"Failed to fetch clients: {str(e)}"
+        logger.error(f"[{request_id}] {error_msg}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=error_msg
+        )
+    index = await get_downtime_index(request_id)
+
+    # Solo gli host cambiati dall'ultima chiamata aggiornano gli aggregati
+    folder_tree.refresh(host_map, host_inventory.updated_at, index)
+    tree = folder_tree.subtree(folder, depth)
+    if tree is None:
+        raise HTTPException(status_code=404, detail=f"Folder not found: {folder}")
+
+    return {
+        "tree": tree,
+        "upcoming_hours": FOLDER_TREE_UPCOMING_HOURS,
+        "index_updated_at": index.updated_at_iso(),
+    }
+
 @router.get("/stats", response_model=StatsResponse)
 async def get_stats(request: Request, token: str = Depends(get_current_user)):
     request_id = f"req-{int(time.time())}"
     logger.info(f"[{request_id}] GET /stats - Request received")
     
-    config = get_checkmk_config()
-    api_url = f"https://{config['host']}/{config['site']}/check_mk/api/1.0"
-    
-    headers = {
-        'Authorization': f"Bearer {config['user']} {config['password']}",
-        'Accept': 'application/json'
-    }
-    
     try:
-        logger.info(f"[{request_id}] Connecting to Checkmk API (async): {api_url}")
-        
-        async with httpx.AsyncClient(headers=headers, timeout=30.0, verify=False) as session:
-            logger.info(f"[{request_id}] Fetching hosts data...")
-            start_time = time.time()
-            hosts_resp = await session.get(
-                f"{api_url}/domain-types/host_config/collections/all",
-                params={"effective_attributes": False}
-            )
-            hosts_time = time.time() - start_time
-        
-        logger.info(f"[{request_id}] Hosts data received in {hosts_time:.2f}s with status: {hosts_resp.status_code}")
+        logger.info(f"[{request_id}] Fetching hosts data...")
+        start_time = time.time()
+        host_map = await host_inventory.get_map()
+        hosts_time = time.time() - start_time
         
-        hosts_resp.raise_for_status()
+        logger.info(f"[{request_id}] Hosts data ready in {hosts_time:.2f}s")
         
-        hosts_data = hosts_resp.json()
-        host_count = len(hosts_data['value']) if 'value' in hosts_data else 0
+        host_count = len(host_map)
         
         logger.info(f"[{request_id}] Successfully retrieved stats: {host_count} hosts")
         
@@ -287,6 +270,20 @@ async def get_stats(request: Request, token: str = Depends(get_current_user)):
             detail=error_msg
         )
 
+async def get_downtimes_from_livestatus(request_id: str, hosts: List[str], config: dict) -> Optional[List[dict]]:
+    """Downtime degli host con una sola query livestatus; None se non disponibile."""
+    if livestatus_client is None:
+        return None
+    try:
+        start_time = time.time()
+        rows = await livestatus_client.get_downtimes(hosts=hosts)
+        downtimes = [downtime_to_rest(row, config['site']) for row in rows]
+        logger.info(f"[{request_id}] Livestatus returned {len(downtimes)} downtimes in {time.time() - start_time:.2f}s")
+        return downtimes
+    except LivestatusError as e:
+        logger.warning(f"[{request_id}] Livestatus failed, falling back to REST API: {e}")
+        return None
+
 @router.get("/downtimes")
 async def get_downtimes(
     request: Request, 
@@ -299,81 +296,82 @@ async def get_downtimes(
     
     config = get_checkmk_config()
     api_url = f"https://{config['host']}/{config['site']}/check_mk/api/1.0"
-    
-    headers = {
-        'Authorization': f"Bearer {config['user']} {config['password']}",
-        'Accept': 'application/json'
-    }
+    session = get_checkmk_session()
 
     try:
         all_downtimes = []
         
-        async with httpx.AsyncClient(headers=headers, timeout=300.0, verify=False) as session:
+        if cliente:
+            logger.info(f"[{request_id}] Filtering by cliente: {cliente}")
             
-            if cliente:
-                logger.info(f"[{request_id}] Filtering by cliente: {cliente}")
-                
-                host_map = await get_all_hosts_map(config, headers)
-                if not host_map:
-                    raise HTTPException(status_code=500, detail="Could not fetch host list to filter by client")
-                
-                hosts_in_cliente = [host_name for host_name, folder in host_map.items() if folder == cliente]
-                
-                if not hosts_in_cliente:
-                    logger.warning(f"[{request_id}] No hosts found for cliente: {cliente}")
-                    return {"downtimes": []}
-                
-                logger.info(f"[{request_id}] Found {len(hosts_in_cliente)} hosts for cliente. Fetching downtimes in parallel...")
-                
-                MAX_CONCURRENT_REQUESTS = 20
-                semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-                
-                tasks = []
-
-                async def get_with_semaphore(host_name):
-                    async with semaphore:
-                        query_params = {"host_name": host_name}
-                        logger.debug(f"[{request_id}] Fetching downtime for {host_name}")
-                        return await session.get(
-                            f"{api_url}/domain-types/downtime/collections/all",
-                            params=query_params
-                        )
-
-                for host_name in hosts_in_cliente:
-                    tasks.append(get_with_semaphore(host_name))
-                
-                logger.info(f"[{request_id}] Executing {len(tasks)} GET requests (limited to {MAX_CONCURRENT_REQUESTS} at a time)...")
-                start_time = time.time()
-                responses = await asyncio.gather(*tasks, return_exceptions=True)
-                response_time = time.time() - start_time
-                logger.info(f"[{request_id}] Parallel fetch completed in {response_time:.2f}s")
-
-                for resp in responses:
-                    if isinstance(resp, httpx.Response) and resp.status_code == 200:
-                        data = resp.json()
-                        all_downtimes.extend(data.get('value', []))
-                    elif isinstance(resp, Exception):
-                        logger.error(f"[{request_id}] Parallel task failed: {type(resp).__name__} - {str(resp)}")
-                
-            elif host:
-                logger.info(f"[{request_id}] Filtering by single host: {host}")
-                query_params = {"host_name": host}
-                start_time = time.time()
-                resp = await session.get(
-                    f"{api_url}/domain-types/downtime/collections/all",
-                    params=query_params
-                )
-                response_time = time.time() - start_time
-                logger.info(f"[{request_id}] API response received in {response_time:.2f}s with status: {resp.status_code}")
-                
-                resp.raise_for_status()
-                data = resp.json()
-                all_downtimes = data.get('value', [])
-                
-            else:
-                logger.warning(f"[{request_id}] No filter (host or cliente) provided. Returning empty list.")
+            host_map = await get_all_hosts_map()
+            if not host_map:
+                raise HTTPException(status_code=500, detail="Could not fetch host list to filter by client")
+            
+            hosts_in_cliente = [host_name for host_name, folder in host_map.items() if folder == cliente]
+            
+            if not hosts_in_cliente:
+                logger.warning(f"[{request_id}] No hosts found for cliente: {cliente}")
                 return {"downtimes": []}
-        
+            
+            logger.info(f"[{request_id}] Found {len(hosts_in_cliente)} hosts for cliente.")
+            
+            livestatus_downtimes = await get_downtimes_from_livestatus(request_id, hosts_in_cliente, config)
+            if livestatus_downtimes is not None:
+                return {"downtimes": livestatus_downtimes}
+            
+            logger.info(f"[{request_id}] Fetching downtimes in parallel via REST API...")
+            
+            tasks = []
+
+            # La concorrenza è regolata dal limiter globale (budget read)
+            async def get_host_downtimes(host_name):
+                query_params = {"host_name": host_name}
+                logger.debug(f"[{request_id}] Fetching downtime for {host_name}")
+                return await checkmk_hedger.get(
+                    session, f"{api_url}/domain-types/downtime/collections/all",
+                    key="downtime/collections/all", params=query_params
+                )
+
+            for host_name in hosts_in_cliente:
+                tasks.append(get_host_downtimes(host_name))
+            
+            logger.info(f"[{request_id}] Executing {len(tasks)} GET requests (limited to {checkmk_limiter.read.max_in_flight} at a time)...")
+            start_time = time.time()
+            responses = await asyncio.gather(*tasks, return_exceptions=True)
+            response_time = time.time() - start_time
+            logger.info(f"[{request_id}] Parallel fetch completed in {response_time:.2f}s")
+
+            for resp in responses:
+                if isinstance(resp, httpx.Response) and resp.status_code == 200:
+                    data = resp.json()
+                    all_downtimes.extend(data.get('value', []))
+                elif isinstance(resp, Exception):
+                    logger.error(f"[{request_id}] Parallel task failed: {type(resp).__name__} - {str(resp)}")
+            
+        elif host:
+            logger.info(f"[{request_id}] Filtering by single host: {host}")
+            livestatus_downtimes = await get_downtimes_from_livestatus(request_id, [host], config)
+            if livestatus_downtimes is not None:
+                return {"downtimes": livestatus_downtimes}
+            
+            query_params = {"host_name": host}
+            start_time = time.time()
+            resp = await checkmk_hedger.get(
+                session, f"{api_url}/domain-types/downtime/collections/all",
+                key="downtime/collections/all", params=query_params
+            )
+            response_time = time.time() - start_time
+            logger.info(f"[{request_id}] API response received in {response_time:.2f}s with status: {resp.status_code}")
+            
+            resp.raise_for_status()
+            data = resp.json()
+            all_downtimes = data.get('value', [])
+            
+        else:
+            logger.warning(f"[{request_id}] No filter (host or cliente) provided. Returning empty list.")
+            return {"downtimes": []}
+    
         logger.info(f"[{request_id}] Successfully retrieved {len(all_downtimes)} total downtimes")
         return {"downtimes": all_downtimes}
         
@@ -393,7 +391,85 @@ async def get_downtimes(
         )
         
         
-@router.post("/schedule", response_model=DowntimeResponse)
+async def get_downtime_index(request_id: str):
+    """Indice dei downtime aggiornato; errori Checkmk convertiti in HTTPException."""
+    try:
+        return await downtime_index.ensure_fresh()
+    except httpx.HTTPStatusError as e:
+        logger.error(f"[{request_id}] API error: {e.response.status_code} - {e.response.text}")
+        raise HTTPException(
+            status_code=e.response.status_code,
+            detail=f"Error from Checkmk API: {e.response.status_code} - {e.response.text}"
+        )
+    except Exception as e:
+        error_msg = f"Failed to load downtime index: {str(e)}"
+        logger.error(f"[{request_id}] {error_msg}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=error_msg
+        )
+
+@router.get("/downtimes/active")
+async def get_active_downtimes(
+    request: Request,
+    token: str = Depends(get_current_user),
+    at: str = None,
+    folder: str = None
+):
+    """
+    Downtime attivi all'istante `at` (ISO, default adesso), opzionalmente per
+    cliente: `folder` include le sottocartelle, come /clients/tree.
+    """
+    request_id = f"req-{int(time.time())}"
+    logger.info(f"[{request_id}] GET /downtimes/active - at={at}, folder={folder}")
+
+    at_ts = parse_filter_datetime(at, "at") if at else int(time.time())
+    index = await get_downtime_index(request_id)
+    downtimes = index.active_at(at_ts, folder)
+
+    logger.info(f"[{request_id}] {len(downtimes)} downtimes active at {at_ts}")
+    return {
+        "at": datetime.fromtimestamp(at_ts).isoformat(),
+        "count": len(downtimes),
+        "index_updated_at": index.updated_at_iso(),
+        "downtimes": downtimes,
+    }
+
+@router.get("/downtimes/overlapping")
+async def get_overlapping_downtimes(
+    request: Request,
+    token: str = Depends(get_current_user),
+    start: str = None,
+    end: str = None,
+    folder: str = None
+):
+    """
+    Downtime che si sovrappongono all'intervallo [start, end], opzionalmente per
+    cliente (`folder` include le sottocartelle).
+    """
+    request_id = f"req-{int(time.time())}"
+    logger.info(f"[{request_id}] GET /downtimes/overlapping - start={start}, end={end}, folder={folder}")
+
+    if not start or not end:
+        raise HTTPException(status_code=400, detail="start and end are required")
+    start_ts = parse_filter_datetime(start, "start")
+    end_ts = parse_filter_datetime(end, "end")
+    if end_ts < start_ts:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+
+    index = await get_downtime_index(request_id)
+    downtimes = index.overlapping(start_ts, end_ts, folder)
+
+    logger.info(f"[{request_id}] {len(downtimes)} downtimes overlap {start_ts}-{end_ts}")
+    return {
+        "start": datetime.fromtimestamp(start_ts).isoformat(),
+        "end": datetime.fromtimestamp(end_ts).isoformat(),
+        "count": len(downtimes),
+        "index_updated_at": index.updated_at_iso(),
+        "downtimes": downtimes,
+    }
+
+@router.post("/schedule", response_model=DowntimeResponse, response_model_exclude_none=True)
 async def schedule_downtime(request: Request, req: DowntimeRequest, token: str = Depends(get_current_user)):
     request_id = f"req-{int(time.time())}"
     logger.info(f"[{request_id}] POST /schedule - Request received for {len(req.hosts)} hosts")
@@ -402,7 +478,9 @@ async def schedule_downtime(request: Request, req: DowntimeRequest, token: str =
     api_url = f"https://{config['host']}/{config['site']}/check_mk/api/1.0"
     
     try:
-        hosts = req.hosts 
+        # Host duplicati nella richiesta: un solo downtime per host/slot. Prima venivano
+        # creati più volte; ora sono esclusi da total e contati a parte in "duplicates"
+        hosts = list(dict.fromkeys(req.hosts))
         start_time_user = req.startTime
         end_time_user = req.endTime
         ripeti_val = req.ripeti
@@ -473,76 +551,67 @@ async def schedule_downtime(request: Request, req: DowntimeRequest, token: str =
                     l_end.append(f"{we_end.isoformat()}{calcolo_dst(we_end)}")
 
         logger.info(f"[{request_id}] Generated {len(l_start)} downtime periods per host.")
+        duplicates = (len(req.hosts) - len(hosts)) * len(l_start)
         
         if len(l_start) == 0:
             logger.warning(f"[{request_id}] No downtime periods were generated!")
-            return {"start_times": [], "end_times": [], "responses": []}
-        
-        all_payloads = []
-        for host in hosts:
-            for i in range(len(l_end)):
-                payload = {
-                    'start_time': l_start[i],
-                    'end_time': l_end[i],
-                    'recur': 'fixed',
-                    'duration': 0,
-                    'comment': commento,
-                    'downtime_type': 'host',
-                    'host_name': host,
-                }
-                all_payloads.append(payload)
+            return {"start_times": [], "end_times": [], **ScheduleResult(0, duplicates=duplicates).summary()}
         
-        total_items = len(all_payloads)
-        responses_list = []
+        total_items = len(hosts) * len(l_start)
+        result = ScheduleResult(total_items, duplicates=duplicates, keep_items=(req.response_mode == "full"))
+
+        # Con skip_conflicts gli slot già coperti (anche in parte) da un downtime
+        # dello stesso host non vengono ricreati
+        index = await get_downtime_index(request_id) if req.skip_conflicts else None
+        slot_bounds = [(parse_filter_datetime(s, "start_time"), parse_filter_datetime(e, "end_time")) for s, e in zip(l_start, l_end)]
 
         # --- 3. CONFIGURAZIONE BATCH (DINAMICA) ---
+        # BATCH_SIZE = richieste contemporanee del job, DELAY = pausa tra una richiesta e la successiva sullo stesso slot
         BATCH_SIZE = req.batch_size if req.batch_size is not None else 3
         DELAY_BETWEEN_BATCHES = req.delay if req.delay is not None else 1.0
         
-        logger.info(f"[{request_id}] Starting execution: {total_items} total requests. Batch size: {BATCH_SIZE}, Delay: {DELAY_BETWEEN_BATCHES}s")
+        logger.info(f"[{request_id}] Starting execution: {total_items} total requests for {token}. Max in flight: {BATCH_SIZE}, Delay: {DELAY_BETWEEN_BATCHES}s")
         
-        headers = {
-            'Authorization': f"Bearer {config['user']} {config['password']}",
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-        }
-
-        # Timeout generale del client: 300 secondi (5 minuti)
+        # Client condiviso, timeout generale: 300 secondi (5 minuti)
         # Questo verrà usato da ogni richiesta .post()
-        async with httpx.AsyncClient(headers=headers, timeout=300.0, verify=False) as session:
-            for i in range(0, total_items, BATCH_SIZE):
-                batch_payloads = all_payloads[i : i + BATCH_SIZE]
-                batch_index_start = i + 1
-                batch_index_end = i + len(batch_payloads)
-                
-                logger.info(f"[{request_id}] Processing batch {batch_index_start}-{batch_index_end} / {total_items}...")
-                
-                batch_tasks = []
-                for idx, p in enumerate(batch_payloads):
-                    current_global_idx = i + idx
-                    batch_tasks.append(post_downtime(
+        session = get_checkmk_session()
+        url = f"{api_url}/domain-types/downtime/collections/host"
+
+        # I payload vengono generati solo quando lo scheduler ha capacità libera:
+        # la memoria non cresce con hosts x slot
+        def schedule_items():
+            for item_index, payload in iter_downtime_payloads(hosts, l_start, l_end, commento):
+                if index is not None:
+                    slot_start, slot_end = slot_bounds[item_index % len(l_start)]
+                    if index.host_conflicts(payload['host_name'], slot_start, slot_end):
+                        result.skip(item_index, "Skipped: overlaps an existing downtime")
+                        continue
+                async def post_item(index=item_index, payload=payload):
+                    outcome, error_class = await post_downtime(
                         session=session,
-                        url=f"{api_url}/domain-types/downtime/collections/host",
-                        payload=p,
+                        url=url,
+                        payload=payload,
                         request_id=request_id,
-                        index=current_global_idx,
+                        index=index,
                         total=total_items
-                    ))
-                # ... (loop dei task del batch) ...
-                batch_results = await asyncio.gather(*batch_tasks)
-                responses_list.extend(batch_results)
-                
-                if (i + BATCH_SIZE) < total_items:
-                    logger.info(f"[{request_id}] Batch finished. Cooling down for {DELAY_BETWEEN_BATCHES}s...")
-                    await asyncio.sleep(DELAY_BETWEEN_BATCHES) # <-- Questa linea ora aspetterà 1 secondo
+                    )
+                    result.add(index, payload, outcome, error_class)
+                    if result.done % 100 == 0:
+                        logger.info(f"[{request_id}] Progress: {result.done}/{total_items} ({result.failed} failed)")
+                yield post_item
 
-        success_count = responses_list.count("Done")
-        logger.info(f"[{request_id}] Schedule complete: {success_count}/{len(responses_list)} requests succeeded")
+        # Lo scheduler condiviso alterna equamente gli item tra gli utenti;
+        # batch_size e delay restano il limite di concorrenza e la pausa di questo job
+        await write_scheduler.run(token, schedule_items(), max_in_flight=BATCH_SIZE, delay=DELAY_BETWEEN_BATCHES)
+        if result.created:
+            downtime_index.invalidate()
+
+        logger.info(f"[{request_id}] Schedule complete: {result.created}/{total_items} requests succeeded")
         
         return {
             "start_times": l_start,
             "end_times": l_end,
-            "responses": responses_list
+            **result.summary()
         }
     except Exception as e:
         error_msg = f"Failed to schedule downtime: {str(e)}"
@@ -553,32 +622,106 @@ async def schedule_downtime(request: Request, req: DowntimeRequest, token: str =
             detail=error_msg
         )
 
+def iter_downtime_payloads(hosts: List[str], l_start: List[str], l_end: List[str], commento: str):
+    """Genera (indice, payload) per ogni coppia host/slot, senza materializzare la lista."""
+    index = 0
+    for host in hosts:
+        for i in range(len(l_end)):
+            yield index, {
+                'start_time': l_start[i],
+                'end_time': l_end[i],
+                'recur': 'fixed',
+                'duration': 0,
+                'comment': commento,
+                'downtime_type': 'host',
+                'host_name': host,
+            }
+            index += 1
+
+class ScheduleResult:
+    """
+    Riduce gli esiti di /schedule in contatori ed errori raggruppati per host e
+    classe di errore. La lista per-item viene tenuta solo in modalità "full".
+    A job concluso created + skipped + failed == total (coppie host/slot uniche);
+    le coppie ripetute nella richiesta sono contate solo in `duplicates`.
+    """
+
+    def __init__(self, total: int, duplicates: int = 0, keep_items: bool = False):
+        self.total = total
+        self.created = 0
+        self.skipped = 0
+        self.duplicates = duplicates
+        self.conflicts = 0
+        self.failed = 0
+        self.failures_by_host: Dict[str, Dict[str, int]] = {}
+        self.failures_by_class: Dict[str, Dict[str, Any]] = {}
+        self.items: Optional[List[Optional[str]]] = [None] * total if keep_items else None
+
+    @property
+    def done(self) -> int:
+        return self.created + self.failed
+
+    def add(self, index: int, payload: dict, outcome: str, error_class: Optional[str]):
+        if self.items is not None:
+            self.items[index] = outcome
+        if error_class is None:
+            self.created += 1
+            return
+        self.failed += 1
+        host_errors = self.failures_by_host.setdefault(payload.get('host_name'), {})
+        host_errors[error_class] = host_errors.get(error_class, 0) + 1
+        group = self.failures_by_class.setdefault(error_class, {"count": 0, "example": outcome})
+        group["count"] += 1
+
+    def skip(self, index: int, outcome: str):
+        """Slot non inviato perché già coperto da un downtime esistente."""
+        if self.items is not None:
+            self.items[index] = outcome
+        self.skipped += 1
+        self.conflicts += 1
+
+    def summary(self) -> Dict[str, Any]:
+        result = {
+            "total": self.total,
+            "created": self.created,
+            "skipped": self.skipped,
+            "duplicates": self.duplicates,
+            "conflicts": self.conflicts,
+            "failed": self.failed,
+            "failures_by_host": self.failures_by_host,
+            "failures_by_class": self.failures_by_class,
+        }
+        if self.items is not None:
+            result["responses"] = self.items
+        return result
+
 # Funzione helper per 'schedule_downtime'
-async def post_downtime(session: httpx.AsyncClient, url: str, payload: dict, request_id: str, index: int, total: int) -> str:
+async def post_downtime(session: httpx.AsyncClient, url: str, payload: dict, request_id: str, index: int, total: int) -> Tuple[str, Optional[str]]:
+    """Ritorna (esito, classe di errore): ("Done", None) in caso di successo."""
     try:
         logger.debug(f"[{request_id}] Sending request {index+1}/{total}: {payload.get('host_name')} from {payload.get('start_time')}")
         
         # --- MODIFICA CHIAVE ---
         # Rimosso il timeout=15.0
         # Ora userà il timeout del client (300 secondi)
-        resp = await session.post(url, json=payload) 
+        resp = await checkmk_limiter.request(session, "POST", url, json=payload)
         
         resp.raise_for_status()
         logger.debug(f"[{request_id}] Request {index+1}/{total} successful")
-        return "Done"
+        return "Done", None
     except httpx.TimeoutException:
          # Questo scatterà solo dopo 300 secondi (5 minuti)
          error_msg = f"Timeout (300s) request {index+1}/{total} for {payload.get('host_name')}"
          logger.error(f"[{request_id}] {error_msg}")
-         return "Timeout"
+         return "Timeout", "Timeout"
     except httpx.HTTPStatusError as e:
         error_msg = f"Failed request {index+1}/{total}: {e.response.status_code} - {e.response.text}"
         logger.error(f"[{request_id}] {error_msg}")
-        return error_msg
+        return error_msg, f"HTTP {e.response.status_code}"
     except Exception as e:
         error_msg = f"Failed request {index+1}/{total}: {str(e)}"
         logger.error(f"[{request_id}] {error_msg}")
-        return error_msg
+        return error_msg, type(e).__name__
 
 
 @router.post("/downtimes/delete-batch", response_model=BatchDeleteResponse)
@@ -596,42 +739,38 @@ async def delete_downtime_batch(
     
     config = get_checkmk_config()
     api_url = f"https://{config['host']}/{config['site']}/check_mk/api/1.0/domain-types/downtime/actions/delete/invoke"
-    headers = {
-        'Authorization': f"Bearer {config['user']} {config['password']}",
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
-    
-    MAX_CONCURRENT_REQUESTS = 20
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    session = get_checkmk_session()
     
-    tasks = []
-
-    async def delete_with_semaphore(session, payload, dt):
-        async with semaphore:
-            logger.debug(f"[{request_id}] Sending delete for {dt.downtime_id} on {dt.site_id}")
-            try:
-                # --- MODIFICA CHIAVE ---
-                # Rimosso il timeout=15.0
-                # Ora userà il timeout del client (300 secondi)
-                return await session.post(api_url, json=payload)
-            except Exception as e:
-                logger.error(f"[{request_id}] Exception in delete_with_semaphore: {e}")
-                return e
-
-    # Timeout generale del client: 300 secondi (5 minuti)
-    async with httpx.AsyncClient(headers=headers, timeout=300.0, verify=False) as session:
-        for dt in downtimes_to_delete:
+    results = [None] * len(downtimes_to_delete)
+
+    # La concorrenza è regolata dal limiter globale (budget write)
+    async def delete_with_limiter(session, payload, dt):
+        logger.debug(f"[{request_id}] Sending delete for {dt.downtime_id} on {dt.site_id}")
+        try:
+            # --- MODIFICA CHIAVE ---
+            # Rimosso il timeout=15.0
+            # Ora userà il timeout del client (300 secondi)
+            return await checkmk_limiter.request(session, "POST", api_url, json=payload)
+        except Exception as e:
+            logger.error(f"[{request_id}] Exception in delete_with_limiter: {e}")
+            return e
+
+    # Client condiviso, timeout generale: 300 secondi (5 minuti)
+    def delete_items():
+        for i, dt in enumerate(downtimes_to_delete):
             payload = {
                 "delete_type": "by_id",
                 "downtime_id": dt.downtime_id,
                 "site_id": dt.site_id
             }
-            tasks.append(delete_with_semaphore(session, payload, dt))
-        
-        logger.info(f"[{request_id}] Sending {len(tasks)} delete requests (limited to {MAX_CONCURRENT_REQUESTS} at a time)...")
-        results = await asyncio.gather(*tasks, return_exceptions=False)
-    
+            async def delete_item(i=i, payload=payload, dt=dt):
+                results[i] = await delete_with_limiter(session, payload, dt)
+            yield delete_item
+
+    logger.info(f"[{request_id}] Sending {len(downtimes_to_delete)} delete requests for {token} (limited to {checkmk_limiter.write.max_in_flight} at a time)...")
+    # Le delete passano dallo scheduler condiviso: un batch grande non blocca gli altri utenti
+    await write_scheduler.run(token, delete_items())
+
     succeeded = 0
     failed = 0
     errors = []
@@ -654,5 +793,153 @@ async def delete_downtime_batch(
             logger.error(f"[{request_id}] {error_msg}")
             errors.append(error_msg)
     
+    if succeeded:
+        downtime_index.invalidate()
     logger.info(f"[{request_id}] Batch delete complete. Succeeded: {succeeded}, Failed: {failed}")
-    return {"succeeded": succeeded, "failed": failed, "errors": errors}
\ No newline at end of file
+    return {"succeeded": succeeded, "failed": failed, "errors": errors}
+
+# Host per singola query livestatus nel delete-by-filter
+DELETE_FILTER_HOST_CHUNK = int(os.environ.get("DELETE_FILTER_HOST_CHUNK", "50"))
+
+def parse_filter_datetime(value: Optional[str], field: str) -> Optional[int]:
+    """Converte una data ISO (es. 2025-01-31T22:00 o con offset) in epoch."""
+    if not value:
+        return None
+    try:
+        return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {field} datetime: {value}")
+
+def build_downtime_query(hosts: Optional[List[str]], start_ts: Optional[int], end_ts: Optional[int]) -> Optional[dict]:
+    """Costruisce l'espressione di query Checkmk (tabella livestatus 'downtimes')."""
+    expr = []
+    if hosts:
+        host_expr = [{"op": "=", "left": "downtimes.host_name", "right": h} for h in hosts]
+        expr.append(host_expr[0] if len(host_expr) == 1 else {"op": "or", "expr": host_expr})
+    # Sovrapposizione con l'intervallo: finisce dopo start e inizia prima di end
+    if start_ts is not None:
+        expr.append({"op": ">=", "left": "downtimes.end_time", "right": str(start_ts)})
+    if end_ts is not None:
+        expr.append({"op": "<=", "left": "downtimes.start_time", "right": str(end_ts)})
+    if not expr:
+        return None
+    return expr[0] if len(expr) == 1 else {"op": "and", "expr": expr}
+
+@router.post("/downtimes/delete-by-filter", response_model=DeleteByFilterResponse)
+async def delete_downtimes_by_filter(
+    request: Request,
+    filter_request: DeleteByFilterRequest,
+    token: str = Depends(get_current_user)
+):
+    request_id = f"req-{int(time.time())}"
+    logger.info(f"[{request_id}] POST /downtimes/delete-by-filter - folder={filter_request.folder}, "
+                f"hosts={len(filter_request.hosts)}, start={filter_request.start}, end={filter_request.end}, "
+                f"dry_run={filter_request.dry_run}")
+
+    if not (filter_request.folder or filter_request.hosts or filter_request.start or filter_request.end):
+        raise HTTPException(status_code=400, detail="At least one of folder, hosts, start or end is required")
+
+    start_ts = parse_filter_datetime(filter_request.start, "start")
+    end_ts = parse_filter_datetime(filter_request.end, "end")
+    if start_ts is not None and end_ts is not None and end_ts < start_ts:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+
+    # 1. Risoluzione degli host (None = nessun filtro host, solo intervallo temporale)
+    hosts = None
+    if filter_request.folder:
+        host_map = await get_all_hosts_map()
+        if not host_map:
+            raise HTTPException(status_code=500, detail="Could not fetch host list to filter by client")
+        hosts = [h for h, folder in host_map.items() if folder == filter_request.folder]
+        if filter_request.hosts:
+            wanted = set(filter_request.hosts)
+            hosts = [h for h in hosts if h in wanted]
+    elif filter_request.hosts:
+        hosts = list(dict.fromkeys(filter_request.hosts))
+
+    if hosts is not None and not hosts:
+        logger.warning(f"[{request_id}] No hosts match the filter")
+        return {"dry_run": filter_request.dry_run, "hosts": 0, "matched": 0, "deleted": 0, "calls": 0, "errors": []}
+
+    if hosts is None:
+        chunks = [None]
+    else:
+        chunks = [hosts[i:i + DELETE_FILTER_HOST_CHUNK] for i in range(0, len(hosts), DELETE_FILTER_HOST_CHUNK)]
+
+    config = get_checkmk_config()
+    api_url = f"https://{config['host']}/{config['site']}/check_mk/api/1.0"
+    session = get_checkmk_session()
+    errors = []
+
+    # 2. Conteggio lato server dei downtime corrispondenti (una GET per chunk)
+    async def count_chunk(chunk):
+        query = build_downtime_query(chunk, start_ts, end_ts)
+        resp = await checkmk_limiter.request(
+            session, "GET", f"{api_url}/domain-types/downtime/collections/all",
+            params={"query": json.dumps(query)}
+        )
+        resp.raise_for_status()
+        return len(resp.json().get('value', []))
+
+    start_time = time.time()
+    counts = await asyncio.gather(*[count_chunk(c) for c in chunks], return_exceptions=True)
+    matched = 0
+    chunk_counts = []
+    for res in counts:
+        if isinstance(res, Exception):
+            error_msg = f"Failed to resolve downtimes: {type(res).__name__} - {str(res)}"
+            logger.error(f"[{request_id}] {error_msg}")
+            errors.append(error_msg)
+            chunk_counts.append(0)
+        else:
+            matched += res
+            chunk_counts.append(res)
+    logger.info(f"[{request_id}] {matched} downtimes match on {len(hosts) if hosts is not None else 'all'} hosts "
+                f"({len(chunks)} queries, {time.time() - start_time:.2f}s)")
+
+    if filter_request.dry_run:
+        return {"dry_run": True, "hosts": len(hosts) if hosts is not None else None, "matched": matched,
+                "deleted": 0, "calls": len(chunks), "errors": errors}
+
+    # 3. Cancellazione: una chiamata per chunk con delete_type "query" e la stessa
+    #    espressione usata per il conteggio, così "deleted" corrisponde al filtro
+    async def delete_chunk(chunk):
+        payload = {"delete_type": "query", "query": build_downtime_query(chunk, start_ts, end_ts)}
+        resp = await checkmk_limiter.request(
+            session, "POST", f"{api_url}/domain-types/downtime/actions/delete/invoke",
+            json=payload
+        )
+        resp.raise_for_status()
+
+    to_delete = [(c, n) for c, n in zip(chunks, chunk_counts) if n > 0]
+    results: List[Any] = [None] * len(to_delete)
+
+    def delete_items():
+        for i, (chunk, _) in enumerate(to_delete):
+            async def delete_item(i=i, chunk=chunk):
+                try:
+                    await delete_chunk(chunk)
+                except Exception as e:
+                    results[i] = e
+            yield delete_item
+
+    await write_scheduler.run(token, delete_items())
+
+    deleted = 0
+    for (chunk, n), res in zip(to_delete, results):
+        if isinstance(res, Exception):
+            error_msg = f"Failed delete for {len(chunk) if chunk else 'all'} hosts: "
+            if isinstance(res, httpx.HTTPStatusError):
+                error_msg += f"{res.response.status_code} - {res.response.text}"
+            else:
+                error_msg += f"{type(res).__name__} - {str(res)}"
+            logger.error(f"[{request_id}] {error_msg}")
+            errors.append(error_msg)
+        else:
+            deleted += n
+
+    if deleted:
+        downtime_index.invalidate()
+    logger.info(f"[{request_id}] Delete by filter complete. Deleted: {deleted}/{matched} in {len(to_delete)} calls")
+    return {"dry_run": False, "hosts": len(hosts) if hosts is not None else None, "matched": matched,
+            "deleted": deleted, "calls": len(chunks) + len(to_delete), "errors": errors}
@@ -3,11 +3,16 @@ CloudConnexa Dashboard API Routes
 Endpoint per dashboard, sicurezza, clienti e filtri
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
-from .athena import run_athena_query
+import asyncio
+import os
+import time
+from .athena import run_athena_query, run_query_set
+from .athena_decode import ResultFormat
+from .shared_cache import shared_cache
 from . import cloudconnexa_queries as ccq
 
 router = APIRouter()
@@ -21,60 +26,35 @@ class DashboardFilters(BaseModel):
 
 
 @router.post("/cloudconnexa/dashboard")
-async def get_dashboard_data(filters: DashboardFilters):
+async def get_dashboard_data(filters: DashboardFilters, response_format: ResultFormat = Query("rows", alias="format")):
     """
     Endpoint principale per la dashboard CloudConnexa.
     Ritorna tutte le statistiche necessarie per visualizzare la dashboard.
+    Con ?format=columnar ogni widget è {columns, data: {colonna: [valori]}}
+    invece di una lista di righe: niente chiavi ripetute e serie già pronte
+    per i grafici.
     """
     try:
         filters_dict = filters.dict()
         
-        # Esegue tutte le query in parallelo (o sequenzialmente per semplicità)
-        results = {}
-        
-        # Statistiche base
-        results['sessionStats'] = run_athena_query(
-            ccq.get_session_stats_query(filters_dict)
-        )
-        
-        results['blockedDomains'] = run_athena_query(
-            ccq.get_blocked_domains_query(filters_dict)
-        )
-        
-        # Timeline
-        results['sessionsTimeline'] = run_athena_query(
-            ccq.get_sessions_timeline_query(filters_dict)
-        )
-        
-        results['securityTimeline'] = run_athena_query(
-            ccq.get_security_events_timeline_query(filters_dict)
-        )
-        
-        # Top lists
-        results['topUsers'] = run_athena_query(
-            ccq.get_top_users_by_traffic_query(filters_dict)
-        )
-        
-        results['topDestinations'] = run_athena_query(
-            ccq.get_top_destinations_query(filters_dict)
-        )
-        
-        # Distribuzioni
-        results['gatewayDistribution'] = run_athena_query(
-            ccq.get_gateway_distribution_query(filters_dict)
-        )
-        
-        results['protocolDistribution'] = run_athena_query(
-            ccq.get_protocol_distribution_query(filters_dict)
-        )
-        
-        results['blockedByCategory'] = run_athena_query(
-            ccq.get_blocked_domains_by_category_query(filters_dict)
-        )
-        
-        results['disconnectReasons'] = run_athena_query(
-            ccq.get_disconnect_reasons_query(filters_dict)
-        )
+        # Esegue tutte le query in parallelo: un widget fallito non blocca gli altri
+        results, errors = await run_query_set({
+            # Statistiche base
+            'sessionStats': ccq.get_session_stats_query(filters_dict),
+            'blockedDomains': ccq.get_blocked_domains_query(filters_dict),
+            # Timeline
+            'sessionsTimeline': ccq.get_sessions_timeline_query(filters_dict),
+            'securityTimeline': ccq.get_security_events_timeline_query(filters_dict),
+            # Top lists
+            'topUsers': ccq.get_top_users_by_traffic_query(filters_dict),
+            'topDestinations': ccq.get_top_destinations_query(filters_dict),
+            # Distribuzioni
+            'gatewayDistribution': ccq.get_gateway_distribution_query(filters_dict),
+            'protocolDistribution': ccq.get_protocol_distribution_query(filters_dict),
+            'blockedByCategory': ccq.get_blocked_domains_by_category_query(filters_dict),
+            'disconnectReasons': ccq.get_disconnect_reasons_query(filters_dict),
+        }, columnar=response_format == "columnar")
+        results['errors'] = errors
         
         return results
         
@@ -83,19 +63,44 @@ async def get_dashboard_data(filters: DashboardFilters):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Cache delle opzioni filtro: cambiano raramente e vengono pre-caricate allo startup
+FILTERS_CACHE_TTL = float(os.getenv("ATHENA_FILTERS_CACHE_TTL", "900"))
+_filters_cache = {'value': None, 'updated_at': 0.0}
+
+
+async def load_filter_options(force: bool = False) -> Dict[str, List[str]]:
+    """Carica utenti e gateway disponibili, usando la cache se ancora valida."""
+    if not force and _filters_cache['value'] is not None \
+            and time.monotonic() - _filters_cache['updated_at'] < FILTERS_CACHE_TTL:
+        return _filters_cache['value']
+    
+    async def fetch():
+        users, gateways = await asyncio.gather(
+            run_athena_query(ccq.get_available_users_query(), cache_class="filters"),
+            run_athena_query(ccq.get_available_gateways_query(), cache_class="filters")
+        )
+        return {
+            'users': [u['parententityname'] for u in users if u.get('parententityname')],
+            'gateways': [g['gateway'] for g in gateways if g.get('gateway')]
+        }
+    
+    # Con più worker le query Athena partono da un solo processo
+    if shared_cache is not None:
+        value = await shared_cache.get_or_fetch("athena:cloudconnexa_filters", FILTERS_CACHE_TTL, fetch)
+    else:
+        value = await fetch()
+    _filters_cache['value'] = value
+    _filters_cache['updated_at'] = time.monotonic()
+    return value
+
+
 @router.get("/cloudconnexa/filters")
 async def get_filter_options():
     """
     Ritorna le opzioni disponibili per i filtri (utenti e gateway).
     """
     try:
-        users = run_athena_query(ccq.get_available_users_query())
-        gateways = run_athena_query(ccq.get_available_gateways_query())
-        
-        return {
-            'users': [u['parententityname'] for u in users if u.get('parententityname')],
-            'gateways': [g['gateway'] for g in gateways if g.get('gateway')]
-        }
+        return await load_filter_options()
         
     except Exception as e:
         print(f"Errore filtri: {str(e)}")
@@ -103,7 +108,7 @@ async def get_filter_options():
 
 
 @router.post("/cloudconnexa/security")
-async def get_security_data(filters: DashboardFilters):
+async def get_security_data(filters: DashboardFilters, response_format: ResultFormat = Query("rows", alias="format")):
     """
     Endpoint per dati di sicurezza avanzati.
     Ritorna analisi su minacce, porte non standard, traffico asimmetrico.
@@ -111,28 +116,15 @@ async def get_security_data(filters: DashboardFilters):
     try:
         filters_dict = filters.dict()
         
-        results = {}
-        
         # Security queries
-        results['blockedAccess'] = run_athena_query(
-            ccq.get_blocked_access_attempts_query(filters_dict)
-        )
-        
-        results['nonStandardPorts'] = run_athena_query(
-            ccq.get_non_standard_ports_query(filters_dict)
-        )
-        
-        results['asymmetricTraffic'] = run_athena_query(
-            ccq.get_asymmetric_traffic_query(filters_dict)
-        )
-        
-        results['securityTimeline'] = run_athena_query(
-            ccq.get_security_events_timeline_query(filters_dict)
-        )
-        
-        results['blockedByCategory'] = run_athena_query(
-            ccq.get_blocked_domains_by_category_query(filters_dict)
-        )
+        results, errors = await run_query_set({
+            'blockedAccess': ccq.get_blocked_access_attempts_query(filters_dict),
+            'nonStandardPorts': ccq.get_non_standard_ports_query(filters_dict),
+            'asymmetricTraffic': ccq.get_asymmetric_traffic_query(filters_dict),
+            'securityTimeline': ccq.get_security_events_timeline_query(filters_dict),
+            'blockedByCategory': ccq.get_blocked_domains_by_category_query(filters_dict),
+        }, columnar=response_format == "columnar")
+        results['errors'] = errors
         
         return results
         
@@ -142,13 +134,13 @@ async def get_security_data(filters: DashboardFilters):
 
 
 @router.get("/cloudconnexa/customers")
-async def get_customers_data():
+async def get_customers_data(response_format: ResultFormat = Query("rows", alias="format")):
     """
     Endpoint per connessioni attive per cliente (ultime 24 ore).
     """
     try:
-        results = run_athena_query(
-            ccq.get_active_connections_by_customer_query()
+        results = await run_athena_query(
+            ccq.get_active_connections_by_customer_query(), cache_class="live", columnar=response_format == "columnar"
         )
         
         return {
@@ -162,21 +154,18 @@ async def get_customers_data():
 
 
 @router.post("/cloudconnexa/timeline")
-async def get_timeline_data(filters: DashboardFilters):
+async def get_timeline_data(filters: DashboardFilters, response_format: ResultFormat = Query("rows", alias="format")):
     """
     Endpoint dedicato per dati timeline (sessioni e sicurezza).
     """
     try:
         filters_dict = filters.dict()
         
-        return {
-            'sessions': run_athena_query(
-                ccq.get_sessions_timeline_query(filters_dict)
-            ),
-            'security': run_athena_query(
-                ccq.get_security_events_timeline_query(filters_dict)
-            )
-        }
+        results, errors = await run_query_set({
+            'sessions': ccq.get_sessions_timeline_query(filters_dict),
+            'security': ccq.get_security_events_timeline_query(filters_dict),
+        }, columnar=response_format == "columnar")
+        return {**results, 'errors': errors}
         
     except Exception as e:
         print(f"Errore timeline: {str(e)}")
@@ -184,7 +173,7 @@ async def get_timeline_data(filters: DashboardFilters):
 
 
 @router.post("/cloudconnexa/users/{username}")
-async def get_user_details(username: str, filters: DashboardFilters):
+async def get_user_details(username: str, filters: DashboardFilters, response_format: ResultFormat = Query("rows", alias="format")):
     """
     Endpoint per dettagli specifici di un utente.
     """
@@ -193,17 +182,12 @@ async def get_user_details(username: str, filters: DashboardFilters):
         filters_dict = filters.dict()
         filters_dict['users'] = [username]
         
-        return {
-            'sessionStats': run_athena_query(
-                ccq.get_session_stats_query(filters_dict)
-            ),
-            'topDestinations': run_athena_query(
-                ccq.get_top_destinations_query(filters_dict)
-            ),
-            'timeline': run_athena_query(
-                ccq.get_sessions_timeline_query(filters_dict)
-            )
-        }
+        results, errors = await run_query_set({
+            'sessionStats': ccq.get_session_stats_query(filters_dict),
+            'topDestinations': ccq.get_top_destinations_query(filters_dict),
+            'timeline': ccq.get_sessions_timeline_query(filters_dict),
+        }, columnar=response_format == "columnar")
+        return {**results, 'errors': errors}
         
     except Exception as e:
         print(f"Errore user details: {str(e)}")
@@ -30,7 +30,7 @@ async def search_logs(log_type: str, request: SearchRequest):
         query = build_dynamic_query(log_type, request.filters, request.selectFields)
         
         # Esegui la query su AWS
-        results = run_athena_query(query)
+        results = await run_athena_query(query, profile="logs-search", cache_class="logs")
         
         return results
     except Exception as e:
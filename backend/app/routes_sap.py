@@ -3,23 +3,23 @@ SAP System Control - API Routes
 FastAPI router per endpoint SAP dashboard
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
 
 from . import sap_queries
-from .athena import run_athena_query
+from .athena import run_athena_query, run_query_set
+from .athena_decode import ResultFormat, rows_from_columns
+from .shared_cache import shared_cache
 
 load_dotenv()
 
 router = APIRouter()
 
-# Configurazione SAP Athena
-SAP_ATHENA_DB = os.getenv('SAP_ATHENA_DB', 'sap_reports_db')
-SAP_ATHENA_WORKGROUP = os.getenv('SAP_ATHENA_WORKGROUP', 'ReportCheckSistemiSap')
-
 
 class DashboardFilters(BaseModel):
     """Modello per i filtri dashboard"""
@@ -43,56 +43,59 @@ class SIDsRequest(BaseModel):
 
 
 @router.post("/sap/dashboard")
-async def get_sap_dashboard(filters: DashboardFilters):
+async def get_sap_dashboard(filters: DashboardFilters, response_format: ResultFormat = Query("rows", alias="format")):
     """
     Endpoint principale dashboard SAP
     Ritorna KPI, grafici e tabelle aggregate
+    (con ?format=columnar la tabella è {columns, data} invece di una lista di righe)
     """
     try:
         filters_dict = filters.dict()
         
-        # Esegui query in parallelo (concettualmente - Athena le eseguirà sequenzialmente)
-        total_dumps_query = sap_queries.get_total_dumps_query(filters_dict)
-        failed_backups_query = sap_queries.get_failed_backups_query(filters_dict)
-        cancelled_jobs_query = sap_queries.get_cancelled_jobs_query(filters_dict)
-        dump_types_query = sap_queries.get_dump_types_query(filters_dict)
-        issues_by_client_query = sap_queries.get_issues_by_client_query(filters_dict)
-        problems_timeline_query = sap_queries.get_problems_timeline_query(filters_dict)
-        
-        # Esegui query
-        total_dumps_results = run_athena_query(total_dumps_query, SAP_ATHENA_DB, SAP_ATHENA_WORKGROUP)
-        failed_backups_results = run_athena_query(failed_backups_query, SAP_ATHENA_DB, SAP_ATHENA_WORKGROUP)
-        cancelled_jobs_results = run_athena_query(cancelled_jobs_query, SAP_ATHENA_DB, SAP_ATHENA_WORKGROUP)
-        dump_types_results = run_athena_query(dump_types_query, SAP_ATHENA_DB, SAP_ATHENA_WORKGROUP)
-        issues_by_client_results = run_athena_query(issues_by_client_query, SAP_ATHENA_DB, SAP_ATHENA_WORKGROUP)
-        problems_timeline_results = run_athena_query(problems_timeline_query, SAP_ATHENA_DB, SAP_ATHENA_WORKGROUP)
+        # Esegui query in parallelo: la latenza è quella della query più lenta
+        results, errors = await run_query_set({
+            'total_dumps': sap_queries.get_total_dumps_query(filters_dict),
+            'failed_backups': sap_queries.get_failed_backups_query(filters_dict),
+            'cancelled_jobs': sap_queries.get_cancelled_jobs_query(filters_dict),
+            'dump_types': sap_queries.get_dump_types_query(filters_dict),
+            'issues_by_client': sap_queries.get_issues_by_client_query(filters_dict),
+            'problems_timeline': sap_queries.get_problems_timeline_query(filters_dict),
+        }, profile="sap", columnar=True)
+        # Risultati colonnari già tipizzati: i grafici sono slice delle colonne
+        total_dumps_results = results['total_dumps']['data']
+        failed_backups_results = results['failed_backups']['data']
+        cancelled_jobs_results = results['cancelled_jobs']['data']
+        dump_types_results = results['dump_types']['data']
+        issues_by_client_results = results['issues_by_client']['data']
+        problems_timeline_results = results['problems_timeline']['data']
         
         # Calcola KPI
-        total_dumps = sum(int(row.get('total_dumps', 0)) for row in total_dumps_results)
-        total_failed_backups = sum(int(row.get('failed_backups', 0)) for row in failed_backups_results)
-        total_cancelled_jobs = sum(int(row.get('cancelled_jobs', 0)) for row in cancelled_jobs_results)
+        total_dumps = sum(filter(None, total_dumps_results.get('total_dumps', [])))
+        total_failed_backups = sum(filter(None, failed_backups_results.get('failed_backups', [])))
+        total_cancelled_jobs = sum(filter(None, cancelled_jobs_results.get('cancelled_jobs', [])))
         
         # Prepara dati per grafici
         # Dump types per Pie Chart
         dump_types_chart = {
-            'labels': [row.get('dump_type', 'Unknown') for row in dump_types_results[:10]],  # Top 10
-            'data': [int(row.get('count', 0)) for row in dump_types_results[:10]]
+            'labels': dump_types_results.get('dump_type', [])[:10],  # Top 10
+            'data': dump_types_results.get('count', [])[:10]
         }
         
         # Issues by client per Bar Chart
         client_issues_chart = {
-            'labels': [f"{row.get('nomecliente', 'Unknown')} - {row.get('sid', 'N/A')}" for row in issues_by_client_results],
-            'dumps': [int(row.get('dumps', 0)) for row in issues_by_client_results],
-            'failed_backups': [int(row.get('failed_backups', 0)) for row in issues_by_client_results],
-            'cancelled_jobs': [int(row.get('cancelled_jobs', 0)) for row in issues_by_client_results]
+            'labels': [f"{client} - {sid}" for client, sid in zip(issues_by_client_results.get('nomecliente', []),
+                                                                  issues_by_client_results.get('sid', []))],
+            'dumps': issues_by_client_results.get('dumps', []),
+            'failed_backups': issues_by_client_results.get('failed_backups', []),
+            'cancelled_jobs': issues_by_client_results.get('cancelled_jobs', [])
         }
         
         # Timeline per Line Chart
         timeline_chart = {
-            'dates': [row.get('datacontrollo', '') for row in problems_timeline_results],
-            'dumps': [int(row.get('dumps', 0)) for row in problems_timeline_results],
-            'failed_backups': [int(row.get('failed_backups', 0)) for row in problems_timeline_results],
-            'cancelled_jobs': [int(row.get('cancelled_jobs', 0)) for row in problems_timeline_results]
+            'dates': problems_timeline_results.get('datacontrollo', []),
+            'dumps': problems_timeline_results.get('dumps', []),
+            'failed_backups': problems_timeline_results.get('failed_backups', []),
+            'cancelled_jobs': problems_timeline_results.get('cancelled_jobs', [])
         }
         
         return {
@@ -104,24 +107,35 @@ async def get_sap_dashboard(filters: DashboardFilters):
             'dumpTypes': dump_types_chart,
             'clientIssues': client_issues_chart,
             'timeline': timeline_chart,
-            'issuesTable': issues_by_client_results
+            'issuesTable': results['issues_by_client'] if response_format == "columnar"
+                           else rows_from_columns(results['issues_by_client']),
+            # Widget non disponibili (query fallita): nome -> errore
+            'errors': errors
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore recupero dati dashboard: {str(e)}")
 
 
-@router.get("/sap/filters")
-async def get_sap_filters():
-    """
-    Ritorna le opzioni disponibili per i filtri (clienti e SID)
-    """
-    try:
+# Cache delle opzioni filtro: cambiano raramente e vengono pre-caricate allo startup
+FILTERS_CACHE_TTL = float(os.getenv('ATHENA_FILTERS_CACHE_TTL', '900'))
+_filters_cache = {'value': None, 'updated_at': 0.0}
+
+
+async def load_sap_filter_options(force: bool = False) -> Dict[str, List[str]]:
+    """Carica clienti e SID disponibili, usando la cache se ancora valida."""
+    if not force and _filters_cache['value'] is not None \
+            and time.monotonic() - _filters_cache['updated_at'] < FILTERS_CACHE_TTL:
+        return _filters_cache['value']
+    
+    async def fetch():
         clients_query = sap_queries.get_available_clients_query()
         sids_query = sap_queries.get_available_sids_query()
         
-        clients_results = run_athena_query(clients_query, SAP_ATHENA_DB, SAP_ATHENA_WORKGROUP)
-        sids_results = run_athena_query(sids_query, SAP_ATHENA_DB, SAP_ATHENA_WORKGROUP)
+        clients_results, sids_results = await asyncio.gather(
+            run_athena_query(clients_query, profile="sap", cache_class="filters"),
+            run_athena_query(sids_query, profile="sap", cache_class="filters")
+        )
         
         clients = [row.get('nomecliente', '') for row in clients_results if row.get('nomecliente')]
         sids = [row.get('sid', '') for row in sids_results if row.get('sid')]
@@ -130,29 +144,44 @@ async def get_sap_filters():
             'clients': sorted(clients),
             'sids': sorted(sids)
         }
+    
+    # Con più worker le query Athena partono da un solo processo
+    if shared_cache is not None:
+        value = await shared_cache.get_or_fetch("athena:sap_filters", FILTERS_CACHE_TTL, fetch)
+    else:
+        value = await fetch()
+    _filters_cache['value'] = value
+    _filters_cache['updated_at'] = time.monotonic()
+    return value
+
+
+@router.get("/sap/filters")
+async def get_sap_filters():
+    """
+    Ritorna le opzioni disponibili per i filtri (clienti e SID)
+    """
+    try:
+        return await load_sap_filter_options()
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore recupero filtri: {str(e)}")
 
 
 @router.post("/sap/timeline")
-async def get_sap_timeline(filters: TimelineFilters):
+async def get_sap_timeline(filters: TimelineFilters, response_format: ResultFormat = Query("rows", alias="format")):
     """
     Ritorna dati timeline per grafici temporali
+    (con ?format=columnar ogni serie è {columns, data: {colonna: [valori]}})
     """
     try:
         filters_dict = filters.dict()
         
-        problems_query = sap_queries.get_problems_timeline_query(filters_dict)
-        services_query = sap_queries.get_services_timeline_query(filters_dict)
-        
-        problems_results = run_athena_query(problems_query, SAP_ATHENA_DB, SAP_ATHENA_WORKGROUP)
-        services_results = run_athena_query(services_query, SAP_ATHENA_DB, SAP_ATHENA_WORKGROUP)
+        results, errors = await run_query_set({
+            'problems': sap_queries.get_problems_timeline_query(filters_dict),
+            'services': sap_queries.get_services_timeline_query(filters_dict),
+        }, profile="sap", columnar=response_format == "columnar")
         
-        return {
-            'problems': problems_results,
-            'services': services_results
-        }
+        return {**results, 'errors': errors}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore recupero timeline: {str(e)}")
@@ -165,7 +194,7 @@ async def get_sap_clients():
     """
     try:
         query = sap_queries.get_available_clients_query()
-        results = run_athena_query(query, SAP_ATHENA_DB, SAP_ATHENA_WORKGROUP)
+        results = await run_athena_query(query, profile="sap", cache_class="filters")
         
         clients = [row.get('nomecliente', '') for row in results if row.get('nomecliente')]
         
@@ -184,7 +213,7 @@ async def get_sap_sids(request: SIDsRequest):
     """
     try:
         query = sap_queries.get_available_sids_query(request.clients if request.clients else None)
-        results = run_athena_query(query, SAP_ATHENA_DB, SAP_ATHENA_WORKGROUP)
+        results = await run_athena_query(query, profile="sap", cache_class="filters")
         
         # Raggruppa SID per cliente
         sids_by_client = {}
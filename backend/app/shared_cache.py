@@ -0,0 +1,203 @@
+"""
+Cache condivisa tra i worker del backend (SQLite locale).
+
+Con più worker uvicorn ogni processo ha le sue cache in memoria: senza un
+livello comune inventario host, downtime, filtri Athena e JWKS verrebbero
+scaricati una volta per worker. Qui i valori (JSON compresso) vivono in un
+file SQLite in WAL e un lease per chiave fa sì che un solo worker alla volta
+interroghi la sorgente, mentre gli altri attendono il suo risultato.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger("checkmk_api")
+
+# --- CONFIGURAZIONE ---
+# Worker uvicorn (stessa variabile letta da `uvicorn --workers`)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Vuoto = cache condivisa disabilitata; di default è attiva solo con più worker
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "logs/shared_cache.db" if WEB_CONCURRENCY > 1 else "")
+SHARED_CACHE_LEASE = float(os.getenv("SHARED_CACHE_LEASE", "120"))
+SHARED_CACHE_POLL = float(os.getenv("SHARED_CACHE_POLL", "0.2"))
+
+
+def per_worker(total):
+    """
+    Quota di un limite dell'istanza spettante a un worker: limiter, scheduler
+    e admission vivono in ogni processo, quindi i valori configurati (totali)
+    vengono divisi per WEB_CONCURRENCY. Gli interi positivi restano almeno 1.
+    """
+    if isinstance(total, int):
+        return max(1, total // WEB_CONCURRENCY) if total > 0 else total
+    return total / WEB_CONCURRENCY
+
+_MISS = object()
+
+
+class SharedCache:
+    def __init__(self, path: str, lease_seconds: float, poll_interval: float):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}"
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.waits = 0
+        self.errors = 0
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+                         " stored_at REAL NOT NULL, expires_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL,"
+                         " expires_at REAL NOT NULL)")
+            self._initialized = True
+        return conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return default
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, key: str, value: Any, ttl: float):
+        payload = zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"), 6)
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+                         (key, payload, now, now + ttl))
+            conn.execute("DELETE FROM cache WHERE expires_at < ?", (now - 3600,))
+        finally:
+            conn.close()
+
+    def delete(self, key: str):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        finally:
+            conn.close()
+
+    def _try_lease(self, key: str, owner: str) -> bool:
+        """Acquisisce il lease della chiave se libero, scaduto o già di `owner`."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT owner, expires_at FROM leases WHERE key = ?", (key,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                         (key, owner, now + self.lease_seconds))
+            conn.execute("COMMIT")
+            return True
+        finally:
+            conn.close()
+
+    def _release(self, key: str, owner: str):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+        finally:
+            conn.close()
+
+    async def _release_quietly(self, key: str, owner: str):
+        try:
+            await asyncio.to_thread(self._release, key, owner)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"[SharedCache] {key}: failed to release lease: {e}")
+
+    async def get_or_fetch(self, key: str, ttl: float, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Valore condiviso per `key`; se manca lo calcola un solo worker con `fetch`.
+        Se SQLite non è utilizzabile si ripiega su `fetch` senza cache.
+        """
+        # Owner per chiamata (pid + uuid): anche due coroutine dello stesso worker
+        # si contendono il lease invece di considerarsi entrambe proprietarie
+        owner = f"{self.owner}:{uuid.uuid4().hex}"
+        try:
+            value = await asyncio.to_thread(self.get, key, _MISS)
+            if value is not _MISS:
+                self.hits += 1
+                return value
+            self.misses += 1
+            while not await asyncio.to_thread(self._try_lease, key, owner):
+                # Un altro worker sta già interrogando la sorgente: attendiamo il suo risultato
+                self.waits += 1
+                await asyncio.sleep(self.poll_interval)
+                value = await asyncio.to_thread(self.get, key, _MISS)
+                if value is not _MISS:
+                    self.hits += 1
+                    return value
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"[SharedCache] {key}: cache unavailable, fetching directly: {e}")
+            return await fetch()
+
+        try:
+            # Un altro worker può aver salvato il valore poco prima che ottenessimo il lease
+            try:
+                value = await asyncio.to_thread(self.get, key, _MISS)
+            except sqlite3.Error:
+                value = _MISS
+            if value is not _MISS:
+                self.hits += 1
+                return value
+            value = await fetch()
+            self.fetches += 1
+            try:
+                await asyncio.to_thread(self.set, key, value, ttl)
+            except sqlite3.Error as e:
+                # Il valore è già stato calcolato: lo ritorniamo anche se non è condivisibile
+                self.errors += 1
+                logger.warning(f"[SharedCache] {key}: failed to store value: {e}")
+            return value
+        finally:
+            await self._release_quietly(key, owner)
+
+    def invalidate(self, key: str):
+        """Rimuove la chiave; gli errori vengono solo registrati."""
+        try:
+            self.delete(key)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"[SharedCache] {key}: failed to invalidate: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "pid": self.owner,
+            "hits": self.hits,
+            "misses": self.misses,
+            "fetches": self.fetches,
+            "waits": self.waits,
+            "errors": self.errors,
+        }
+
+
+# Cache condivisa; None con un solo worker (salvo SHARED_CACHE_PATH esplicito)
+shared_cache: Optional[SharedCache] = (
+    SharedCache(SHARED_CACHE_PATH, SHARED_CACHE_LEASE, SHARED_CACHE_POLL) if SHARED_CACHE_PATH else None
+)
@@ -0,0 +1,138 @@
+"""
+Snapshot su disco dell'inventario host e dei downtime.
+
+Ogni restart del container ripartiva da zero e le prime richieste dovevano
+attendere Checkmk. Gli snapshot (JSON compresso in SQLite, sul volume dei
+log) vengono riletti allo startup in pochi millisecondi e serviti come dati
+"stale" finché il refresh in background non li riallinea.
+
+Ogni snapshot ha un numero di versione crescente e un hash del contenuto:
+se i dati non cambiano il file non viene riscritto.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("checkmk_api")
+
+# --- CONFIGURAZIONE ---
+# Vuoto = snapshot disabilitati
+SNAPSHOT_STORE_PATH = os.getenv("SNAPSHOT_STORE_PATH", "logs/snapshots.db")
+# Snapshot più vecchi di così non vengono usati allo startup (secondi)
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE", str(7 * 24 * 3600)))
+# Incrementare quando cambia il formato dei dati salvati
+SNAPSHOT_SCHEMA = 1
+
+
+class SnapshotStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.loaded: Dict[str, Dict[str, Any]] = {}
+        self.saved: Dict[str, Dict[str, Any]] = {}
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                " name TEXT PRIMARY KEY, version INTEGER NOT NULL, schema INTEGER NOT NULL,"
+                " source TEXT, saved_at REAL NOT NULL, digest TEXT NOT NULL, payload BLOB NOT NULL)"
+            )
+            self._initialized = True
+        return conn
+
+    def _record_error(self, action: str, name: str, e: Exception):
+        self.errors += 1
+        self.last_error = f"{action} {name}: {type(e).__name__} - {e}"
+        logger.warning(f"[Snapshot] Failed to {action} {name}: {type(e).__name__} - {e}")
+
+    def load(self, name: str) -> Optional[Dict[str, Any]]:
+        """Ritorna {version, source, saved_at, data} oppure None se assente, vecchio o illeggibile."""
+        start_time = time.monotonic()
+        try:
+            if not os.path.exists(self.path):
+                return None
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT version, schema, source, saved_at, payload FROM snapshots WHERE name = ?", (name,)
+                ).fetchone()
+            finally:
+                conn.close()
+            if row is None:
+                return None
+            version, schema, source, saved_at, payload = row
+            if schema != SNAPSHOT_SCHEMA:
+                logger.info(f"[Snapshot] Ignoring {name} v{version}: schema {schema} != {SNAPSHOT_SCHEMA}")
+                return None
+            if time.time() - saved_at > SNAPSHOT_MAX_AGE:
+                logger.info(f"[Snapshot] Ignoring {name} v{version}: older than {SNAPSHOT_MAX_AGE:.0f}s")
+                return None
+            data = json.loads(zlib.decompress(payload))
+        except Exception as e:
+            self._record_error("load", name, e)
+            return None
+        snapshot = {"version": version, "source": source, "saved_at": saved_at, "data": data}
+        self.loaded[name] = {"version": version, "saved_at": saved_at,
+                             "load_time": round(time.monotonic() - start_time, 4)}
+        logger.info(f"[Snapshot] Loaded {name} v{version} ({len(payload)} bytes) in {time.monotonic() - start_time:.3f}s")
+        return snapshot
+
+    def save(self, name: str, data: Any, source: str) -> Optional[int]:
+        """Salva lo snapshot se il contenuto è cambiato; ritorna la versione corrente."""
+        try:
+            raw = json.dumps(data, separators=(",", ":"), sort_keys=True).encode("utf-8")
+            digest = hashlib.sha256(raw).hexdigest()
+            conn = self._connect()
+            try:
+                with conn:
+                    row = conn.execute("SELECT version, digest FROM snapshots WHERE name = ?", (name,)).fetchone()
+                    if row and row[1] == digest:
+                        # Stesso contenuto: aggiorniamo solo il timestamp
+                        conn.execute("UPDATE snapshots SET saved_at = ? WHERE name = ?", (time.time(), name))
+                        version = row[0]
+                    else:
+                        version = (row[0] if row else 0) + 1
+                        conn.execute(
+                            "INSERT OR REPLACE INTO snapshots (name, version, schema, source, saved_at, digest, payload)"
+                            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (name, version, SNAPSHOT_SCHEMA, source, time.time(), digest, zlib.compress(raw, 6))
+                        )
+            finally:
+                conn.close()
+        except Exception as e:
+            self._record_error("save", name, e)
+            return None
+        self.saved[name] = {"version": version, "saved_at": time.time()}
+        return version
+
+    async def save_async(self, name: str, data: Any, source: str) -> Optional[int]:
+        return await asyncio.to_thread(self.save, name, data, source)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "loaded": self.loaded,
+            "saved": self.saved,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
+
+
+# Store condiviso; None se gli snapshot sono disabilitati
+snapshot_store: Optional[SnapshotStore] = SnapshotStore(SNAPSHOT_STORE_PATH) if SNAPSHOT_STORE_PATH else None
@@ -0,0 +1,149 @@
+"""
+Warm-up in background allo startup.
+
+Lo startup non attende più Checkmk: avvia dei task che riscaldano il pool di
+connessioni, l'inventario host, le chiavi JWKS di Cognito e le liste filtro
+Athena più usate. `/health/ready` riporta quando il warm-up è completato e i
+task critici (pool Checkmk e inventario host) sono andati a buon fine; quelli
+falliti vengono ritentati finché non riescono.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from .checkmk_client import get_checkmk_config, get_api_url, get_checkmk_session, CHECKMK_MAX_CONNECTIONS
+from .checkmk_limiter import checkmk_limiter
+from .host_inventory import host_inventory
+from .dependencies import get_jwks
+from .routes_cloudconnexa import load_filter_options
+from .routes_sap import load_sap_filter_options
+
+logger = logging.getLogger("checkmk_api")
+
+# Connessioni aperte in anticipo verso Checkmk
+POOL_WARM_CONNECTIONS = min(4, CHECKMK_MAX_CONNECTIONS)
+# Attesa (secondi) prima di ritentare i task critici falliti
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "30"))
+
+
+async def warm_checkmk_pool():
+    """Apre alcune connessioni keep-alive verso Checkmk con richieste leggere."""
+    api_url = get_api_url(get_checkmk_config())
+    session = get_checkmk_session()
+    responses = await asyncio.gather(*[
+        checkmk_limiter.request(session, "GET", f"{api_url}/version", timeout=10.0)
+        for _ in range(POOL_WARM_CONNECTIONS)
+    ])
+    for resp in responses:
+        resp.raise_for_status()
+
+
+async def warm_host_inventory():
+    await host_inventory.get_map(force=True)
+
+
+async def warm_jwks():
+    await get_jwks()
+
+
+async def warm_athena_filters():
+    # Le due sorgenti sono indipendenti: un errore SAP non blocca CloudConnexa
+    results = await asyncio.gather(load_filter_options(force=True), load_sap_filter_options(force=True), return_exceptions=True)
+    errors = [f"{type(r).__name__}: {r}" for r in results if isinstance(r, Exception)]
+    if errors:
+        raise RuntimeError("; ".join(errors))
+
+
+WARMUP_TASKS = {
+    "checkmk_pool": warm_checkmk_pool,
+    "host_inventory": warm_host_inventory,
+    "cognito_jwks": warm_jwks,
+    "athena_filters": warm_athena_filters,
+}
+
+# Senza questi l'istanza risponderebbe "a freddo": la readiness li richiede riusciti.
+# JWKS e filtri Athena vengono comunque caricati alla prima richiesta.
+CRITICAL_TASKS = ("checkmk_pool", "host_inventory")
+
+
+class Warmup:
+    """Esegue i task di warm-up e ne tiene lo stato per la readiness."""
+
+    def __init__(self, tasks, critical=CRITICAL_TASKS):
+        self.tasks = tasks
+        self.critical = [name for name in critical if name in tasks]
+        self.state: Dict[str, Dict[str, Any]] = {
+            name: {"status": "pending", "duration": None, "error": None} for name in tasks
+        }
+        self.started_at: Optional[float] = None
+        self.completed_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run_one(self, name, func):
+        self.state[name]["status"] = "running"
+        start_time = time.monotonic()
+        try:
+            await func()
+            self.state[name]["status"] = "ok"
+            self.state[name]["error"] = None
+            logger.info(f"[Warmup] {name} ready in {time.monotonic() - start_time:.2f}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.state[name]["status"] = "failed"
+            self.state[name]["error"] = f"{type(e).__name__}: {str(e)}"
+            logger.error(f"[Warmup] {name} failed: {self.state[name]['error']}")
+        finally:
+            self.state[name]["duration"] = round(time.monotonic() - start_time, 3)
+
+    async def _run(self):
+        self.started_at = time.time()
+        await asyncio.gather(*[self._run_one(name, func) for name, func in self.tasks.items()])
+        self.completed_at = time.time()
+        failed = [name for name, st in self.state.items() if st["status"] == "failed"]
+        logger.info(f"[Warmup] Completed in {self.completed_at - self.started_at:.2f}s (failed: {failed or 'none'})")
+        # Finché un task critico è fallito l'istanza resta non pronta: lo ritentiamo
+        while self.failed_critical():
+            await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+            retry = self.failed_critical()
+            logger.info(f"[Warmup] Retrying critical tasks: {', '.join(retry)}")
+            await asyncio.gather(*[self._run_one(name, self.tasks[name]) for name in retry])
+
+    def start(self):
+        if self._task is None:
+            logger.info(f"[Warmup] Starting background warm-up: {', '.join(self.tasks)}")
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def failed_critical(self):
+        return [name for name in self.critical if self.state[name]["status"] != "ok"]
+
+    @property
+    def is_ready(self) -> bool:
+        return self.completed_at is not None and not self.failed_critical()
+
+    def snapshot(self) -> Dict[str, Any]:
+        def as_iso(ts):
+            return datetime.fromtimestamp(ts).isoformat() if ts else None
+
+        return {
+            "ready": self.is_ready,
+            "started_at": as_iso(self.started_at),
+            "completed_at": as_iso(self.completed_at),
+            "critical": self.critical,
+            "tasks": self.state,
+        }
+
+
+warmup = Warmup(WARMUP_TASKS)
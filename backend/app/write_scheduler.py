@@ -0,0 +1,227 @@
+"""
+Scheduler condiviso per le scritture verso Checkmk (schedule e delete).
+
+Ogni utente ha la sua coda di job; un pool globale di worker preleva gli
+item con deficit round-robin tra gli utenti. Così la richiesta da 3 host di
+un operatore non resta in coda dietro un /schedule da 50k item di un altro,
+e il job grande continua comunque a usare tutta la capacità libera.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Callable, Awaitable, Dict, Iterator, Any, Optional
+
+from .deadline import current_deadline, reset_deadline, set_deadline
+from .shared_cache import per_worker
+
+logger = logging.getLogger("checkmk_api")
+
+# --- CONFIGURAZIONE ---
+# Totale dell'istanza, ripartito tra i worker uvicorn
+WRITE_SCHEDULER_WORKERS = per_worker(int(os.getenv("WRITE_SCHEDULER_WORKERS", os.getenv("CHECKMK_WRITE_MAX_IN_FLIGHT", "10"))))
+WRITE_SCHEDULER_QUANTUM = float(os.getenv("WRITE_SCHEDULER_QUANTUM", "1"))
+# Pesi per utente, es. "alice:2,batch-user:0.5" (default 1)
+WRITE_SCHEDULER_WEIGHTS = {
+    user.strip(): float(weight)
+    for user, _, weight in (item.partition(":") for item in os.getenv("WRITE_SCHEDULER_WEIGHTS", "").split(",") if item.strip())
+}
+
+WorkItem = Callable[[], Awaitable[Any]]
+
+
+class WriteJob:
+    """Un insieme di item di scrittura inviati da un utente in una richiesta."""
+
+    def __init__(self, user: str, items: Iterator[WorkItem], max_in_flight: int, delay: float):
+        self.user = user
+        self.items = items
+        self.max_in_flight = max(1, max_in_flight)
+        self.delay = delay
+        self.in_flight = 0        # slot occupati (incluso l'eventuale delay dopo l'item)
+        self.running = 0          # item effettivamente in esecuzione
+        self.served = 0
+        self.exhausted = False
+        self.cancelled = False
+        self.submitted_at = time.monotonic()
+        self.done: Optional[asyncio.Future] = None
+        # Deadline della richiesta che ha inviato il job (i worker girano in un altro contesto)
+        self.deadline = current_deadline()
+
+    def eligible(self) -> bool:
+        if self.deadline is not None and self.deadline.expired():
+            self.cancelled = True
+        return not self.exhausted and not self.cancelled and self.in_flight < self.max_in_flight
+
+    def maybe_finish(self):
+        if (self.exhausted or self.cancelled) and self.running == 0 and not self.done.done():
+            self.done.set_result(self.served)
+
+
+class WriteScheduler:
+    def __init__(self, workers: int, quantum: float, weights: Dict[str, float]):
+        self.workers = workers
+        self.quantum = quantum
+        self.weights = weights
+        self.queues: Dict[str, deque] = {}
+        self.active = deque()               # utenti con job in coda, in ordine di servizio
+        self.deficit: Dict[str, float] = {}
+        self.served_by_user: Dict[str, int] = {}
+        self._wakeup: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks = []
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Primo avvio, oppure un nuovo event loop (es. riavvio dell'app nei test):
+            # Condition e worker del loop precedente non sono più utilizzabili
+            self._wakeup = asyncio.Condition()
+            self._tasks = []
+            self._loop = loop
+        if not self._tasks:
+            logger.info(f"[WriteScheduler] Starting {self.workers} workers")
+            self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def _notify(self):
+        async with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _drop_user_if_idle(self, user: str):
+        if not self.queues.get(user):
+            self.queues.pop(user, None)
+            self.deficit.pop(user, None)
+            if user in self.active:
+                self.active.remove(user)
+
+    def _next_item(self):
+        """Deficit round-robin: ogni visita accredita quantum*peso, ogni item costa 1."""
+        skipped = 0
+        while self.active and skipped < len(self.active):
+            user = self.active[0]
+            jobs = self.queues[user]
+            # Rimuove dalla testa i job che non hanno più item da distribuire
+            while jobs and (jobs[0].exhausted or jobs[0].cancelled):
+                jobs.popleft().maybe_finish()
+            if not jobs:
+                self._drop_user_if_idle(user)
+                skipped = 0
+                continue
+            job = next((j for j in jobs if j.eligible()), None)
+            if job is None:
+                # Tutti i job dell'utente sono al loro limite di concorrenza
+                self.active.rotate(-1)
+                skipped += 1
+                continue
+            if self.deficit[user] < 1:
+                self.deficit[user] += self.quantum * self.weights.get(user, 1.0)
+                if self.deficit[user] < 1:
+                    self.active.rotate(-1)
+                    continue
+            try:
+                item = next(job.items, None)
+            except Exception as e:
+                # Errore nel generatore degli item: il job termina con l'eccezione
+                job.exhausted = True
+                if not job.done.done():
+                    job.done.set_exception(e)
+                continue
+            if item is None:
+                job.exhausted = True
+                job.maybe_finish()
+                continue
+            self.deficit[user] -= 1
+            if self.deficit[user] < 1:
+                self.active.rotate(-1)
+            return job, item
+        return None
+
+    async def _worker(self, worker_id: int):
+        while True:
+            async with self._wakeup:
+                picked = self._next_item()
+                while picked is None:
+                    await self._wakeup.wait()
+                    picked = self._next_item()
+            job, item = picked
+            job.in_flight += 1
+            job.running += 1
+            token = set_deadline(job.deadline)
+            try:
+                await item()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[WriteScheduler] Item of {job.user} failed: {type(e).__name__} - {e}")
+            finally:
+                reset_deadline(token)
+                job.running -= 1
+                job.served += 1
+                self.served_by_user[job.user] = self.served_by_user.get(job.user, 0) + 1
+                job.maybe_finish()
+                if job.delay > 0 and not job.exhausted:
+                    # Lo slot del job resta occupato per il delay, il worker no
+                    asyncio.get_running_loop().call_later(job.delay, self._release_slot, job)
+                else:
+                    job.in_flight -= 1
+            await self._notify()
+
+    def _release_slot(self, job: WriteJob):
+        job.in_flight -= 1
+        asyncio.ensure_future(self._notify())
+
+    async def run(self, user: str, items: Iterator[WorkItem], max_in_flight: Optional[int] = None,
+                  delay: float = 0.0) -> int:
+        """Accoda gli item dell'utente e attende che siano stati eseguiti tutti."""
+        self._ensure_started()
+        job = WriteJob(user, items, max_in_flight or self.workers, delay)
+        job.done = asyncio.get_running_loop().create_future()
+        async with self._wakeup:
+            if user not in self.queues:
+                self.queues[user] = deque()
+                self.deficit[user] = 0.0
+                self.active.append(user)
+            self.queues[user].append(job)
+            self._wakeup.notify_all()
+        try:
+            served = await job.done
+        except asyncio.CancelledError:
+            # La richiesta è stata abbandonata: non distribuiamo altri item del job
+            job.cancelled = True
+            logger.warning(f"[WriteScheduler] Job of {user} cancelled after {job.served} items")
+            raise
+        logger.info(f"[WriteScheduler] Job of {user} completed: {served} items in {time.monotonic() - job.submitted_at:.2f}s")
+        return served
+
+    async def stop(self):
+        if self._loop is not asyncio.get_running_loop():
+            self._tasks = []
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "quantum": self.quantum,
+            "users": {
+                user: {
+                    "queued_jobs": len(jobs),
+                    "in_flight": sum(j.running for j in jobs),
+                    "deficit": round(self.deficit.get(user, 0.0), 3),
+                }
+                for user, jobs in self.queues.items()
+            },
+            "served_by_user": self.served_by_user,
+        }
+
+
+# Scheduler condiviso da /schedule e dalle rotte di delete
+write_scheduler = WriteScheduler(WRITE_SCHEDULER_WORKERS, WRITE_SCHEDULER_QUANTUM, WRITE_SCHEDULER_WEIGHTS)
@@ -0,0 +1,78 @@
+"""
+Prova del connettore livestatus contro il server finto (nessun Checkmk necessario).
+
+Avvio:  python test_livestatus.py   (dalla cartella backend)
+"""
+
+import asyncio
+
+from app.livestatus import LivestatusClient, LivestatusError
+from app.livestatus_fake import FakeLivestatusServer
+
+
+async def run_checks():
+    server = FakeLivestatusServer()
+    port = await server.start()
+    client = LivestatusClient("127.0.0.1", port, timeout=5.0, pool_size=2)
+    try:
+        print("Mappa host...")
+        host_map = await client.get_host_map()
+        print(f"  {host_map}")
+        assert host_map["srv-a1"] == "/clienteA"
+        assert host_map["srv-b1"] == "/clienteB/prod"
+        assert host_map["localhost"] == "/"
+
+        print("Downtime per host e per host group...")
+        by_host = await client.get_downtimes(hosts=["srv-a1"])
+        assert [d["id"] for d in by_host] == [1]
+        by_group = await client.get_downtimes(host_groups=["clienteA", "clienteB"])
+        assert sorted(d["id"] for d in by_group) == [1, 2]
+        print(f"  {len(by_host)} per host, {len(by_group)} per host group")
+
+        print("Connessione riutilizzata chiusa lato server...")
+        assert client.stats()["idle_connections"] == 1
+        server.drop_connections()
+        await asyncio.sleep(0.05)
+        downtimes = await client.get_downtimes(hosts=["srv-b1"])
+        assert [d["id"] for d in downtimes] == [2]
+        assert client.errors == 0
+        print(f"  ok, query riuscita su una nuova connessione ({server.queries} query al server)")
+    finally:
+        await client.close()
+        await server.stop()
+
+
+async def run_invalid_body_check():
+    # Risposta con header valido ma corpo non JSON: deve diventare LivestatusError
+    async def handle(reader, writer):
+        await reader.readuntil(b"\n\n")
+        body = b'[["srv-a1", "/wato/cl'
+        writer.write(f"200 {len(body):11d}\n".encode("ascii") + body)
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    client = LivestatusClient("127.0.0.1", server.sockets[0].getsockname()[1], timeout=5.0)
+    try:
+        print("Corpo della risposta troncato...")
+        try:
+            await client.get_host_map()
+        except LivestatusError as e:
+            print(f"  LivestatusError: {e}")
+        else:
+            raise AssertionError("LivestatusError attesa")
+        assert client.errors == 1
+    finally:
+        await client.close()
+        server.close()
+        await server.wait_closed()
+
+
+def test_livestatus_against_fake_server():
+    asyncio.run(run_checks())
+    asyncio.run(run_invalid_body_check())
+
+
+if __name__ == "__main__":
+    test_livestatus_against_fake_server()
+    print("\n\n=== Test completato ===")
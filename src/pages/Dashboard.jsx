@@ -65,8 +65,13 @@ const Dashboard = () => {
     // Chiamata 2: per Clienti Totali (da /clients)
     const { data: clientsData, loading: clientsLoading, error: clientsError } = useApi('clients');
 
+    // Chiamata 3: aggregati per cliente calcolati dal backend (da /clients/tree)
+    const { data: treeData, loading: treeLoading, error: treeError } = useApi('clients/tree?depth=1');
+
     const totalHosts = statsData?.totalHosts;
     const totalClients = clientsData?.length;
+    const hostsInDowntime = treeData?.tree?.hosts_in_downtime;
+    const upcomingDowntimes = treeData?.tree?.upcoming_downtimes;
 
     return (
         <div className="dashboard-container">
@@ -94,6 +99,24 @@ const Dashboard = () => {
                     colorClass="bg-purple"
                 />
 
+                <StatCard
+                    title="Host in Downtime"
+                    value={hostsInDowntime}
+                    loading={treeLoading}
+                    error={treeError}
+                    icon="🛠️"
+                    colorClass="bg-yellow"
+                />
+
+                <StatCard
+                    title={`Downtime nelle prossime ${treeData?.upcoming_hours ?? 24}h`}
+                    value={upcomingDowntimes}
+                    loading={treeLoading}
+                    error={treeError}
+                    icon="📅"
+                    colorClass="bg-blue"
+                />
+
                 <QuickActions />
             </div>
         </div>
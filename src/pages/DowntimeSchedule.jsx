@@ -108,12 +108,11 @@ const DowntimeSchedule = () => {
                 throw new Error(result.detail || `Errore server: ${response.status}`);
             }
 
-            const errorsInResponses = result.responses.filter(r => r !== 'Done');
-            if (errorsInResponses.length > 0) {
-                const firstError = errorsInResponses[0];
-                setError(`Operazione completata con ${errorsInResponses.length} errori su ${result.responses.length} task. Primo errore: ${firstError}`);
+            if (result.failed > 0) {
+                const firstError = Object.values(result.failures_by_class)[0]?.example;
+                setError(`Operazione completata con ${result.failed} errori su ${result.total} task. Primo errore: ${firstError}`);
             } else {
-                setSuccess(`✓ Downtime programmato con successo per ${hostList.length} host! (${result.responses.length} slot totali creati)`);
+                setSuccess(`✓ Downtime programmato con successo per ${hostList.length} host! (${result.created} slot totali creati)`);
                 setSelectedClients([]);
                 setHostList([]);
                 setDurationValue(1);
@@ -24,7 +24,8 @@ const SapDashboard = () => {
     const [dumpTypesData, setDumpTypesData] = useState([]);
     const [clientIssuesData, setClientIssuesData] = useState([]);
     const [timelineData, setTimelineData] = useState([]);
-    const [issuesTableData, setIssuesTableData] = useState([]);
+    // Tabella issues in formato colonnare: { columns: [...], data: { colonna: [valori] } }
+    const [issuesTable, setIssuesTable] = useState({ columns: [], data: {} });
 
     // State UI
     const [loading, setLoading] = useState(true);
@@ -83,7 +84,7 @@ const SapDashboard = () => {
         setError(null);
 
         try {
-            const response = await fetch(`${API_BASE_URL}/sap/dashboard`, {
+            const response = await fetch(`${API_BASE_URL}/sap/dashboard?format=columnar`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
@@ -129,7 +130,7 @@ const SapDashboard = () => {
             setTimelineData(timeline);
 
             // Tabella issues
-            setIssuesTableData(data.issuesTable || []);
+            setIssuesTable(data.issuesTable || { columns: [], data: {} });
 
         } catch (err) {
             console.error('Errore caricamento dashboard:', err);
@@ -149,6 +150,9 @@ const SapDashboard = () => {
         setSelectedSids(options);
     };
 
+    const issueColumns = issuesTable.data || {};
+    const issueCount = (issueColumns.nomecliente || []).length;
+
     return (
         <div className="sap-dashboard">
             {/* Header */}
@@ -323,7 +327,7 @@ const SapDashboard = () => {
                     {/* Tabella Issues */}
                     <section className="table-section card">
                         <h3>📋 Dettaglio Problemi per Cliente/SID</h3>
-                        {issuesTableData.length > 0 ? (
+                        {issueCount > 0 ? (
                             <div className="table-wrapper">
                                 <table className="issues-table">
                                     <thead>
@@ -338,17 +342,19 @@ const SapDashboard = () => {
                                         </tr>
                                     </thead>
                                     <tbody>
-                                        {issuesTableData.map((row, index) => {
-                                            const total = (row.dumps || 0) + (row.failed_backups || 0) + (row.cancelled_jobs || 0);
+                                        {Array.from({ length: issueCount }, (_, index) => {
+                                            const dumps = issueColumns.dumps?.[index] || 0;
+                                            const failedBackups = issueColumns.failed_backups?.[index] || 0;
+                                            const cancelledJobs = issueColumns.cancelled_jobs?.[index] || 0;
                                             return (
                                                 <tr key={index}>
                                                     <td>{index + 1}</td>
-                                                    <td>{row.nomecliente}</td>
-                                                    <td><span className="sid-badge">{row.sid}</span></td>
-                                                    <td>{row.dumps || 0}</td>
-                                                    <td>{row.failed_backups || 0}</td>
-                                                    <td>{row.cancelled_jobs || 0}</td>
-                                                    <td><strong>{total}</strong></td>
+                                                    <td>{issueColumns.nomecliente[index]}</td>
+                                                    <td><span className="sid-badge">{issueColumns.sid?.[index]}</span></td>
+                                                    <td>{dumps}</td>
+                                                    <td>{failedBackups}</td>
+                                                    <td>{cancelledJobs}</td>
+                                                    <td><strong>{dumps + failedBackups + cancelledJobs}</strong></td>
                                                 </tr>
                                             );
                                         })}